@@ -0,0 +1,835 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the findflights hot paths.
+
+    python benchmark.py parser [--fixtures DIR] [--engines bs4,lxml]
+    python benchmark.py pairing [--size 1000]
+    python benchmark.py vectorized [--size 1000]
+    python benchmark.py records [--size 100000]
+    python benchmark.py scheduler [--searches 200] [--workers 5]
+    python benchmark.py history [--size 500000] [--days 10]
+    python benchmark.py e2e [--targets cli,collector] [--fetchers http,browser]
+    python benchmark.py startup [--runs 10] [--budget help=50]
+
+Without ``--fixtures`` a set of synthetic result pages shaped like the
+skiplagged markup is generated, so runs are reproducible offline. ``e2e``
+serves synthetic pages and api responses from stubsite.py and runs the
+real CLI and collector against it. ``startup`` times CLI start-up with
+``python -X importtime`` and fails when a command goes over its budget.
+"""
+
+import argparse
+import asyncio
+import compileall
+import datetime
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+import lib
+from retry import classify
+from stubsite import StubServer, add_fault_arguments, faults_from_args
+
+console = Console()
+
+AIRLINES = ["Alaska Airlines", "United", "Delta", "Southwest", "American", "JetBlue"]
+LAYOVERS = ["LAS", "PHX", "SEA", "DEN", "SLC", "PDX"]
+
+
+def synthetic_trip(rng, index, origin="LAX", destination="SFO", depart="2026-03-07"):
+    stops = rng.choice([0, 0, 0, 1, 2])
+    dep_h, dep_m = rng.randrange(5, 22), rng.choice([0, 15, 30, 45])
+    dur = rng.randrange(60, 400)
+    arr_total = dep_h * 60 + dep_m + dur
+    arr_h, arr_m = (arr_total // 60) % 24, arr_total % 60
+    airline = rng.choice(AIRLINES)
+    numbers = ", ".join(f"Flight {rng.randrange(100, 9999)}" for _ in range(stops + 1))
+    payload = json.dumps({"depart": depart, "key": f"{origin}{destination}{index}"})
+    layovers = "".join(
+        f"""
+          <div class="trip-path-point trip-path-point-airport-demp">
+            <span class="airport-code"> {rng.choice(LAYOVERS)} </span>
+            <span class="airport-name">Layover &amp; connection</span>
+          </div>"""
+        for _ in range(stops)
+    )
+    stops_text = "nonstop" if stops == 0 else f"{stops} stop{'s' if stops > 1 else ''}"
+
+    def clock(h, m):
+        return f"{(h % 12) or 12}:{m:02d}{'am' if h < 12 else 'pm'}"
+
+    return f"""
+    <div class="trip trip-{index}" id='{index}|{payload}'>
+      <div class="trip-path">
+        <div class="trip-path-point trip-path-point-first">
+          <div class="trip-path-point-time">{clock(dep_h, dep_m)}</div>
+          <span class="airport-code">{origin}</span>
+        </div>{layovers}
+        <div class="trip-path-duration">{dur // 60}h {dur % 60}m <span>|</span> {stops_text}</div>
+        <div class="trip-path-point trip-path-point-last">
+          <div class="trip-path-point-time"> {clock(arr_h, arr_m)} <!-- local --></div>
+          <span class="airport-code">{destination}</span>
+        </div>
+      </div>
+      <span class="trip-stops"><b>{stops_text}</b></span>
+      <span class="airlines" data-original-title="{numbers}">{airline}</span>
+      <div class="trip-cost"><span>$<b>{rng.randrange(59, 699)}</b></span><p>one way</p></div>
+    </div>"""
+
+
+def synthetic_page(trips, seed=0, origin="LAX", destination="SFO", depart="2026-03-07"):
+    rng = random.Random(seed)
+    body = "".join(synthetic_trip(rng, i, origin, destination, depart) for i in range(trips))
+    if not trips:
+        body = '<div class="trip-list-empty">No flights found</div>'
+    return f"""<!DOCTYPE html>
+<html><head><title>{origin} to {destination}</title><script>var trips = "<div class='trip'>";</script>
+<style>.trip {{ display: block; }}</style></head>
+<body><nav>skiplagged</nav><section class="trip-list-section">{body}
+</section><footer>&copy; skiplagged</footer></body></html>"""
+
+
+def synthetic_api(trips, seed=0, origin="LAX", destination="SFO", depart="2026-03-07"):
+    """A search api response (format v3) with ``trips`` one-way flights"""
+    rng = random.Random(seed)
+    airlines = {"AS": {"name": "Alaska Airlines"}, "UA": {"name": "United"}, "WN": {"name": "Southwest"}}
+    day = datetime.datetime.fromisoformat(depart)
+    flights, itineraries = {}, []
+    for i in range(trips):
+        departure = day + datetime.timedelta(minutes=rng.randrange(5 * 60, 22 * 60))
+        minutes = rng.randrange(60, 400)
+        flights[f"k{i}"] = {
+            "segments": [{
+                "airline": rng.choice(list(airlines)),
+                "flight_number": rng.randrange(100, 9999),
+                "departure": {"airport": origin, "time": departure.isoformat()},
+                "arrival": {
+                    "airport": destination,
+                    "time": (departure + datetime.timedelta(minutes=minutes)).isoformat(),
+                },
+            }],
+            "duration": minutes * 60,
+        }
+        itineraries.append({"flight": f"k{i}", "one_way_price": rng.randrange(59, 699) * 100})
+    return {"airlines": airlines, "flights": flights, "itineraries": {"outbound": itineraries}}
+
+
+def write_synthetic_fixtures(root, airports, dates, empty_fraction=0.1, seed=0):
+    """Api responses and results pages for every route and date, in the
+    layout stubsite.py serves"""
+    rng = random.Random(seed)
+    root = Path(root)
+    (root / "api").mkdir(parents=True, exist_ok=True)
+    (root / "pages").mkdir(parents=True, exist_ok=True)
+    for origin, destination in itertools.permutations(airports, 2):
+        for day in dates:
+            trips = 0 if rng.random() < empty_fraction else rng.randrange(10, 80)
+            name = f"{origin}-{destination}-{day.isoformat()}"
+            route = (trips, rng.randrange(1 << 30), origin, destination, day.isoformat())
+            (root / "api" / f"{name}.json").write_text(json.dumps(synthetic_api(*route)))
+            (root / "pages" / f"{name}.html").write_text(synthetic_page(*route), encoding="utf-8")
+
+
+def synthetic_flights(count, origins, destinations, dates, seed=0):
+    """Flight dicts shaped like parse_flights output"""
+    rng = random.Random(seed)
+    flights = []
+    for _ in range(count):
+        stops = rng.choice([0, 0, 0, 1, 2])
+        dep = rng.randrange(5 * 60, 22 * 60)
+        dur = rng.randrange(60, 400)
+        arr = (dep + dur) % 1440
+        flights.append({
+            "depart": rng.choice(dates).isoformat(),
+            "stops": "nonstop" if stops == 0 else f"{stops} stop{'s' if stops > 1 else ''}",
+            "airline": rng.choice(AIRLINES),
+            "flight_numbers": [str(rng.randrange(100, 9999))],
+            "dep_time": f"{dep // 60:02d}:{dep % 60:02d}",
+            "arr_time": f"{arr // 60:02d}:{arr % 60:02d}",
+            "intermediate_airports": rng.sample(LAYOVERS, stops),
+            "num_stops": stops,
+            "cost": rng.randrange(59, 699) * 100,
+            "duration": f"{dur // 60}h {dur % 60}m",
+            "from": rng.choice(origins),
+            "to": rng.choice(destinations),
+        })
+    return flights
+
+
+def load_pages(fixtures):
+    if fixtures:
+        paths = sorted(Path(fixtures).rglob("*.html"))
+        if not paths:
+            sys.exit(f"no .html fixtures under {fixtures}")
+        return [(p.name, p.read_text(encoding="utf-8")) for p in paths]
+    return [(f"synthetic-{n}", synthetic_page(n, seed=n)) for n in (10, 100, 500)]
+
+
+def _proc_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise OSError(f"{field} not in /proc/self/status")
+
+
+def peak_rss_kb(fn):
+    """Peak RSS growth in KiB while running ``fn``, or None where the peak
+    cannot be reset (only linux exposes /proc/self/clear_refs)"""
+    gc.collect()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # resets VmHWM to the current rss
+        before = _proc_status_kb("VmRSS")
+    except OSError:
+        return None
+    fn()
+    return _proc_status_kb("VmHWM") - before
+
+
+def _parse_peak_rss(engine, html):
+    lib.set_parser_engine(engine)  # import the engine before measuring
+    return peak_rss_kb(lambda: lib.parse_flights(html, "LAX", "SFO", engine=engine))
+
+
+def parse_peak_rss_kb(engine, html):
+    """Peak RSS growth of one parse, measured in a fresh process so memory
+    freed by earlier runs cannot hide it"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_parse_peak_rss, (engine, html))
+
+
+def pair_flights_product(outbound_list, inbound_list):
+    """The original cartesian-product pairing, kept as the reference"""
+    pairs = []
+    for o, i in itertools.product(outbound_list, inbound_list):
+        try:
+            o_date = datetime.datetime.strptime(o["depart"], "%Y-%m-%d").date()
+            i_date = datetime.datetime.strptime(i["depart"], "%Y-%m-%d").date()
+        except Exception:
+            continue
+        if o_date < i_date:
+            out_cost = o.get("cost", 0)
+            in_cost = i.get("cost", 0)
+            total_cost = out_cost + in_cost
+            out_dur = lib.parse_duration_str(o.get("duration", ""))
+            in_dur = lib.parse_duration_str(i.get("duration", ""))
+            total_dur = out_dur + in_dur
+            stay_min = lib.compute_stay_duration(o, i)
+            pair = {
+                "out_src": o.get("from", ""),
+                "out_dest": o.get("to", ""),
+                "in_src": i.get("from", ""),
+                "in_dest": i.get("to", ""),
+                "out_date": o.get("depart", ""),
+                "in_date": i.get("depart", ""),
+                "out_dep_time": o.get("dep_time", ""),
+                "out_arr_time": o.get("arr_time", ""),
+                "in_dep_time": i.get("dep_time", ""),
+                "in_arr_time": i.get("arr_time", ""),
+                "out_duration": o.get("duration", ""),
+                "in_duration": i.get("duration", ""),
+                "out_cost": out_cost,
+                "in_cost": in_cost,
+                "total_cost": total_cost,
+                "out_airline": o.get("airline", ""),
+                "in_airline": i.get("airline", ""),
+                "out_stops": o.get("stops", ""),
+                "in_stops": i.get("stops", ""),
+                "total_dur": total_dur,
+                "stay_dur": stay_min,
+            }
+            pairs.append(pair)
+    return pairs
+
+
+def as_json(records):
+    return json.dumps([r.to_dict() for r in records])
+
+
+def timed(fn, min_time):
+    runs = []
+    start = time.perf_counter()
+    while not runs or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return statistics.median(runs), len(runs)
+
+
+def bench_parser(args):
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    for engine in engines:
+        lib.set_parser_engine(engine)
+    pages = load_pages(args.fixtures)
+
+    table = Table(title="parse_flights engines")
+    for column in ("page", "engine", "trips", "median ms", "pages/s", "trips/s", "peak rss KiB", "identical"):
+        table.add_column(column, justify="left" if column in ("page", "engine") else "right")
+    for name, html in pages:
+        reference = as_json(lib.parse_flights(html, "LAX", "SFO", engine="bs4"))
+        for engine in engines:
+            flights = lib.parse_flights(html, "LAX", "SFO", engine=engine)
+            median, _ = timed(lambda: lib.parse_flights(html, "LAX", "SFO", engine=engine), args.min_time)
+            rss = parse_peak_rss_kb(engine, html) if args.memory else None
+            table.add_row(
+                name,
+                engine,
+                str(len(flights)),
+                f"{median * 1000:.2f}",
+                f"{1 / median:.1f}",
+                f"{len(flights) / median:.0f}",
+                str(rss) if rss is not None else "-",
+                "yes" if as_json(flights) == reference else "[red]NO[/red]",
+            )
+    console.print(table)
+
+
+def pairing_inputs(size, seed=0):
+    start = datetime.date(2026, 3, 6)
+    depart_dates = [start + datetime.timedelta(days=d) for d in range(3)]
+    return_dates = [start + datetime.timedelta(days=d) for d in range(1, 5)]
+    socal, norcal = ["LAX", "SNA", "BUR"], ["SFO", "OAK", "SJC"]
+    outbound = synthetic_flights(size, socal, norcal, depart_dates, seed)
+    inbound = synthetic_flights(size, norcal, socal, return_dates, seed + 1)
+    return outbound, inbound
+
+
+def pair_dicts(pairs):
+    return [p.to_dict() for p in pairs]
+
+
+def bench_pairing(args):
+    outbound, inbound = pairing_inputs(args.size)
+    out_f, in_f = lib.as_flights(outbound), lib.as_flights(inbound)
+    cases = [
+        ("product (reference)", lambda: pair_flights_product(outbound, inbound)),
+        ("indexed", lambda: lib.pair_flights(out_f, in_f)),
+        ("indexed, same airports", lambda: lib.pair_flights(out_f, in_f, same_airports=True)),
+        ("indexed + full sort, top 5", lambda: lib.sort_pairs(lib.pair_flights(out_f, in_f), "price")[:5]),
+        ("streaming top 5", lambda: lib.top_pairs(out_f, in_f, 5, "price")),
+    ]
+    reference = pair_flights_product(outbound, inbound)
+    top_reference = sorted(reference, key=lambda p: p["total_cost"])[:5]
+    table = Table(title=f"pair_flights, {args.size} x {args.size} flights")
+    for column in ("implementation", "pairs", "median s", "speedup", "matches reference"):
+        table.add_column(column, justify="left" if column == "implementation" else "right")
+    baseline = None
+    for name, fn in cases:
+        pairs = fn()
+        median, _ = timed(fn, args.min_time)
+        baseline = baseline or median
+        if name == "product (reference)":
+            matches = "-"
+        elif "top 5" in name:
+            matches = "yes" if pair_dicts(pairs) == top_reference else "[red]NO[/red]"
+        elif "same airports" in name:
+            matches = "-"
+        else:
+            matches = "yes" if pair_dicts(pairs) == reference else "[red]NO[/red]"
+        table.add_row(name, str(len(pairs)), f"{median:.3f}", f"{baseline / median:.1f}x", matches)
+    console.print(table)
+
+
+def bench_vectorized(args):
+    import columnar
+
+    outbound, inbound = pairing_inputs(args.size)
+    out_f, in_f = lib.as_flights(outbound), lib.as_flights(inbound)
+    out, inb = columnar._columns(out_f, in_f)
+    cases = [
+        ("pair_flights", lambda: lib.pair_flights(out_f, in_f)),
+        ("build columns", lambda: columnar._columns(out_f, in_f)),
+        ("score_pairs (arrays only)", lambda: columnar.score_pairs(out, inb)),
+        ("pair_flights_vectorized", lambda: columnar.pair_flights_vectorized(out_f, in_f)),
+        ("top_pairs, top 5", lambda: lib.top_pairs(out_f, in_f, 5, "total time")),
+        ("top_pairs_vectorized, top 5", lambda: columnar.top_pairs_vectorized(out_f, in_f, 5, "total time")),
+    ]
+    reference = pair_dicts(lib.pair_flights(out_f, in_f))
+    top_reference = pair_dicts(lib.top_pairs(out_f, in_f, 5, "total time"))
+    table = Table(title=f"vectorized pairing, {args.size} x {args.size} flights")
+    for column in ("implementation", "median s", "vs pair_flights", "matches"):
+        table.add_column(column, justify="left" if column == "implementation" else "right")
+    baseline = None
+    for name, fn in cases:
+        result = fn()
+        median, _ = timed(fn, args.min_time)
+        baseline = baseline or median
+        if name == "pair_flights_vectorized":
+            matches = "yes" if pair_dicts(result) == reference else "[red]NO[/red]"
+        elif name == "top_pairs_vectorized, top 5":
+            matches = "yes" if pair_dicts(result) == top_reference else "[red]NO[/red]"
+        elif name.startswith("score_pairs"):
+            totals = [p["total_cost"] for p in reference]
+            matches = "yes" if result.total_cost.tolist() == totals else "[red]NO[/red]"
+        else:
+            matches = "-"
+        table.add_row(name, f"{median:.4f}", f"{baseline / median:.1f}x", matches)
+    console.print(table)
+
+
+def bench_records(args):
+    flights = synthetic_flights(args.size, ["LAX", "SNA", "BUR"], ["SFO", "OAK", "SJC"], [datetime.date(2026, 3, 6)])
+    # round trip through json so every dict owns its values, as parsed ones do
+    lines = [json.dumps(f) for f in flights]
+    cases = [
+        ("flight dicts", lambda: [json.loads(line) for line in lines]),
+        ("Flight records", lambda: [lib.Flight.from_dict(json.loads(line)) for line in lines]),
+    ]
+    table = Table(title=f"{args.size} flights held in memory")
+    for column in ("representation", "python heap KiB", "bytes/flight"):
+        table.add_column(column, justify="left" if column == "representation" else "right")
+    for name, build in cases:
+        gc.collect()
+        tracemalloc.start()
+        kept = build()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        table.add_row(name, f"{size / 1024:.0f}", f"{size / len(kept):.0f}")
+        del kept
+    console.print(table)
+
+
+def search_latencies(count, slow_fraction, seed=0):
+    """Simulated search times: mostly quick pages with a tail of slow ones"""
+    rng = random.Random(seed)
+    return [
+        rng.uniform(0.2, 0.6) if rng.random() < slow_fraction else rng.uniform(0.02, 0.06)
+        for _ in range(count)
+    ]
+
+
+async def _batched(latencies, workers):
+    # the scheduling main.py and the collector used before iter_tasks:
+    # slices of ``workers`` searches, each waiting for its slowest member
+    for i in range(0, len(latencies), workers):
+        await asyncio.gather(
+            *(asyncio.sleep(t) for t in latencies[i:i + workers]), return_exceptions=True
+        )
+
+
+async def _windowed(latencies, workers):
+    async for _ in lib.iter_tasks(latencies, asyncio.sleep, workers=workers):
+        pass
+
+
+def bench_scheduler(args):
+    latencies = search_latencies(args.searches, args.slow_fraction)
+    ideal = sum(latencies) / args.workers
+    table = Table(title=f"{args.searches} simulated searches, {args.workers} workers, {args.slow_fraction:.0%} slow")
+    for column in ("scheduler", "wall s", "searches/s", "vs ideal"):
+        table.add_column(column, justify="left" if column == "scheduler" else "right")
+    for name, run in (("fixed batches", _batched), ("sliding window (iter_tasks)", _windowed)):
+        start = time.perf_counter()
+        asyncio.run(run(latencies, args.workers))
+        wall = time.perf_counter() - start
+        table.add_row(name, f"{wall:.2f}", f"{args.searches / wall:.1f}", f"{wall / ideal:.2f}x")
+    console.print(table)
+
+
+def jsonl_price_history(paths, origin, destination):
+    """Reference route query over raw collector files"""
+    cheapest = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                r = json.loads(line)
+                if r["from"] != origin or r["to"] != destination or r.get("cost") is None:
+                    continue
+                key = (r["log_date"][:10], r["depart"])
+                if key not in cheapest or r["cost"] < cheapest[key]:
+                    cheapest[key] = r["cost"]
+    return cheapest
+
+
+def bench_history(args):
+    import history
+
+    airports = ["SFO", "OAK", "SAN", "SJC", "SMF", "LAX", "SNA", "LGB", "BUR"]
+    dates = [datetime.date(2026, 3, 1) + datetime.timedelta(days=i) for i in range(90)]
+    per_day = args.size // args.days
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        paths = []
+        for day in range(args.days):
+            log_date = datetime.datetime(2026, 2, 1, 3) + datetime.timedelta(days=day)
+            flights = synthetic_flights(per_day, airports, airports, dates, seed=day)
+            path = tmp / f"flights_{log_date:%Y-%m-%d}.jsonl"
+            with open(path, "w") as f:
+                for flight in flights:
+                    if flight["from"] == flight["to"]:
+                        continue
+                    flight["log_date"] = log_date.isoformat()
+                    flight["search_date"] = flight["depart"]
+                    f.write(json.dumps(flight) + "\n")
+            paths.append(path)
+        root = tmp / "history"
+        start = time.perf_counter()
+        rows, _ = history.compact_jsonl(paths, root)
+        compact = time.perf_counter() - start
+
+        jsonl_bytes = sum(p.stat().st_size for p in paths)
+        parquet_bytes = sum(p.stat().st_size for p in root.rglob("*.parquet"))
+        expected = jsonl_price_history(paths, "SFO", "LAX")
+        got = {
+            (r["log_day"], r["depart"].isoformat()): r["cost_min"]
+            for r in history.price_history(root, "SFO", "LAX").to_pylist()
+        }
+        cases = [
+            ("jsonl scan", lambda: jsonl_price_history(paths, "SFO", "LAX")),
+            ("parquet route partitions", lambda: history.price_history(root, "SFO", "LAX")),
+        ]
+        table = Table(title=f"SFO->LAX price history over {rows} flights, {args.days} collection days")
+        for column in ("storage", "MiB on disk", "query s", "speedup"):
+            table.add_column(column, justify="left" if column == "storage" else "right")
+        baseline = None
+        for (name, fn), size in zip(cases, (jsonl_bytes, parquet_bytes)):
+            median, _ = timed(fn, args.min_time)
+            baseline = baseline or median
+            table.add_row(name, f"{size / 2**20:.1f}", f"{median:.4f}", f"{baseline / median:.0f}x")
+        console.print(table)
+        console.print(f"compaction took {compact:.1f}s; results match: {got == expected}")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def run_measured(command, cwd):
+    """Run ``command`` to completion; returns ``(wall seconds, peak rss
+    MiB or None, exit status, last line of stderr)``"""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=stderr)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # kilobytes on linux, bytes on macOS
+            peak = usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+        else:
+            proc.wait()
+            peak = None
+        wall = time.perf_counter() - start
+        stderr.seek(0)
+        lines = stderr.read().decode(errors="replace").strip().splitlines()
+    return wall, peak, proc.returncode, lines[-1] if lines else ""
+
+
+def e2e_cli(config, base_url, airports, dates, workdir):
+    """One search run of main.py; returns per-search ``(seconds, outcome)``"""
+    trace = Path(workdir) / "trace.json"
+    span = f"{dates[0]:%m/%d/%Y}-{dates[-1]:%m/%d/%Y}"
+    command = [
+        sys.executable, str(Path(__file__).with_name("main.py")),
+        "--fetcher", config["fetcher"], "--parser", config["parser"],
+        "--workers", str(config["workers"]), "--search-timeout", str(config["timeout"]),
+        "--base-url", base_url, "--no-cache", "--depart", span, "--return", span,
+        "--profile-out", str(trace),
+        airports[0], ",".join(airports[1:]),
+    ]
+    wall, peak, status, error = run_measured(command, workdir)
+    searches = []
+    if trace.exists():
+        events = json.loads(trace.read_text())["traceEvents"]
+        searches = [
+            (e["dur"] / 1e6, e["args"]["outcome"])
+            for e in events
+            if e.get("ph") == "X" and "outcome" in e.get("args", {})
+        ]
+    return wall, peak, status, error, searches
+
+
+def e2e_collector(config, base_url, airports, dates, workdir):
+    """One collection cycle of data_collection.py"""
+    results = Path(workdir) / "searches.json"
+    command = [
+        sys.executable, str(Path(__file__)), "_collector", json.dumps({
+            **config, "base_url": base_url, "airports": airports, "days": len(dates),
+            "results": str(results),
+        }),
+    ]
+    wall, peak, status, error = run_measured(command, workdir)
+    searches = json.loads(results.read_text()) if results.exists() else []
+    return wall, peak, status, error, searches
+
+
+def run_collector(args):
+    """Child of ``e2e``: run one collector cycle in the current directory
+    with the benchmark's settings and write each search's timing"""
+    config = json.loads(args.config)
+    import data_collection as dc
+
+    dc.AIRPORTS = config["airports"]
+    dc.DAYS_AHEAD = config["days"] + 1
+    dc.FETCHER = config["fetcher"]
+    dc.BASE_URL = config["base_url"]
+    dc.PARSER_ENGINE = config["parser"]
+    dc.MAX_WORKERS = config["workers"]
+    dc.SEARCH_TIMEOUT = config["timeout"]
+    # measure the collector, not our politeness towards the real site
+    dc.RATE_LIMIT_PER_MINUTE = 1_000_000
+    dc.ADAPTIVE_RATE_LIMIT = False
+    dc.SEARCH_ATTEMPTS = 1
+    dc.POPULATE_CACHE = False
+    dc.METRICS_FILE = None
+    searches = []
+    iter_tasks = dc.iter_tasks
+
+    async def timed_tasks(*a, **kw):
+        async for done in iter_tasks(*a, **kw):
+            searches.append((done.elapsed, classify(done.error, done.result)))
+            yield done
+
+    dc.iter_tasks = timed_tasks
+    lib.set_parser_engine(config["parser"])
+    asyncio.run(dc.collect_flight_data())
+    Path(config["results"]).write_text(json.dumps(searches))
+
+
+def bench_e2e(args):
+    airports = [a.strip().upper() for a in args.airports.split(",")]
+    today = datetime.date.today()
+    # the collector always searches the days after today
+    dates = [today + datetime.timedelta(days=i) for i in range(1, args.days + 1)]
+    targets = {"cli": e2e_cli, "collector": e2e_collector}
+    configs = []
+    for target in args.targets.split(","):
+        for fetcher in args.fetchers.split(","):
+            # the api backend never parses html, so one parser will do
+            parsers = args.parsers.split(",") if fetcher != "http" else args.parsers.split(",")[:1]
+            for parser in parsers:
+                for workers in args.workers.split(","):
+                    configs.append({
+                        "target": target, "fetcher": fetcher, "parser": parser,
+                        "workers": int(workers), "timeout": args.search_timeout,
+                    })
+
+    faults = faults_from_args(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = Path(args.fixtures) if args.fixtures else Path(tmp) / "fixtures"
+        if not args.fixtures:
+            write_synthetic_fixtures(fixtures, airports, dates, args.empty_fraction)
+        server = StubServer(fixtures, faults=faults)
+        server.start_in_thread()
+        table = Table(
+            title=f"{len(airports)} airports, {len(dates)} days, stub latency"
+            f" {args.latency * 1000:.0f}+{args.jitter * 1000:.0f}ms"
+        )
+        for column in (
+            "target", "fetcher", "parser", "workers", "searches", "failed",
+            "wall s", "searches/s", "p50 s", "p95 s", "peak MiB",
+        ):
+            table.add_column(column, justify="left" if column in ("target", "fetcher", "parser") else "right")
+        try:
+            for config in configs:
+                workdir = Path(tempfile.mkdtemp(dir=tmp))
+                wall, peak, status, error, searches = targets[config["target"]](
+                    config, server.base_url, airports, dates, workdir
+                )
+                row = [config["target"], config["fetcher"], config["parser"], str(config["workers"])]
+                if status != 0 or not searches:
+                    console.print(f"[red]{' '.join(row)} failed: {error or f'exit status {status}'}[/red]")
+                    table.add_row(*row, *["-"] * 7)
+                    continue
+                latencies = [seconds for seconds, _ in searches]
+                failed = sum(1 for _, outcome in searches if outcome not in ("found", "empty"))
+                if failed == len(searches):
+                    console.print(f"[yellow]{' '.join(row)}: every search failed, is the backend installed?[/yellow]")
+                table.add_row(
+                    *row,
+                    str(len(searches)),
+                    str(failed),
+                    f"{wall:.2f}",
+                    f"{len(searches) / wall:.1f}",
+                    f"{percentile(latencies, 0.5):.3f}",
+                    f"{percentile(latencies, 0.95):.3f}",
+                    f"{peak:.0f}" if peak is not None else "-",
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+    console.print(table)
+    console.print(f"stub responses: {server.stats}")
+    console.print("wall time includes interpreter start-up and, for the browser, launching chromium")
+
+
+# commands whose start-up is budgeted, and milliseconds of imports each may
+# spend; --help and bad arguments should import next to nothing, an offline
+# query reads sqlite synchronously and needs only rich to print the table.
+# rich.console alone takes 45-75ms, so an offline query stays above
+# "tens of ms" for as long as results are printed with rich
+STARTUP_BUDGETS = {"help": 50, "bad arguments": 50, "offline query": 175}
+HEAVY_MODULES = ("playwright", "bs4", "lxml", "soupsieve", "numpy", "pyarrow")
+# none of the budgeted commands searches, so none needs these either
+SEARCH_MODULES = ("asyncio", "rich.progress")
+
+
+def import_times(stderr):
+    """``{module: (self us, cumulative us, depth)}`` from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(own), int(cumulative), depth)
+    return modules
+
+
+def startup_commands(data_dir, day):
+    main_py = str(Path(__file__).with_name("main.py"))
+    query = ["LAX", "SFO", "--depart", f"{day:%m/%d/%Y}", "--return", f"{day:%m/%d/%Y}"]
+    return {
+        "help": [main_py, "--help"],
+        "bad arguments": [main_py, "LAX", "SFO", "--depart", "13/45", "--return", "3/9"],
+        "offline query": [main_py, *query, "--from-store", str(data_dir)],
+    }
+
+
+def bench_startup(args):
+    budgets = dict(STARTUP_BUDGETS)
+    for budget in args.budget:
+        name, _, ms = budget.rpartition("=")
+        if name not in budgets:
+            raise SystemExit(f"--budget: unknown command {name!r}, one of {', '.join(budgets)}")
+        budgets[name] = float(ms)
+    # measure imports, not compiling them
+    compileall.compile_dir(Path(__file__).parent, maxlevels=0, quiet=1)
+    day = datetime.date.today() + datetime.timedelta(days=30)
+    over = []
+    with tempfile.TemporaryDirectory() as tmp:
+        flights = synthetic_flights(200, ["LAX", "SFO"], ["SFO", "LAX"], [day])
+        with open(Path(tmp) / f"flights_{datetime.date.today()}.jsonl", "w") as f:
+            for flight in flights:
+                if flight["from"] != flight["to"]:
+                    record = {**flight, "search_date": flight["depart"], "log_date": "2000-01-01T00:00:00"}
+                    f.write(json.dumps(record) + "\n")
+
+        table = Table(title=f"start-up, median of {args.runs} runs")
+        for column in ("command", "wall ms", "imports ms", "budget ms", "slowest imports", "heavy"):
+            table.add_column(column, justify="right" if "ms" in column else "left")
+        for name, command in startup_commands(tmp, day).items():
+            # the first run indexes the store and warms the page cache
+            run_measured([sys.executable, *command], tmp)
+            walls = [run_measured([sys.executable, *command], tmp)[0] for _ in range(args.runs)]
+            imports = []
+            for _ in range(args.runs):
+                proc = subprocess.run(
+                    [sys.executable, "-X", "importtime", *command],
+                    cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                )
+                modules = import_times(proc.stderr)
+                imports.append(sum(own for own, _, _ in modules.values()) / 1000)
+            top = sorted(
+                ((cumulative, module) for module, (_, cumulative, depth) in modules.items() if depth == 0),
+                reverse=True,
+            )[:3]
+            heavy = sorted({m.split(".")[0] for m in modules if m.split(".")[0] in HEAVY_MODULES})
+            heavy += [m for m in SEARCH_MODULES if m in modules]
+            median = statistics.median(imports)
+            if median > budgets[name] or heavy:
+                over.append(name)
+            table.add_row(
+                name,
+                f"{statistics.median(walls) * 1000:.0f}",
+                f"[red]{median:.0f}[/red]" if median > budgets[name] else f"{median:.0f}",
+                f"{budgets[name]:.0f}",
+                ", ".join(f"{module} {cumulative / 1000:.0f}" for cumulative, module in top),
+                f"[red]{', '.join(heavy)}[/red]" if heavy else "",
+            )
+    console.print(table)
+    console.print("imports ms is the sum of -X importtime's self times; wall ms includes the interpreter")
+    if over:
+        console.print(f"[red]over budget: {', '.join(over)}[/red]")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="findflights micro-benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("parser", help="compare parse_flights engines")
+    p.add_argument("--fixtures", help="directory of saved result pages (*.html)")
+    p.add_argument("--engines", default="bs4,lxml", help="comma separated engines (default bs4,lxml)")
+    p.add_argument("--min-time", type=float, default=1.0, help="seconds to run each case (default 1)")
+    p.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak rss measurement")
+    p.set_defaults(func=bench_parser)
+
+    p = sub.add_parser("pairing", help="compare round-trip pairing implementations")
+    p.add_argument("--size", type=int, default=1000, help="flights each way (default 1000)")
+    p.add_argument("--min-time", type=float, default=1.0, help="seconds to run each case (default 1)")
+    p.set_defaults(func=bench_pairing)
+
+    p = sub.add_parser("vectorized", help="numpy pairing and scoring against the dict path")
+    p.add_argument("--size", type=int, default=1000, help="flights each way (default 1000)")
+    p.add_argument("--min-time", type=float, default=1.0, help="seconds to run each case (default 1)")
+    p.set_defaults(func=bench_vectorized)
+
+    p = sub.add_parser("records", help="memory of flight dicts against Flight records")
+    p.add_argument("--size", type=int, default=100_000, help="flights (default 100000)")
+    p.set_defaults(func=bench_records)
+
+    p = sub.add_parser("scheduler", help="fixed batches against the sliding-window iter_tasks")
+    p.add_argument("--searches", type=int, default=200, help="simulated searches (default 200)")
+    p.add_argument("--workers", type=int, default=5, help="concurrent searches (default 5)")
+    p.add_argument("--slow-fraction", type=float, default=0.2, help="share of slow searches (default 0.2)")
+    p.set_defaults(func=bench_scheduler)
+
+    p = sub.add_parser("history", help="route price history from jsonl against the parquet dataset")
+    p.add_argument("--size", type=int, default=500_000, help="collected flights (default 500000)")
+    p.add_argument("--days", type=int, default=10, help="collection days (default 10)")
+    p.add_argument("--min-time", type=float, default=1.0, help="seconds to run each case (default 1)")
+    p.set_defaults(func=bench_history)
+
+    p = sub.add_parser("e2e", help="the CLI and collector end to end against a local stub site")
+    p.add_argument("--targets", default="cli,collector", help="comma separated: cli, collector (default both)")
+    p.add_argument("--fetchers", default="http,browser", help="comma separated backends (default http,browser)")
+    p.add_argument("--parsers", default="bs4,lxml", help="comma separated engines, for the browser (default bs4,lxml)")
+    p.add_argument("--workers", default="5", help="comma separated concurrency levels (default 5)")
+    p.add_argument("--airports", default="LAX,SFO,OAK", help="airports to search between (default LAX,SFO,OAK)")
+    p.add_argument("--days", type=int, default=5, help="days ahead to search (default 5)")
+    p.add_argument("--fixtures", help="serve these fixtures instead of synthetic ones (dates must match)")
+    p.add_argument("--empty-fraction", type=float, default=0.1, help="share of empty routes (default 0.1)")
+    p.add_argument("--search-timeout", type=float, default=30, help="per-search timeout (default 30)")
+    # the stub's latency and fault options
+    add_fault_arguments(p)
+    p.set_defaults(func=bench_e2e, latency=0.05, jitter=0.05)
+
+    p = sub.add_parser("startup", help="CLI start-up time and imports, against a budget")
+    p.add_argument("--runs", type=int, default=10, help="runs of each command (default 10)")
+    p.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="COMMAND=MS",
+        help="import budget for a command, e.g. 'help=40' (defaults: "
+        + ", ".join(f"{name}={ms}" for name, ms in STARTUP_BUDGETS.items())
+        + ")",
+    )
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("_collector", help=argparse.SUPPRESS)
+    p.add_argument("config")
+    p.set_defaults(func=run_collector)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
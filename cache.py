@@ -0,0 +1,131 @@
+"""On-disk cache of parsed search results.
+
+Each entry holds the flights one backend returned for one
+(origin, destination, depart date) search. Entries older than the ttl
+are misses, and once the payloads outgrow ``max_bytes`` the least
+recently used entries are evicted. The store is a single SQLite file,
+so the collector can fill it and later CLI runs can read it.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from lib import Flight
+
+DEFAULT_TTL = 24 * 3600  # long enough to answer from last night's collection
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_cache_path():
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "findflights" / "searches.sqlite3"
+
+
+class SearchCache:
+    """TTL + LRU cache of flights keyed by (origin, destination, date, backend)"""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, clock=time.time):
+        self.path = Path(path) if path is not None else default_cache_path()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS searches (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                depart TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                flights TEXT NOT NULL,
+                PRIMARY KEY (origin, destination, depart, backend)
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS searches_lru ON searches (accessed_at)")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _key(origin, destination, depart_date, backend):
+        return (origin.upper(), destination.upper(), depart_date.isoformat(), backend)
+
+    def get(self, origin, destination, depart_date, backend):
+        """The cached flights, or None on a miss or an expired entry"""
+        key = self._key(origin, destination, depart_date, backend)
+        row = self.db.execute(
+            "SELECT stored_at, flights FROM searches"
+            " WHERE origin = ? AND destination = ? AND depart = ? AND backend = ?",
+            key,
+        ).fetchone()
+        now = self.clock()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        stored_at, payload = row
+        if self.ttl is not None and now - stored_at > self.ttl:
+            self.stats["misses"] += 1
+            self.stats["expired"] += 1
+            return None
+        self.db.execute(
+            "UPDATE searches SET accessed_at = ?"
+            " WHERE origin = ? AND destination = ? AND depart = ? AND backend = ?",
+            (now, *key),
+        )
+        self.db.commit()
+        self.stats["hits"] += 1
+        return [Flight.from_dict(d) for d in json.loads(payload)]
+
+    def put(self, origin, destination, depart_date, backend, flights):
+        payload = json.dumps([f.to_dict() for f in flights])
+        now = self.clock()
+        self.db.execute(
+            "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*self._key(origin, destination, depart_date, backend), now, now, len(payload), payload),
+        )
+        self.stats["stores"] += 1
+        self._evict()
+        self.db.commit()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        (total,) = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM searches").fetchone()
+        if total <= self.max_bytes:
+            return
+        # walk from the least recently used entry until enough is freed
+        doomed = []
+        for rowid, size in self.db.execute("SELECT rowid, size FROM searches ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((rowid,))
+            total -= size
+        self.db.executemany("DELETE FROM searches WHERE rowid = ?", doomed)
+        self.stats["evictions"] += len(doomed)
+
+    def purge_expired(self):
+        """Drop entries past the ttl, returning how many were removed"""
+        if self.ttl is None:
+            return 0
+        cursor = self.db.execute("DELETE FROM searches WHERE stored_at < ?", (self.clock() - self.ttl,))
+        self.db.commit()
+        return cursor.rowcount
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
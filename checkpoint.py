@@ -0,0 +1,119 @@
+"""Journal of finished searches so an interrupted collection can resume.
+
+The journal is a JSONL file. Its first line names the run (its log_date
+and output file), and each later line is a finished (src, dst, date)
+search plus the size the output file had once that search's flights were
+written. Entries are only appended after the flights are on disk. On
+resume, the output file is cut back to the last journaled size, which
+drops flights from searches that never made it into the journal, and
+the journaled searches are skipped. The output written before the run
+started is kept, so the run's own flights are those from ``start_offset``
+on.
+"""
+
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class CheckpointState:
+    """What an unfinished run's journal says"""
+
+    def __init__(self, log_date, output_file, done, offset, journal_size, start_offset=0):
+        self.log_date = log_date
+        self.output_file = output_file
+        self.done = done
+        self.offset = offset
+        self.start_offset = start_offset
+        self.journal_size = journal_size
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+        self._lock = threading.Lock()
+        self.entries = 0
+
+    def load(self):
+        """The unfinished run in the journal, or None"""
+        if not self.path.exists():
+            return None
+        done = set()
+        offset = 0
+        header = None
+        journal_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn final write
+                journal_size += len(line)
+                entry = json.loads(line)
+                if header is None:
+                    header = entry
+                    continue
+                done.add((entry["src"], entry["dst"], datetime.date.fromisoformat(entry["date"])))
+                offset = max(offset, entry["offset"])
+        if header is None:
+            return None
+        output_file = Path(header["output_file"])
+        start_offset = header.get("start_offset", 0)
+        if not done:
+            # nothing was journaled, so the run wrote nothing worth keeping
+            # past where it started
+            offset = start_offset
+        return CheckpointState(
+            datetime.datetime.fromisoformat(header["log_date"]),
+            output_file,
+            done,
+            offset,
+            journal_size,
+            start_offset,
+        )
+
+    def start(self, log_date, output_file):
+        """Begin a journal for a new run"""
+        output_file = Path(output_file)
+        start_offset = output_file.stat().st_size if output_file.exists() else 0
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._append({
+            "log_date": log_date.isoformat(),
+            "output_file": str(output_file),
+            "start_offset": start_offset,
+        })
+        self._file.flush()
+
+    def resume(self, state):
+        """Cut the output file back to the journaled size and keep appending
+        to the journal"""
+        output_file = state.output_file
+        if output_file.exists() and output_file.stat().st_size > state.offset:
+            os.truncate(output_file, state.offset)
+        # and the journal back to its last whole line
+        os.truncate(self.path, state.journal_size)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.entries = len(state.done)
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+
+    def mark(self, written):
+        """Record ``((src, dst, date), offset)`` searches as finished; this
+        is JsonlWriter's on_written hook"""
+        with self._lock:
+            for (src, dst, date), offset in written:
+                self._append({"src": src, "dst": dst, "date": date.isoformat(), "offset": offset})
+            self._file.flush()
+            self.entries += len(written)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """The run completed; nothing is left to resume"""
+        self.close()
+        self.path.unlink(missing_ok=True)
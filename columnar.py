@@ -0,0 +1,168 @@
+"""Columnar, NumPy-vectorized round-trip pairing.
+
+Flight records are held as parallel arrays (cost, departure/arrival minutes
+since the epoch, duration, stop count, interned airline and airport ids),
+and pair totals are computed by broadcasting one block of outbound legs
+against all inbound legs at a time. Results match ``flights.pair_flights`` and
+``flights.top_pairs``. Needs the optional numpy package.
+
+Only the array scoring is fast: ``score_pairs`` is ~30x the indexed
+pairing at 1000 x 1000 legs. Turning scored rows back into FlightPair
+records costs more than it saves, so ``pair_flights_vectorized`` is
+slower than ``flights.pair_flights`` and ``top_pairs_vectorized`` about
+10x slower than the heap in ``flights.top_pairs`` (``python benchmark.py
+vectorized``). The CLI therefore always pairs with the indexed path; this
+module is for bulk scoring over arrays, and for the benchmark.
+"""
+
+import datetime
+
+import numpy as np
+
+from flights import FlightPair, as_flights, sort_pairs
+
+# outbound rows per block are chosen so a block's pair matrix stays
+# around this many cells
+BLOCK_CELLS = 4_000_000
+MISSING = np.iinfo(np.int64).min
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+
+class Interner:
+    """Maps strings to small integer ids, shared by a pair of LegColumns"""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __call__(self, value):
+        id_ = self.ids.get(value)
+        if id_ is None:
+            id_ = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return id_
+
+
+class LegColumns:
+    """Dated Flight records as parallel arrays, one row per flight.
+
+    ``flights`` keeps the records so pairs can be turned back into
+    FlightPairs.
+    """
+
+    def __init__(self, flights, interner=None):
+        interner = interner or Interner()
+        self.interner = interner
+        self.flights = [f for f in as_flights(flights) if f.depart is not None]
+        flights = self.flights
+        n = len(flights)
+        days = [f.depart.toordinal() - EPOCH for f in flights]
+        self.cost = np.fromiter((f.cost or 0 for f in flights), np.int64, n)
+        self.date = np.array(days, np.int64)
+        self.dep = np.fromiter(
+            (d * 1440 + f.dep_min if f.dep_min is not None else MISSING for d, f in zip(days, flights)),
+            np.int64,
+            n,
+        )
+        self.arr = np.fromiter(
+            (d * 1440 + f.arr_min if f.arr_min is not None else MISSING for d, f in zip(days, flights)),
+            np.int64,
+            n,
+        )
+        self.duration = np.fromiter((f.duration_min for f in flights), np.int64, n)
+        self.stops = np.fromiter((f.num_stops for f in flights), np.int16, n)
+        self.airline = np.fromiter((interner(f.airline) for f in flights), np.int32, n)
+        self.src = np.fromiter((interner(f.origin) for f in flights), np.int32, n)
+        self.dst = np.fromiter((interner(f.destination) for f in flights), np.int32, n)
+
+    def __len__(self):
+        return len(self.flights)
+
+
+class PairArrays:
+    """Every valid (outbound, inbound) pair as rows into two LegColumns,
+    in cartesian product order, with their totals"""
+
+    def __init__(self, out_rows, in_rows, total_cost, total_dur, stay, stay_known):
+        self.out_rows = out_rows
+        self.in_rows = in_rows
+        self.total_cost = total_cost
+        self.total_dur = total_dur
+        self.stay = stay
+        self.stay_known = stay_known
+
+    def __len__(self):
+        return len(self.out_rows)
+
+
+def score_pairs(out, inb, same_airports=False):
+    """Broadcast outbound blocks against all inbound legs and score the
+    pairs whose return is on a later date"""
+    chunks = []
+    block = max(1, BLOCK_CELLS // max(1, len(inb)))
+    for start in range(0, len(out), block):
+        rows = slice(start, start + block)
+        valid = inb.date[None, :] > out.date[rows, None]
+        if same_airports:
+            valid &= inb.src[None, :] == out.dst[rows, None]
+            valid &= inb.dst[None, :] == out.src[rows, None]
+        o, i = np.nonzero(valid)
+        o += start
+        stay_known = (out.arr[o] != MISSING) & (inb.dep[i] != MISSING)
+        stay = np.where(stay_known, inb.dep[i] - out.arr[o], 0)
+        stay = np.where(stay < 0, stay + 1440, stay)
+        chunks.append((
+            o,
+            i,
+            out.cost[o] + inb.cost[i],
+            out.duration[o] + inb.duration[i],
+            stay,
+            stay_known,
+        ))
+    if not chunks:
+        empty = np.empty(0, np.int64)
+        return PairArrays(empty, empty, empty, empty, empty, np.empty(0, bool))
+    return PairArrays(*(np.concatenate(parts) for parts in zip(*chunks)))
+
+
+def _columns(outbound_list, inbound_list):
+    interner = Interner()
+    return LegColumns(outbound_list, interner), LegColumns(inbound_list, interner)
+
+
+def _to_pairs(out, inb, pairs, rows):
+    return [
+        FlightPair(out.flights[o], inb.flights[i])
+        for o, i in zip(pairs.out_rows[rows].tolist(), pairs.in_rows[rows].tolist())
+    ]
+
+
+def pair_flights_vectorized(outbound_list, inbound_list, same_airports=False):
+    """Same pairs as ``flights.pair_flights``, scored with NumPy"""
+    out, inb = _columns(outbound_list, inbound_list)
+    pairs = score_pairs(out, inb, same_airports)
+    return _to_pairs(out, inb, pairs, slice(None))
+
+
+def top_pairs_vectorized(outbound_list, inbound_list, k, sort_metric="price", same_airports=False):
+    """Same result as ``flights.top_pairs``: only the best ``k`` pairs become
+    FlightPairs"""
+    if sort_metric not in ("price", "total time"):
+        return sort_pairs(pair_flights_vectorized(outbound_list, inbound_list, same_airports), sort_metric)[:k]
+    out, inb = _columns(outbound_list, inbound_list)
+    pairs = score_pairs(out, inb, same_airports)
+    if k <= 0 or not len(pairs):
+        return []
+    if sort_metric == "price":
+        key = pairs.total_cost.astype(np.float64)
+    else:
+        key = np.where(pairs.stay_known, pairs.stay.astype(np.float64), np.inf)
+    if k < len(key):
+        # keep everything tied with the k-th key so the stable sort can
+        # break ties in product order
+        kth = np.partition(key, k - 1)[k - 1]
+        candidates = np.flatnonzero(key <= kth)
+    else:
+        candidates = np.arange(len(key))
+    order = candidates[np.argsort(key[candidates], kind="stable")][:k]
+    return _to_pairs(out, inb, pairs, order)
@@ -0,0 +1,280 @@
+"""SQLite work queue for sharding a collection run across processes.
+
+Every worker process opens the same queue database. The first one to
+arrive for a cycle creates a run and seeds it with the planned
+(src, dst, date) searches; later ones join it. Workers lease one search
+at a time. A lease that is not completed before it expires (its worker
+crashed or hung) goes back to the queue, and a search that fails
+``max_attempts`` times is given up on.
+
+Each worker writes its own shard file. The last worker to find the run
+drained merges the shards into the day's output file, keeping a
+search's flights only from the worker the queue credits with completing
+it, so searches done twice after a lease expired are not duplicated.
+
+The database has to be on a filesystem with working locks: one machine,
+or a shared disk that supports them.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class Run:
+    def __init__(self, id, log_date, created):
+        self.id = id
+        self.log_date = log_date
+        self.created = created
+
+
+class WorkQueue:
+    def __init__(self, path, lease_seconds=600, max_attempts=3, clock=time.time):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        # autocommit, with explicit BEGIN IMMEDIATE around read-modify-write
+        self.db = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        # the collector's writer thread completes searches too
+        self._lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                log_date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                merge_offset INTEGER,
+                merge_started REAL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                run_id INTEGER NOT NULL,
+                src TEXT NOT NULL,
+                dst TEXT NOT NULL,
+                date TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (run_id, src, dst, date)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (run_id, state, priority);
+            CREATE TABLE IF NOT EXISTS shards (
+                run_id INTEGER NOT NULL,
+                worker TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (run_id, worker)
+            );
+            """
+        )
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self):
+        return _Immediate(self.db, self._lock)
+
+    def open_run(self, log_date, max_age, plan):
+        """Join the newest unfinished run started within ``max_age``, or
+        start one seeded with ``plan()``'s (src, dst, date) list"""
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT id, log_date FROM runs WHERE status != 'done' ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                started = datetime.datetime.fromisoformat(row[1])
+                if log_date - started <= max_age:
+                    return Run(row[0], started, created=False)
+            run_id = db.execute(
+                "INSERT INTO runs (log_date, status) VALUES (?, 'open')", (log_date.isoformat(),)
+            ).lastrowid
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks (run_id, src, dst, date, priority, state)"
+                " VALUES (?, ?, ?, ?, ?, 'pending')",
+                [(run_id, src, dst, date.isoformat(), i) for i, (src, dst, date) in enumerate(plan())],
+            )
+            return Run(run_id, log_date, created=True)
+
+    def register_shard(self, run_id, worker, path):
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO shards VALUES (?, ?, ?)", (run_id, worker, str(path)))
+
+    def claim(self, run_id, worker):
+        """Lease the next search, or None if nothing is claimable now"""
+        now = self.clock()
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT src, dst, date FROM tasks WHERE run_id = ?"
+                " AND (state = 'pending' OR (state = 'leased' AND lease_until < ?))"
+                " ORDER BY priority LIMIT 1",
+                (run_id, now),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?"
+                " WHERE run_id = ? AND src = ? AND dst = ? AND date = ?",
+                (worker, now + self.lease_seconds, run_id, *row),
+            )
+        src, dst, date = row
+        return src, dst, datetime.date.fromisoformat(date)
+
+    def leases(self, run_id, worker):
+        """Claim searches one at a time until none are claimable"""
+        while True:
+            item = self.claim(run_id, worker)
+            if item is None:
+                return
+            yield item
+
+    def complete(self, run_id, worker, items):
+        """Credit ``worker`` with finished searches it still holds; a search
+        whose lease passed to another worker is not credited"""
+        with self._transaction() as db:
+            db.executemany(
+                "UPDATE tasks SET state = 'done', lease_until = NULL"
+                " WHERE run_id = ? AND src = ? AND dst = ? AND date = ?"
+                " AND worker = ? AND state = 'leased'",
+                [(run_id, src, dst, date.isoformat(), worker) for src, dst, date in items],
+            )
+
+    def fail(self, run_id, worker, item, error):
+        """Return a failed search to the queue, or give up after max_attempts"""
+        src, dst, date = item
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET attempts = attempts + 1, error = ?, lease_until = NULL,"
+                " state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END"
+                " WHERE run_id = ? AND src = ? AND dst = ? AND date = ?"
+                " AND worker = ? AND state = 'leased'",
+                (str(error), self.max_attempts, run_id, src, dst, date.isoformat(), worker),
+            )
+
+    def counts(self, run_id):
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT state, COUNT(*) FROM tasks WHERE run_id = ? GROUP BY state", (run_id,)
+            ).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def remaining(self, run_id):
+        counts = self.counts(run_id)
+        return counts["pending"] + counts["leased"]
+
+    def begin_merge(self, run_id, output_size):
+        """Claim the merge of a drained run. Returns the output file size to
+        merge from (cut the file back to it first), or None if another
+        worker is merging or the run is not drained"""
+        now = self.clock()
+        with self._transaction() as db:
+            status, offset, started = db.execute(
+                "SELECT status, merge_offset, merge_started FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            left = db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE run_id = ? AND state IN ('pending', 'leased')",
+                (run_id,),
+            ).fetchone()[0]
+            if left:
+                return None
+            if status == "open":
+                offset = output_size
+            elif status != "merging" or now - started < self.lease_seconds:
+                # done, or another worker is merging right now
+                return None
+            # else a merge that stalled past a lease: take it over
+            db.execute(
+                "UPDATE runs SET status = 'merging', merge_offset = ?, merge_started = ? WHERE id = ?",
+                (offset, now, run_id),
+            )
+        return offset
+
+    def credited(self, run_id):
+        """``{(src, dst, date iso): worker}`` for every completed search"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT src, dst, date, worker FROM tasks WHERE run_id = ? AND state = 'done'", (run_id,)
+            ).fetchall()
+        return {(src, dst, date): worker for src, dst, date, worker in rows}
+
+    def shards(self, run_id):
+        with self._lock:
+            return dict(self.db.execute("SELECT worker, path FROM shards WHERE run_id = ?", (run_id,)))
+
+    def finish_run(self, run_id):
+        with self._transaction() as db:
+            db.execute("UPDATE runs SET status = 'done' WHERE id = ?", (run_id,))
+
+
+class _Immediate:
+    """BEGIN IMMEDIATE ... COMMIT, so concurrent claims never race"""
+
+    def __init__(self, db, lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+
+
+def merge_shards(queue, run_id, output_file):
+    """Append the credited flights from every shard of a drained run to
+    ``output_file``; returns the number merged, or None if this worker
+    should not merge"""
+    output_file = Path(output_file)
+    size = output_file.stat().st_size if output_file.exists() else 0
+    offset = queue.begin_merge(run_id, size)
+    if offset is None:
+        return None
+    if size > offset:
+        # an earlier merge died part way through
+        os.truncate(output_file, offset)
+    credited = queue.credited(run_id)
+    merged = 0
+    with open(output_file, "a", encoding="utf-8") as out:
+        for worker, path in sorted(queue.shards(run_id).items()):
+            if not Path(path).exists():
+                continue
+            with open(path, encoding="utf-8") as shard:
+                for line in shard:
+                    if not line.endswith("\n"):
+                        break  # torn final write
+                    record = json.loads(line)
+                    # the searched route, which a nearby-airport flight's
+                    # from/to does not match; shards from before src/dst
+                    # were written fall back to from/to
+                    key = (
+                        record.get("src") or record.get("from"),
+                        record.get("dst") or record.get("to"),
+                        record.get("search_date"),
+                    )
+                    if credited.get(key) == worker:
+                        out.write(line)
+                        merged += 1
+    queue.finish_run(run_id)
+    for path in queue.shards(run_id).values():
+        Path(path).unlink(missing_ok=True)
+    return merged
+
@@ -0,0 +1,356 @@
+"""A long-running search server, and the client the CLI uses to reach it.
+
+``findflights serve`` keeps a backend open (warm browsers, pooled http
+connections, the search cache) and listens on a Unix domain socket.
+``findflights --daemon`` then hands its searches to the server instead of
+starting its own backend, and gets each one back as soon as it finishes.
+
+The protocol is one JSON object per line in each direction. A client may
+have many searches in flight on one connection; replies carry the id of
+the request they answer and arrive in whatever order searches finish:
+
+    -> {"id": 1, "search": ["LAX", "SFO", "2025-03-07"]}
+    <- {"id": 1, "flights": [{...}, ...]}
+    <- {"id": 2, "error": "...", "blocked": false, "timed_out": true}
+
+Identical searches in flight at the same time, from any client, share one
+fetch.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import signal
+import sys
+from pathlib import Path
+
+from cache import SearchCache
+from fetchers import FETCHERS, CachingFetcher, CoalescingFetcher, FetchError, Fetcher, create_fetcher
+from lib import (
+    PARSER_ENGINES,
+    SKIPLAGGED_URL,
+    Flight,
+    ParsePool,
+    console,
+    set_parse_pool,
+    set_parser_engine,
+)
+
+# a reply holds every flight for a route/date, far past asyncio's 64k default
+LINE_LIMIT = 1 << 24
+
+
+def default_socket_path():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime) / "findflights.sock"
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "findflights" / "daemon.sock"
+
+
+class DaemonUnavailable(Exception):
+    """Raised when no daemon is listening on the socket"""
+
+
+def _error_reply(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return {"error": "timed out", "timeout": True}
+    reply = {"error": str(error) or type(error).__name__}
+    if isinstance(error, FetchError):
+        reply.update(status=error.status, blocked=error.blocked, timed_out=error.timed_out)
+    return reply
+
+
+def _error_from_reply(reply):
+    if reply.get("timeout"):
+        return asyncio.TimeoutError()
+    return FetchError(
+        reply["error"],
+        status=reply.get("status"),
+        blocked=reply.get("blocked", False),
+        timed_out=reply.get("timed_out", False),
+    )
+
+
+class FlightDaemon:
+    """Answers searches from any number of clients with one shared fetcher"""
+
+    def __init__(self, fetcher, path=None):
+        self.fetcher = fetcher
+        self.path = Path(path or default_socket_path())
+        self.stats = {"clients": 0, "searches": 0, "errors": 0}
+        self._server = None
+
+    async def start(self):
+        if await _listening(self.path):
+            raise RuntimeError(f"a daemon is already serving on {self.path}")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # left behind by a daemon that did not shut down cleanly
+        self.path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(self._handle, self.path, limit=LINE_LIMIT)
+        os.chmod(self.path, 0o600)
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            self.path.unlink(missing_ok=True)
+
+    async def _handle(self, reader, writer):
+        self.stats["clients"] += 1
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def reply(message):
+            async with lock:
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+
+        async def answer(request_id, origin, destination, depart_date):
+            try:
+                flights = await self.fetcher.search(origin, destination, depart_date)
+            except Exception as e:
+                self.stats["errors"] += 1
+                await reply({"id": request_id, **_error_reply(e)})
+            else:
+                await reply({"id": request_id, "flights": [f.to_dict() for f in flights]})
+
+        try:
+            while line := await reader.readline():
+                request = None
+                try:
+                    request = json.loads(line)
+                    origin, destination, day = request["search"]
+                    search = (request["id"], origin, destination, datetime.date.fromisoformat(day))
+                except (ValueError, KeyError, TypeError) as e:
+                    request_id = request.get("id") if isinstance(request, dict) else None
+                    await reply({"id": request_id, "error": f"bad request: {e}"})
+                    continue
+                self.stats["searches"] += 1
+                task = asyncio.create_task(answer(*search))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionError, ValueError):
+            # a client that hung up, or sent a line past LINE_LIMIT
+            pass
+        finally:
+            # a shared fetch carries on for the cache and other clients
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+
+async def _listening(path):
+    try:
+        _, writer = await asyncio.open_unix_connection(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    writer.close()
+    return True
+
+
+class DaemonFetcher(Fetcher):
+    """Sends searches to a running daemon over its Unix socket"""
+
+    name = "daemon"
+
+    def __init__(self, path=None):
+        self.path = Path(path or default_socket_path())
+        self._reader = self._writer = self._reads = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+
+    async def start(self):
+        try:
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                self.path, limit=LINE_LIMIT
+            )
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise DaemonUnavailable(
+                f"no daemon on {self.path}; start one with `findflights serve`"
+            ) from None
+        self._reads = asyncio.create_task(self._read_replies())
+        return self
+
+    async def close(self):
+        if self._reads is not None:
+            self._reads.cancel()
+            self._reads = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def search(self, origin, destination, depart_date):
+        if self._reads is None or self._reads.done():
+            raise FetchError("not connected to the daemon")
+        request_id = next(self._ids)
+        reply = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        try:
+            message = {"id": request_id, "search": [origin, destination, depart_date.isoformat()]}
+            self._writer.write(json.dumps(message).encode() + b"\n")
+            await self._writer.drain()
+            return await reply
+        finally:
+            # a search the caller timed out on may still be answered later
+            self._pending.pop(request_id, None)
+
+    async def _read_replies(self):
+        try:
+            while line := await self._reader.readline():
+                message = json.loads(line)
+                reply = self._pending.get(message.get("id"))
+                if reply is None or reply.done():
+                    continue
+                if "error" in message:
+                    reply.set_exception(_error_from_reply(message))
+                else:
+                    reply.set_result([Flight.from_dict(d) for d in message["flights"]])
+        except (ConnectionError, ValueError):
+            pass
+        for reply in self._pending.values():
+            if not reply.done():
+                reply.set_exception(FetchError("the daemon closed the connection"))
+
+
+async def serve(args):
+    try:
+        set_parser_engine(args.parser)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        sys.exit(1)
+    browsers = max(1, min(args.browsers, args.workers))
+    fetcher = create_fetcher(
+        args.fetcher,
+        base_url=args.base_url,
+        connections=args.workers,
+        size=browsers,
+        pages_per_browser=-(-args.workers // browsers),
+        max_navigations=args.max_navigations,
+        block_assets=args.block_assets,
+    )
+    cache = None
+    if args.cache:
+        cache = SearchCache(args.cache_path, ttl=args.cache_ttl * 3600)
+        fetcher = CachingFetcher(fetcher, cache)
+    fetcher = CoalescingFetcher(fetcher, timeout=args.search_timeout)
+    parse_pool = (
+        ParsePool(args.parse_workers, kind=args.parse_pool) if args.parse_workers > 0 else None
+    )
+    set_parse_pool(parse_pool)
+    daemon = FlightDaemon(fetcher, args.socket)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        async with fetcher:
+            try:
+                await daemon.start()
+            except RuntimeError as e:
+                console.print(f"[red]{e}[/red]")
+                sys.exit(1)
+            if args.warm:
+                # searches that arrive meanwhile wait for the pool
+                try:
+                    await fetcher.warm()
+                except Exception as e:
+                    console.print(f"[yellow]could not start browsers up front: {e}[/yellow]")
+            console.print(f"serving {fetcher.name} searches on {daemon.path}")
+            try:
+                await stop.wait()
+            finally:
+                await daemon.close()
+                stats = {**daemon.stats, "shared": fetcher.stats["coalesced"]}
+                if cache is not None:
+                    stats["cache hits"] = cache.stats["hits"]
+                console.print(", ".join(f"{name}: {value}" for name, value in stats.items()))
+    finally:
+        set_parse_pool(None)
+        if parse_pool is not None:
+            parse_pool.close()
+        if cache is not None:
+            cache.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="findflights serve",
+        description="keep a search backend warm and answer `findflights --daemon` over a unix socket",
+    )
+    parser.add_argument(
+        "--socket",
+        default=None,
+        help="socket to listen on (default $XDG_RUNTIME_DIR/findflights.sock)",
+    )
+    parser.add_argument(
+        "--fetcher",
+        choices=FETCHERS,
+        default="auto",
+        help="search backend (default auto)",
+    )
+    parser.add_argument("--base-url", default=SKIPLAGGED_URL, help="site to search")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=5,
+        help="searches the backend runs at once, across all clients (default 5)",
+    )
+    parser.add_argument(
+        "--browsers", type=int, default=2, help="number of browsers in the pool (default 2)"
+    )
+    parser.add_argument(
+        "--max-navigations",
+        type=int,
+        default=50,
+        help="recycle a browser after this many searches (default 50, 0 = never)",
+    )
+    parser.add_argument(
+        "--no-block-assets",
+        dest="block_assets",
+        action="store_false",
+        help="let the browser load images, fonts and trackers",
+    )
+    parser.add_argument(
+        "--no-warm",
+        dest="warm",
+        action="store_false",
+        help="start browsers on the first search that needs them, not at startup",
+    )
+    parser.add_argument(
+        "--search-timeout",
+        type=float,
+        default=90,
+        help="give up on a search after this many seconds (default 90)",
+    )
+    parser.add_argument(
+        "--parser", choices=sorted(PARSER_ENGINES), default="bs4", help="html parser engine"
+    )
+    parser.add_argument(
+        "--parse-workers", type=int, default=2, help="parse workers, 0 parses inline (default 2)"
+    )
+    parser.add_argument(
+        "--parse-pool", choices=["auto", "process", "thread"], default="auto", help="parse worker type"
+    )
+    parser.add_argument(
+        "--no-cache", dest="cache", action="store_false", help="do not use the search cache"
+    )
+    parser.add_argument(
+        "--cache-ttl", type=float, default=24, help="hours a cached search stays fresh (default 24)"
+    )
+    parser.add_argument("--cache-path", default=None, help="cache database")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
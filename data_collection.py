@@ -6,31 +6,78 @@ import datetime
 import json
 import os
 import signal
+import socket
+import subprocess
 import sys
-import time
 from pathlib import Path
 
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeRemainingColumn
 
+from dates import parse_date_range
 from lib import (
-    parse_date_range,
-    create_browser,
-    search_flights,
-    run_tasks
+    iter_tasks,
+    set_parser_engine,
+    set_parse_pool,
+    ParsePool,
 )
+from fetchers import CachingFetcher, create_fetcher
+from ratelimit import RateLimiter
+from metrics import (
+    CIRCUIT_TRIPS,
+    RATE_LIMIT_WAIT_SECONDS,
+    REGISTRY,
+    RETRIES,
+    SEARCHES,
+    SEARCH_SECONDS,
+    MetricsServer,
+)
+from retry import BLOCKED, OUTCOMES, TIMEOUT, CircuitBreaker, CircuitOpen, RetryPolicy, classify
+from writers import JsonlWriter, StatusFile
+from planner import CollectionPlanner
+from checkpoint import Checkpoint
+from coordinator import WorkQueue, merge_shards
+from cache import SearchCache
+from store import search_marker
 
 # Configuration
 DATA_DIR = Path("flight_data")
 AIRPORTS = ["SFO", "OAK", "SAN", "SJC", "SMF", "LAX", "SNA", "LGB", "BUR"]
 DAYS_AHEAD = 90  # Look 90 days ahead
 MAX_WORKERS = 5  # Maximum concurrent tasks
+SEARCH_TIMEOUT = 120  # Give up on a single search after this many seconds
+BROWSER_POOL_SIZE = 2  # Browsers shared by the workers
+BROWSER_RECYCLE_AFTER = 100  # Relaunch a browser after this many searches
+BLOCK_ASSETS = True  # Abort image/font/media and tracker requests in the browser
+PARSER_ENGINE = "bs4"  # "lxml" parses several times faster if installed
+PARSE_WORKERS = 2  # Processes/threads parsing pages off the event loop (0 = inline)
+PARSE_POOL = "auto"  # "process", "thread", or "auto" (threads for lxml)
+FETCHER = "auto"  # "http", "browser", or "auto" (http with browser fallback)
+BASE_URL = "https://skiplagged.com"
+POPULATE_CACHE = True  # Store every search in the CLI's cache so it can answer offline
+CACHE_PATH = None  # None uses the CLI default (~/.cache/findflights/searches.sqlite3)
+CACHE_TTL_HOURS = 36  # Keep entries fresh until after the next daily run
 COLLECTION_INTERVAL_HOURS = 24  # Run daily
+REQUEST_BUDGET = None  # Searches per cycle; the planner picks the stalest/most volatile (None = all)
+LEASE_SECONDS = 600  # Sharded mode: hand a search to another worker if not done within this
+MAX_ATTEMPTS = 3  # Sharded mode: give up on a search after this many failures
+LEASE_POLL_SECONDS = 30  # Sharded mode: how often an idle worker checks for expired leases
 RATE_LIMIT_PER_MINUTE = 60  # Maximum requests per minute
+RATE_LIMIT_PER_DESTINATION = None  # Requests per minute to any one destination (None = no limit)
+ADAPTIVE_RATE_LIMIT = True  # Slow down on timeouts/challenge pages, speed back up on success
+SEARCH_ATTEMPTS = 3  # Tries per search when it times out or errors (blocks are not retried)
+RETRY_BASE_DELAY = 2  # Seconds before the first retry, doubling per retry, with jitter
+RETRY_MAX_DELAY = 60  # Longest wait between retries
+BREAKER_ROUTE_BLOCKS = 3  # Pause a route after this many blocked searches in a row
+BREAKER_GLOBAL_BLOCKS = 5  # Pause every route after this many blocked searches in a row
+BREAKER_COOLDOWN = 300  # Seconds a pause lasts, doubling while the site keeps blocking
+BREAKER_MAX_COOLDOWN = 3600  # Longest single pause
+STATUS_INTERVAL = 5  # Rewrite the status file at most every this many seconds
+FLUSH_INTERVAL = 5  # Write buffered flights to disk at least every this many seconds
+METRICS_FILE = DATA_DIR / "metrics.prom"  # Prometheus textfile, rewritten with the status file (None = off)
+METRICS_PORT = None  # Also serve metrics at http://127.0.0.1:PORT/metrics, e.g. 9464 (None = off)
+PARQUET_DIR = None  # Also write flights to a Parquet dataset here, e.g. Path("flight_history") (needs pyarrow)
 DEBUG = False  # Debug flag for verbose logging
 
-# Ensure data directory exists
-DATA_DIR.mkdir(exist_ok=True)
-
 # Status tracking
 status = {
     "last_run": None,
@@ -47,66 +94,33 @@ def log(message, level="info"):
         return
     print(f"[{timestamp}] [{level.upper()}] {message}")
 
-def save_status():
-    """Save current status to a status file for monitoring"""
-    with open(DATA_DIR / "collection_status.json", "w") as f:
-        json.dump(status, f, default=str, indent=2)
-    if DEBUG:
-        log(f"Status saved: {status}", "debug")
+# set up when run as a script; spawned parse workers import this module too
+# and must not write the status file
+status_file = None
+
+def save_status(force=False):
+    """Save current status to a status file for monitoring.
+
+    Progress updates are throttled to STATUS_INTERVAL; pass force for
+    state changes that must be visible right away.
+    """
+    if status_file is not None and status_file.save(status, force=force):
+        if METRICS_FILE is not None:
+            REGISTRY.write_textfile(METRICS_FILE)
+        if DEBUG:
+            log(f"Status saved: {status}", "debug")
 
 def handle_exit(signum, frame):
     """Handle graceful shutdown"""
     status["current_status"] = "shutting down"
-    save_status()
+    save_status(force=True)
     log("\nGracefully shutting down...")
     sys.exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, handle_exit)
-signal.signal(signal.SIGTERM, handle_exit)
-
-class RateLimiter:
-    """Simple token bucket rate limiter"""
-    def __init__(self, rate_limit_per_minute):
-        self.rate = rate_limit_per_minute
-        self.tokens = self.rate
-        self.last_check = time.monotonic()
-        self.lock = asyncio.Lock()
-
-    async def acquire(self):
-        """Acquire a token, waiting if necessary"""
-        async with self.lock:
-            while True:
-                now = time.monotonic()
-                time_passed = now - self.last_check
-
-                # Add new tokens based on time passed
-                self.tokens += time_passed * (self.rate / 60.0)
-                self.tokens = min(self.tokens, self.rate)  # Cap at max tokens
-                self.last_check = now
-
-                if self.tokens >= 1:
-                    self.tokens -= 1
-                    if DEBUG:
-                        log(f"Token acquired, {self.tokens:.2f} tokens remaining", "debug")
-                    return
-
-                # Calculate time to wait for next token
-                wait_time = (1 - self.tokens) * (60.0 / self.rate)
-                if DEBUG:
-                    log(f"Rate limit reached, waiting {wait_time:.2f}s for next token", "debug")
-                await asyncio.sleep(wait_time)
-
-async def collect_flight_data():
-    """Collect flight data for all airport pairs and dates"""
-    log_date = datetime.datetime.now()
-    status["current_status"] = "collecting data"
-    status["last_run"] = log_date
-    save_status()
-    log(f"Starting data collection at {log_date}")
-
+def plan_searches(log_date, planner, finished=frozenset()):
+    """The (src, dst, date) searches for a cycle, best first"""
     # Generate date range to look ahead
-    today = datetime.date.today()
+    today = log_date.date()
     future_dates = [today + datetime.timedelta(days=i) for i in range(1, DAYS_AHEAD)]
     if DEBUG:
         log(f"Generated {len(future_dates)} dates from {future_dates[0]} to {future_dates[-1]}", "debug")
@@ -124,123 +138,381 @@ async def collect_flight_data():
     all_tasks = []
     for date in future_dates:
         for src, dst in airport_pairs:
-            all_tasks.append((src, dst, date))
+            if (src, dst, date) not in finished:
+                all_tasks.append((src, dst, date))
     if DEBUG:
         log(f"Created {len(all_tasks)} total tasks", "debug")
 
-    # Create output filename for today's data
+    # Rank route/dates by staleness, nearness of departure and how much
+    # their fares have been moving, and keep what fits in the budget
+    if REQUEST_BUDGET is not None:
+        planner.budget = max(0, REQUEST_BUDGET - len(finished))
+    plan = planner.plan(all_tasks)
+    plan.write_report(DATA_DIR / f"plan_{log_date.strftime('%Y-%m-%d')}.json")
+    report = plan.report
+    log(
+        f"Planned {report['selected']}/{report['candidates']} searches"
+        f" ({report['selected_never_searched']} never searched before)"
+    )
+    if report["oldest_skipped_hours"] is not None:
+        log(f"Oldest skipped search was last made {report['oldest_skipped_hours']}h ago")
+    return plan.items
+
+
+async def collect_flight_data(queue=None, worker_id=None):
+    """Collect flight data for all airport pairs and dates.
+
+    With a WorkQueue this process is one of several workers sharing the
+    run: it leases searches from the queue, writes a shard file, and the
+    last worker to finish merges the shards.
+    """
+    DATA_DIR.mkdir(exist_ok=True)
+    log_date = datetime.datetime.now()
     output_file = DATA_DIR / f"flights_{log_date.strftime('%Y-%m-%d')}.jsonl"
-    log(f"Output file: {output_file}")
+    planner = CollectionPlanner(DATA_DIR / "planner.sqlite3", refresh_hours=COLLECTION_INTERVAL_HOURS)
+    max_age = datetime.timedelta(hours=COLLECTION_INTERVAL_HOURS)
+
+    if queue is None:
+        # Pick up an interrupted run where it stopped
+        checkpoint = Checkpoint(DATA_DIR / "checkpoint.jsonl")
+        resumed = checkpoint.load()
+        if resumed is not None and log_date - resumed.log_date > max_age:
+            log(f"Discarding checkpoint of the run started {resumed.log_date}, it is over a cycle old")
+            resumed = None
+        if resumed is not None:
+            log_date = resumed.log_date
+            log(f"Resuming the run started {log_date}, {len(resumed.done)} searches already done")
+            all_tasks = plan_searches(log_date, planner, resumed.done)
+            # drop flights from searches that were not journaled before the
+            # interruption; they are searched again
+            output_file = resumed.output_file
+            checkpoint.resume(resumed)
+        else:
+            all_tasks = plan_searches(log_date, planner)
+            checkpoint.start(log_date, output_file)
+        on_written = checkpoint.mark
+        write_file = output_file
+    else:
+        # A restarted worker must not append to the shard of the process it
+        # replaces, so each process is its own worker in the queue
+        worker_id = f"{worker_id}.{os.getpid()}"
+        # Join this cycle's run, or start it if we are the first worker
+        run = queue.open_run(log_date, max_age, lambda: plan_searches(log_date, planner))
+        log_date = run.log_date
+        output_file = DATA_DIR / f"flights_{log_date.strftime('%Y-%m-%d')}.jsonl"
+        log(f"{'Started' if run.created else 'Joined'} sharded run {run.id} from {log_date} as {worker_id}")
+        write_file = DATA_DIR / "shards" / f"{output_file.stem}.{worker_id}.jsonl"
+        write_file.parent.mkdir(exist_ok=True)
+        queue.register_shard(run.id, worker_id, write_file)
+
+        def on_written(written):
+            queue.complete(run.id, worker_id, [item for item, _ in written])
 
-    # Initialize browser
-    log("Initializing browser")
-    browser, playwright = await create_browser()
+    status["current_status"] = "collecting data"
+    status["last_run"] = log_date
+    save_status(force=True)
+    log(f"Starting data collection at {log_date}")
+    log(f"Output file: {write_file}")
+
+    # Initialize fetcher backend (the browser pool is launched on first use)
+    log(f"Initializing {FETCHER} fetcher")
+    fetcher = create_fetcher(
+        FETCHER,
+        base_url=BASE_URL,
+        connections=MAX_WORKERS,
+        size=BROWSER_POOL_SIZE,
+        pages_per_browser=-(-MAX_WORKERS // BROWSER_POOL_SIZE),
+        max_navigations=BROWSER_RECYCLE_AFTER,
+        block_assets=BLOCK_ASSETS,
+    )
+    cache = None
+    if POPULATE_CACHE:
+        # always search live; the cache is only written here
+        cache = SearchCache(CACHE_PATH, ttl=CACHE_TTL_HOURS * 3600)
+        cache.purge_expired()
+        fetcher = CachingFetcher(fetcher, cache, refresh=True)
+        log(f"Populating search cache at {cache.path}")
+    await fetcher.start()
+
+    # Parse pages off the event loop so fetches and the rate limiter keep running
+    parse_pool = ParsePool(PARSE_WORKERS, kind=PARSE_POOL) if PARSE_WORKERS > 0 else None
+    set_parse_pool(parse_pool)
 
     # Initialize rate limiter
-    rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE)
+    rate_limiter = RateLimiter(
+        RATE_LIMIT_PER_MINUTE,
+        per_destination=RATE_LIMIT_PER_DESTINATION,
+        adaptive=ADAPTIVE_RATE_LIMIT,
+    )
     log(f"Rate limiter initialized with {RATE_LIMIT_PER_MINUTE} requests per minute")
+    retry_policy = RetryPolicy(SEARCH_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+    breaker = CircuitBreaker(
+        BREAKER_ROUTE_BLOCKS, BREAKER_GLOBAL_BLOCKS, BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN
+    )
+    status["outcomes"] = dict.fromkeys(OUTCOMES, 0)
+    status["retries"] = 0
+    status["paused"] = 0
+
+    # the writer journals (or, sharded, completes) each search once its
+    # flights are on disk
+    writer = JsonlWriter(write_file, flush_interval=FLUSH_INTERVAL, on_written=on_written)
+    parquet = None
+    if PARQUET_DIR is not None:
+        from history import ParquetSink, remove_parts, run_name
+
+        # parts are named after the run, so a resume or a later compaction
+        # of the output replaces them; shard workers add their id to keep
+        # their part numbers apart
+        name = run_name(log_date) if queue is None else f"{run_name(log_date)}-{worker_id}"
+        parquet = ParquetSink(PARQUET_DIR, name=name)
+        log(f"Parquet output: {PARQUET_DIR}")
+        if queue is None and resumed is not None:
+            # the run's parts may hold searches the journal never recorded,
+            # which are about to be searched again; write the run out again
+            # from what the output file kept
+            removed = remove_parts(PARQUET_DIR, name)
+            kept = 0
+            if output_file.exists():
+                with open(output_file, "rb") as f:
+                    f.seek(resumed.start_offset)
+                    for line in f:
+                        parquet.write(json.loads(line))
+                        kept += 1
+            log(f"Replaced {removed} Parquet files of the run with its {kept} journaled flights")
 
     try:
-        total_tasks = len(all_tasks)
+        if queue is None:
+            total_tasks = len(all_tasks)
+        else:
+            total_tasks = queue.remaining(run.id)
         completed = 0
 
-
-        # Process tasks in batches to avoid memory issues
-        for i in range(0, total_tasks, 100):
-            batch = all_tasks[i:i+100]
-            batch_size = len(batch)
-            if DEBUG:
-                log(f"Processing batch {i//100 + 1}/{(total_tasks+99)//100}, size: {batch_size}", "debug")
-
-            # Create async tasks for the batch with rate limiting
-            async def process_flight_task(item):
-                src, dst, date = item
+        async def process_flight_task(item):
+            src, dst, date = item
+            route = (src, dst)
+            attempt = 0
+            while True:
+                attempt += 1
+                # check the breaker before spending a rate limit token
+                pause = breaker.wait()
+                if pause:
+                    if DEBUG:
+                        log(f"All searches paused, waiting {pause:.0f}s", "debug")
+                    await asyncio.sleep(pause)
+                if breaker.route_open(route):
+                    raise CircuitOpen(f"{src}->{dst} is paused after repeated blocks")
                 if DEBUG:
-                    log(f"Fetching flights: {src} to {dst} on {date}", "debug")
-                await rate_limiter.acquire()  # Wait for rate limit
+                    log(f"Fetching flights: {src} to {dst} on {date} (attempt {attempt})", "debug")
+                waited = await rate_limiter.acquire(dst)  # Wait for rate limit
+                RATE_LIMIT_WAIT_SECONDS.observe(waited)
+                if DEBUG and waited:
+                    log(f"Rate limited for {waited:.2f}s, {rate_limiter.waiting} searches waiting", "debug")
+                # the timeout covers the search only, not the rate limiter wait
+                flights, error = None, None
                 try:
-                    result = await search_flights(src, dst, date, browser)
-                    return src, dst, date, result
+                    with SEARCH_SECONDS.time():
+                        flights = await asyncio.wait_for(fetcher.search(src, dst, date), SEARCH_TIMEOUT)
                 except Exception as e:
-                    log(f"Error fetching {src} to {dst} on {date}: {e}", "error")
-                    return src, dst, date, []
-
-            # Create progress bar for this batch
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-                TimeRemainingColumn(),
-                TextColumn("({task.completed}/{task.total})"),
-            ) as progress:
-                batch_task = progress.add_task(f"Batch {i//100 + 1}/{(total_tasks+99)//100}", total=batch_size)
-
-                # Run tasks in parallel with limited concurrency
-                task_results = []
-                for j in range(0, len(batch), MAX_WORKERS):
-                    sub_batch = batch[j:j+MAX_WORKERS]
-                    results = await run_tasks([process_flight_task(item) for item in sub_batch], workers=MAX_WORKERS)
-                    task_results.extend(results)
-                    progress.update(batch_task, advance=len(sub_batch))
-
-            # Process results
-            for result in task_results:
-                if result:
-                    src, dst, date, flights = result
-
-                    # Write flights directly to file as they are received
-                    flight_count = 0
-                    for flight in flights:
-                        flight["log_date"] = log_date.isoformat()
-                        flight["search_date"] = date.isoformat()
-
-                        # Append to the JSONL file
-                        with open(output_file, "a") as f:
-                            f.write(json.dumps(flight) + "\n")
-
-                        status["flights_collected"] += 1
-                        flight_count += 1
+                    error = e
+                outcome = classify(error, flights)
+                rate_limiter.record(dst, ok=outcome not in (TIMEOUT, BLOCKED))
+                was_open = breaker.wait(), breaker.route_open(route)
+                breaker.record(route, outcome)
+                if not was_open[0] and breaker.wait():
+                    CIRCUIT_TRIPS.inc(scope="global")
+                    log(f"Repeated blocks, pausing all searches for {breaker.wait():.0f}s", "warning")
+                elif not was_open[1] and breaker.route_open(route):
+                    CIRCUIT_TRIPS.inc(scope="route")
+                    log(f"Repeated blocks on {src}->{dst}, pausing the route", "warning")
+                if error is None:
+                    return flights
+                if not retry_policy.should_retry(outcome, attempt):
+                    raise error
+                delay = retry_policy.delay(attempt)
+                status["retries"] += 1
+                RETRIES.inc()
+                if DEBUG:
+                    log(f"Retrying {src} to {dst} on {date} in {delay:.1f}s after {outcome}: {error}", "debug")
+                await asyncio.sleep(delay)
+
+        written = set()
+
+        async def results():
+            if queue is None:
+                async for done in iter_tasks(all_tasks, process_flight_task, workers=MAX_WORKERS):
+                    yield done
+                return
+            # Lease searches until the queue is drained; leases other
+            # workers let expire come back, so keep polling while any are out
+            while True:
+                async for done in iter_tasks(
+                    queue.leases(run.id, worker_id), process_flight_task, workers=MAX_WORKERS
+                ):
+                    yield done
+                if not queue.remaining(run.id):
+                    return
+                await asyncio.sleep(LEASE_POLL_SECONDS)
+
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+            TimeRemainingColumn(),
+            TextColumn("({task.completed}/{task.total})"),
+        ) as progress:
+            progress_task = progress.add_task("Collecting", total=total_tasks)
+
+            # Keep MAX_WORKERS searches in flight and handle each one as it
+            # finishes, so a slow route never holds up the rest of a batch
+            async for done in results():
+                src, dst, date = done.item
+                if isinstance(done.error, CircuitOpen):
+                    # not searched; left stale so the planner (or, sharded,
+                    # the lease expiring) brings it back after the pause
+                    status["paused"] += 1
+                    if DEBUG:
+                        log(f"Skipped {src} to {dst} on {date}: {done.error}", "debug")
+                elif done.error is not None:
+                    outcome = classify(done.error)
+                    status["outcomes"][outcome] += 1
+                    SEARCHES.inc(route=f"{src}-{dst}", outcome=outcome)
+                    reason = "timed out" if isinstance(done.error, asyncio.TimeoutError) else done.error
+                    log(f"Error fetching {src} to {dst} on {date} ({outcome}): {reason}", "error")
+                    planner.record(src, dst, date, None)
+                    if queue is not None:
+                        queue.fail(run.id, worker_id, done.item, reason)
+                elif done.item in written:
+                    # sharded: our own lease expired and we claimed the
+                    # search again before the first attempt finished
+                    writer.write_many([], marker=done.item)
+                else:
+                    outcome = classify(None, done.result)
+                    status["outcomes"][outcome] += 1
+                    SEARCHES.inc(route=f"{src}-{dst}", outcome=outcome)
+                    written.add(done.item)
+                    # Hand flights to the writer as they are received; it
+                    # batches them into the JSONL file in the background
+                    records = []
+                    for flight in done.result:
+                        record = flight.to_dict()
+                        # the route searched; with nearby airports the
+                        # flight's own from/to can differ
+                        record["src"] = src
+                        record["dst"] = dst
+                        record["log_date"] = log_date.isoformat()
+                        record["search_date"] = date.isoformat()
+                        records.append(record)
+                    # and a marker, so an empty search is on record too
+                    marker = search_marker(src, dst, date, log_date, len(records))
+                    writer.write_many([*records, marker], marker=done.item)
+                    planner.record(src, dst, date, done.result)
+                    if parquet is not None:
+                        parquet.write_many(records)
+                    flight_count = len(records)
+                    status["flights_collected"] += flight_count
 
                     if DEBUG:
-                        log(f"Found and saved {flight_count} flights for {src} to {dst} on {date}", "debug")
+                        log(
+                            f"Found and saved {flight_count} flights for {src} to {dst} on {date}"
+                            f" in {done.elapsed:.1f}s",
+                            "debug",
+                        )
 
                 # Update status after each result
                 completed += 1
+                if completed > total_tasks:
+                    # sharded: picked up leases other workers let expire
+                    total_tasks = completed
+                    progress.update(progress_task, total=total_tasks)
+                progress.update(progress_task, advance=1)
                 status["current_status"] = f"collected {completed}/{total_tasks} searches"
                 save_status()
                 if completed % 10 == 0 or DEBUG:
                     log(f"Progress: {completed}/{total_tasks} ({completed/total_tasks*100:.1f}%)")
+                    limits = rate_limiter.snapshot()
+                    log(
+                        f"Rate limit: {limits['rate']:.1f}/min, {limits['queue_depth']} waiting,"
+                        f" {limits['throttle_seconds']:.1f}s throttled, {limits['backoffs']} backoffs"
+                    )
 
     finally:
-        log("Closing browser")
-        await browser.close()
-        await playwright.stop()
+        outcomes = ", ".join(f"{count} {outcome}" for outcome, count in status["outcomes"].items())
+        log(f"Searches: {outcomes}; {status['retries']} retries")
+        trips = breaker.snapshot()
+        if trips["route_trips"] or trips["global_trips"] or status["paused"]:
+            log(
+                f"Circuit breaker paused routes {trips['route_trips']} times and all searches"
+                f" {trips['global_trips']} times; {status['paused']} searches skipped"
+            )
+        for phase, stats in fetcher.phase_summary().items():
+            unit = "" if phase in ("blocked_requests", "est_bytes_saved") else "s"
+            log(
+                f"Page {phase}: mean {stats['mean']:.2f}{unit}, p95 {stats['p95']:.2f}{unit},"
+                f" max {stats['max']:.2f}{unit} over {stats['count']} pages"
+            )
+        log("Closing fetcher")
+        await fetcher.close()
+        if cache is not None:
+            log(f"Cached {cache.stats['stores']} searches ({cache.stats['evictions']} evicted)")
+            cache.close()
+        set_parse_pool(None)
+        if parse_pool is not None:
+            log(f"Parse pool stats: {parse_pool.stats}")
+            parse_pool.close()
+        planner.close()
+        # closing flushes what is still buffered and raises a write error
+        writer.close()
+        log(
+            f"Wrote {writer.stats['records']} flights to {write_file}"
+            f" in {writer.stats['flushes']} flushes"
+        )
+        if parquet is not None:
+            # waits for the thread to write the batches still queued
+            parquet.close()
+            log(f"Wrote {parquet.stats['records']} flights to {PARQUET_DIR}")
+        if queue is None:
+            checkpoint.close()
+
+    if queue is None:
+        checkpoint.finish()
+    else:
+        counts = queue.counts(run.id)
+        log(f"Run {run.id}: {counts['done']} searches done, {counts['failed']} failed")
+        merged = merge_shards(queue, run.id, output_file)
+        if merged is None:
+            log("Other workers are still collecting; the last one to finish merges the shards")
+        else:
+            log(f"Merged {merged} flights from all shards into {output_file}")
 
     status["total_collections"] += 1
     status["current_status"] = "idle"
     status["next_run"] = log_date + datetime.timedelta(hours=COLLECTION_INTERVAL_HOURS)
-    save_status()
+    save_status(force=True)
     log(f"Collection completed. Added {status['flights_collected']} flights.")
 
-async def main():
+async def main(queue=None, worker_id=None):
     """Main loop for continuous data collection"""
 
     # Set debug flag
     global DEBUG
 
     log(f"Starting flight data collection service (debug={DEBUG})...")
+    set_parser_engine(PARSER_ENGINE)
+    if METRICS_PORT is not None:
+        await MetricsServer(METRICS_PORT).start()
+        log(f"Serving metrics at http://127.0.0.1:{METRICS_PORT}/metrics")
 
     while True:
         try:
-            await collect_flight_data()
+            await collect_flight_data(queue, worker_id)
 
             # Sleep until next collection
             log(f"Collection complete. Next run in {COLLECTION_INTERVAL_HOURS} hours.")
             for i in range(COLLECTION_INTERVAL_HOURS * 60):
                 if DEBUG and i % 60 == 0:
                     log(f"Waiting: {i//60}/{COLLECTION_INTERVAL_HOURS} hours elapsed", "debug")
-                time.sleep(60)  # Check every minute
+                await asyncio.sleep(60)  # Check every minute
                 save_status()  # Update timestamp
         except Exception as e:
             log(f"Error in collection cycle: {e}", "error")
@@ -248,8 +520,65 @@ async def main():
                 import traceback
                 log(traceback.format_exc(), "debug")
             status["current_status"] = f"error: {e}"
-            save_status()
-            time.sleep(300)  # Wait 5 minutes after error
+            save_status(force=True)
+            await asyncio.sleep(300)  # Wait 5 minutes after error
+
+def run_shards(count, queue_path):
+    """Run ``count`` worker processes on one queue until interrupted"""
+    host = socket.gethostname()
+    workers = [
+        subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            "--queue", str(queue_path), "--worker-id", f"{host}-{i}",
+        ])
+        for i in range(count)
+    ]
+    log(f"Started {count} collector workers on {queue_path}")
+    try:
+        for worker in workers:
+            worker.wait()
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            worker.wait()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Collect flight prices on a schedule")
+    parser.add_argument(
+        "--queue",
+        type=Path,
+        help="share each run with the other workers using this queue database",
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=socket.gethostname(),
+        help="this worker's name in the queue and its status file (default the host name)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="run this many worker processes on DATA_DIR/queue.sqlite3",
+    )
+    args = parser.parse_args()
+
+    DATA_DIR.mkdir(exist_ok=True)
+    status_file = StatusFile(DATA_DIR / "collection_status.json", interval=STATUS_INTERVAL)
+    signal.signal(signal.SIGINT, handle_exit)
+    signal.signal(signal.SIGTERM, handle_exit)
+
+    if args.shards:
+        run_shards(args.shards, args.queue or DATA_DIR / "queue.sqlite3")
+    elif args.queue:
+        status_file = StatusFile(
+            DATA_DIR / f"collection_status.{args.worker_id}.json", interval=STATUS_INTERVAL
+        )
+        if METRICS_FILE is not None:
+            METRICS_FILE = DATA_DIR / f"metrics.{args.worker_id}.prom"
+        REGISTRY.labels["worker"] = args.worker_id
+        queue = WorkQueue(args.queue, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS)
+        asyncio.run(main(queue, args.worker_id))
+    else:
+        asyncio.run(main())
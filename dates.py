@@ -0,0 +1,47 @@
+"""Date arguments, kept apart from lib so the CLI can check them before
+importing anything heavy."""
+
+import datetime
+
+
+def parse_date(date_str, default_year=None):
+    for fmt in ("%m/%d/%Y", "%m/%d"):
+        try:
+            dt = datetime.datetime.strptime(date_str, fmt).date()
+            if fmt == "%m/%d" and default_year:
+                dt = dt.replace(year=default_year)
+            return dt
+        except ValueError:
+            continue
+    raise ValueError(f"invalid date format: {date_str}")
+
+
+def parse_date_range(range_str):
+    # if no '-' present, treat it as a single date
+    if "-" not in range_str:
+        today = datetime.date.today()
+        single_date = parse_date(range_str, default_year=today.year)
+        return [single_date]
+    parts = range_str.split("-")
+    if len(parts) != 2:
+        raise ValueError("date range must be in 'start-end' format")
+    today = datetime.date.today()
+    start = parse_date(parts[0], default_year=today.year)
+    end = parse_date(parts[1], default_year=today.year)
+    if start > end:
+        raise ValueError("start date must not be after end date")
+    return [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def weekend_dates(day):
+    """``(depart dates, return dates)`` for the weekend ``day`` falls in:
+    out friday or saturday, back sunday or monday"""
+    # friday (4), saturday (5), sunday (6), monday (0)
+    back = {4: 0, 5: 1, 6: 2, 0: 3}.get(day.weekday())
+    if back is None:
+        raise ValueError(f"{day:%m/%d} is not part of a weekend (fri-sat-sun-mon)")
+    friday = day - datetime.timedelta(days=back)
+    return (
+        [friday, friday + datetime.timedelta(days=1)],
+        [friday + datetime.timedelta(days=2), friday + datetime.timedelta(days=3)],
+    )
@@ -0,0 +1,558 @@
+import asyncio
+import datetime
+import gzip
+import json
+import ssl
+import urllib.parse
+import zlib
+
+from lib import (
+    SKIPLAGGED_URL,
+    USER_AGENT,
+    BrowserPool,
+    Flight,
+    console,
+    parse_flights_async,
+)
+from metrics import BROWSER_START_SECONDS, PAGE_PHASE_SECONDS, PARSE_SECONDS, REQUEST_SECONDS, RESPONSE_BYTES
+
+SEARCH_API_PATH = "/api/search.php"
+
+
+class FetchError(Exception):
+    """Raised when a backend cannot produce flights for a search.
+
+    ``blocked`` is set when the site refused us (rate limited or served a
+    challenge page) rather than failing on its own, and ``timed_out`` when
+    the results never finished loading.
+    """
+
+    def __init__(self, message, status=None, blocked=False, timed_out=False):
+        super().__init__(message)
+        self.status = status
+        self.blocked = blocked
+        self.timed_out = timed_out
+
+
+# text that shows up on bot-check pages instead of results
+CHALLENGE_MARKERS = ("captcha", "are you a robot", "verify you are human", "cf-challenge")
+BLOCKED_STATUSES = (403, 429)
+
+
+def looks_blocked(html):
+    text = html.lower()
+    return any(marker in text for marker in CHALLENGE_MARKERS)
+
+
+class Fetcher:
+    """Base class for flight search backends.
+
+    A backend turns an (origin, destination, depart_date) search into the
+    list of Flight records produced by ``parse_flights``. Backends are async
+    context managers so connections or browsers are set up once per run.
+    ``base_url`` is the site a backend searches.
+    """
+
+    name = "base"
+    base_url = SKIPLAGGED_URL
+
+    async def start(self):
+        return self
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def search(self, origin, destination, depart_date):
+        raise NotImplementedError
+
+    async def warm(self):
+        """Start anything that would otherwise start on the first search"""
+
+    def phase_summary(self):
+        """Per-phase page timings, for backends that render pages"""
+        return {}
+
+
+class PlaywrightFetcher(Fetcher):
+    """Renders the results page in a pooled headless browser and scrapes it.
+
+    The pool is launched lazily on the first search, so a fallback backend
+    that is never needed never starts chromium.
+    """
+
+    name = "browser"
+
+    def __init__(self, pool=None, base_url=SKIPLAGGED_URL, **pool_options):
+        self.pool = pool
+        self.base_url = base_url
+        self._pool_options = pool_options
+        self._owns_pool = pool is None
+        self._start_lock = asyncio.Lock()
+        self._started = pool is not None
+
+    async def _ensure_pool(self):
+        if self._started:
+            return self.pool
+        async with self._start_lock:
+            if not self._started:
+                self.pool = BrowserPool(**self._pool_options)
+                with BROWSER_START_SECONDS.time():
+                    await self.pool.start()
+                self._started = True
+        return self.pool
+
+    async def warm(self):
+        await self._ensure_pool()
+
+    async def close(self):
+        if self._owns_pool and self._started:
+            await self.pool.close()
+            self._started = False
+
+    async def search(self, origin, destination, depart_date):
+        pool = await self._ensure_pool()
+        timings = {}
+        html = await pool.fetch_flights_page(
+            origin, destination, depart_date, base_url=self.base_url, timings=timings
+        )
+        for phase in ("navigate", "ready", "settle", "content"):
+            if phase in timings:
+                PAGE_PHASE_SECONDS.observe(timings[phase], phase=phase)
+        RESPONSE_BYTES.observe(len(html), backend=self.name)
+        flights, seconds = await parse_flights_async(html, origin, destination)
+        PARSE_SECONDS.observe(seconds, backend=self.name)
+        if not flights:
+            if looks_blocked(html):
+                raise FetchError(f"challenge page for {origin}->{destination}", blocked=True)
+            # no results and no empty-results banner is not an empty route
+            if timings.get("result") in ("timeout", "error"):
+                raise FetchError(
+                    f"results for {origin}->{destination} never loaded", timed_out=True
+                )
+        return flights
+
+    def phase_summary(self):
+        return self.pool.phase_summary() if self._started else {}
+
+
+class HttpClient:
+    """Minimal async HTTP/1.1 client with keep-alive connection pooling.
+
+    Only what the search API needs: GET requests, chunked or sized bodies,
+    and gzip/deflate content encoding.
+    """
+
+    def __init__(self, base_url, max_connections=10, timeout=30):
+        parts = urllib.parse.urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported url scheme: {base_url}")
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        default_port = 443 if parts.scheme == "https" else 80
+        self.host_header = (
+            self.host if self.port == default_port else f"{self.host}:{self.port}"
+        )
+        self.timeout = timeout
+        self.stats = {"requests": 0, "connections": 0, "bytes_received": 0}
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl
+        )
+        self.stats["connections"] += 1
+        return reader, writer
+
+    async def get(self, path, params=None, headers=None):
+        """Return ``(status, headers, body)`` with the body already decoded"""
+        target = self.base_path + path
+        if params:
+            target += "?" + urllib.parse.urlencode(params)
+        async with self._semaphore:
+            # a pooled connection may have been closed by the server while
+            # idle, so retry once on a fresh one if a reused one fails
+            for attempt in range(2):
+                reused = bool(self._idle) and attempt == 0
+                conn = self._idle.pop() if reused else await self._connect()
+                try:
+                    response = await asyncio.wait_for(
+                        self._request(conn, target, headers), self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn[1].close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    conn[1].close()
+                    raise
+                break
+            status, resp_headers, body, keep_alive = response
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+        self.stats["requests"] += 1
+        self.stats["bytes_received"] += len(body)
+        return status, resp_headers, self._decode(resp_headers, body)
+
+    async def _request(self, conn, target, headers):
+        reader, writer = conn
+        lines = [
+            f"GET {target} HTTP/1.1",
+            f"Host: {self.host_header}",
+            f"User-Agent: {USER_AGENT}",
+            "Accept: application/json",
+            "Accept-Encoding: gzip, deflate",
+            "Connection: keep-alive",
+        ]
+        for key, value in (headers or {}).items():
+            lines.append(f"{key}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before response")
+        version, status, *_ = status_line.decode("latin-1").split(" ", 2)
+        resp_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            resp_headers[key.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1"
+        connection = resp_headers.get("connection", "").lower()
+        if connection == "close":
+            keep_alive = False
+        elif connection == "keep-alive":
+            keep_alive = True
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # skip trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in resp_headers:
+            body = await reader.readexactly(int(resp_headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), resp_headers, body, keep_alive
+
+    @staticmethod
+    def _decode(headers, body):
+        encoding = headers.get("content-encoding", "").lower()
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        if encoding == "deflate":
+            return zlib.decompress(body)
+        return body
+
+
+def _format_duration(seconds):
+    minutes = int(seconds) // 60
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m"
+
+
+def _format_stops(count):
+    if count == 0:
+        return "nonstop"
+    return f"{count} stop" if count == 1 else f"{count} stops"
+
+
+def search_params(origin, destination, depart_date):
+    """Query parameters of a one-way search API request"""
+    return {
+        "from": origin,
+        "to": destination,
+        "depart": depart_date.isoformat(),
+        "return": "",
+        "format": "v3",
+        "counts[adults]": 1,
+        "counts[children]": 0,
+    }
+
+
+def parse_search_json(data, origin, destination, depart_date=None):
+    """Convert a search API response into the Flights ``parse_flights`` gives"""
+    airlines = data.get("airlines", {})
+    flight_table = data.get("flights", {})
+    itineraries = data.get("itineraries", {}).get("outbound", [])
+    flights = []
+    for itinerary in itineraries:
+        info = flight_table.get(itinerary.get("flight"))
+        if not info or not info.get("segments"):
+            continue
+        segments = info["segments"]
+        try:
+            departure = datetime.datetime.fromisoformat(segments[0]["departure"]["time"])
+            arrival = datetime.datetime.fromisoformat(segments[-1]["arrival"]["time"])
+        except (KeyError, ValueError):
+            continue
+
+        names = []
+        for segment in segments:
+            code = segment.get("airline", "")
+            name = airlines.get(code, {}).get("name", code)
+            if name not in names:
+                names.append(name)
+
+        intermediate_airports = []
+        for segment in segments[:-1]:
+            code = segment.get("arrival", {}).get("airport", "")
+            if code and code not in intermediate_airports:
+                intermediate_airports.append(code)
+
+        duration = info.get("duration")
+        if duration is None:
+            duration = (arrival - departure).total_seconds()
+
+        if depart_date is not None and departure.date() != depart_date:
+            continue
+        price = itinerary.get("one_way_price", itinerary.get("min_round_trip_price"))
+        flights.append(Flight(
+            origin,
+            destination,
+            departure.date(),
+            dep_time=departure.strftime("%H:%M"),
+            arr_time=arrival.strftime("%H:%M"),
+            duration=_format_duration(duration),
+            cost=int(price) if price is not None else None,
+            airline=", ".join(names),
+            stops=_format_stops(len(segments) - 1),
+            num_stops=len(intermediate_airports),
+            flight_numbers=[str(s["flight_number"]) for s in segments if "flight_number" in s],
+            intermediate_airports=intermediate_airports,
+        ))
+    return flights
+
+
+class HttpFetcher(Fetcher):
+    """Fetches search results straight from the JSON API, no browser needed"""
+
+    name = "http"
+
+    def __init__(self, base_url=SKIPLAGGED_URL, connections=10, timeout=30):
+        self.base_url = base_url
+        self.client = HttpClient(base_url, max_connections=connections, timeout=timeout)
+
+    async def close(self):
+        await self.client.close()
+
+    async def search(self, origin, destination, depart_date):
+        params = search_params(origin, destination, depart_date)
+        with REQUEST_SECONDS.time():
+            status, _, body = await self.client.get(SEARCH_API_PATH, params)
+        RESPONSE_BYTES.observe(len(body), backend=self.name)
+        if status != 200:
+            raise FetchError(
+                f"search api returned {status} for {origin}->{destination}",
+                status=status,
+                blocked=status in BLOCKED_STATUSES,
+            )
+        with PARSE_SECONDS.time(backend=self.name):
+            try:
+                data = json.loads(body)
+            except ValueError as e:
+                raise FetchError(f"invalid search api response: {e}") from e
+            if not isinstance(data, dict):
+                raise FetchError("unexpected search api response")
+            return parse_search_json(data, origin, destination, depart_date)
+
+
+class FallbackFetcher(Fetcher):
+    """Tries the primary backend and falls back to the secondary on failure"""
+
+    name = "auto"
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.base_url = primary.base_url
+        self.stats = {"primary": 0, "fallback": 0}
+
+    async def start(self):
+        await self.primary.start()
+        await self.fallback.start()
+        return self
+
+    async def close(self):
+        try:
+            await self.primary.close()
+        finally:
+            await self.fallback.close()
+
+    async def warm(self):
+        await self.primary.warm()
+        await self.fallback.warm()
+
+    async def search(self, origin, destination, depart_date):
+        try:
+            flights = await self.primary.search(origin, destination, depart_date)
+            self.stats["primary"] += 1
+            return flights
+        except Exception as e:
+            console.print(
+                f"[yellow]{self.primary.name} fetch failed for {origin}->{destination}"
+                f" on {depart_date}, using {self.fallback.name}: {e}[/yellow]"
+            )
+        flights = await self.fallback.search(origin, destination, depart_date)
+        self.stats["fallback"] += 1
+        return flights
+
+    def phase_summary(self):
+        return self.fallback.phase_summary() or self.primary.phase_summary()
+
+
+def cache_backend(fetcher):
+    """The backend part of ``fetcher``'s SearchCache keys"""
+    base_url = fetcher.base_url.rstrip("/")
+    if base_url == SKIPLAGGED_URL:
+        return fetcher.name
+    return f"{fetcher.name}@{base_url}"
+
+
+class CachingFetcher(Fetcher):
+    """Answers searches from a SearchCache and stores what the wrapped
+    backend fetches.
+
+    Entries are keyed by the wrapped backend's name, plus its base url when
+    that is not skiplagged, so searches of a stub or recorded site never
+    answer for the real one. With ``refresh`` every search goes to the
+    backend and the result replaces the cached one.
+    """
+
+    def __init__(self, fetcher, cache, refresh=False):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.refresh = refresh
+        self.name = fetcher.name
+        self.base_url = fetcher.base_url
+        self.backend = cache_backend(fetcher)
+
+    async def start(self):
+        await self.fetcher.start()
+        return self
+
+    async def close(self):
+        await self.fetcher.close()
+
+    async def warm(self):
+        await self.fetcher.warm()
+
+    async def search(self, origin, destination, depart_date):
+        if not self.refresh:
+            flights = self.cache.get(origin, destination, depart_date, self.backend)
+            if flights is not None:
+                return flights
+        flights = await self.fetcher.search(origin, destination, depart_date)
+        self.cache.put(origin, destination, depart_date, self.backend, flights)
+        return flights
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def phase_summary(self):
+        return self.fetcher.phase_summary()
+
+
+class CoalescingFetcher(Fetcher):
+    """Shares one backend search between identical searches in flight at
+    the same time, e.g. from several clients of the daemon.
+
+    The shared search runs to completion even if every caller gives up on
+    it, so a wrapped cache still gets the result. ``timeout`` bounds it.
+    """
+
+    def __init__(self, fetcher, timeout=None):
+        self.fetcher = fetcher
+        self.timeout = timeout
+        self.name = fetcher.name
+        self.base_url = fetcher.base_url
+        self._inflight = {}
+        self.stats = {"searches": 0, "coalesced": 0}
+
+    async def start(self):
+        await self.fetcher.start()
+        return self
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await self.fetcher.close()
+
+    async def warm(self):
+        await self.fetcher.warm()
+
+    async def search(self, origin, destination, depart_date):
+        key = (origin, destination, depart_date)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                asyncio.wait_for(self.fetcher.search(origin, destination, depart_date), self.timeout)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.stats["searches"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        # callers get their own list; one caller cancelling leaves the others waiting
+        return list(await asyncio.shield(task))
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if nobody was waiting any more
+
+    def phase_summary(self):
+        return self.fetcher.phase_summary()
+
+
+FETCHERS = ("auto", "http", "browser")
+
+
+def create_fetcher(kind="auto", base_url=SKIPLAGGED_URL, connections=10, **pool_options):
+    """Build a backend by name: ``http``, ``browser`` or ``auto`` (http, then browser)"""
+    if kind == "http":
+        return HttpFetcher(base_url, connections=connections)
+    if kind == "browser":
+        return PlaywrightFetcher(base_url=base_url, **pool_options)
+    if kind == "auto":
+        return FallbackFetcher(
+            HttpFetcher(base_url, connections=connections),
+            PlaywrightFetcher(base_url=base_url, **pool_options),
+        )
+    raise ValueError(f"unknown fetcher: {kind}")
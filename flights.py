@@ -0,0 +1,519 @@
+"""Flight and FlightPair records, round-trip pairing, and printing results.
+
+Kept apart from lib, which scrapes and schedules searches, so a query that
+only reads collected flights does not import asyncio or the backends.
+"""
+
+import bisect
+import collections
+import csv
+import datetime
+import functools
+import heapq
+import re
+import sys
+
+from rich.console import Console
+
+console = Console()
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_duration_str(dur_str):
+    match = re.search(r"(\d+)\s*h", dur_str)
+    hours = int(match.group(1)) if match else 0
+    match = re.search(r"(\d+)\s*m", dur_str)
+    minutes = int(match.group(1)) if match else 0
+    return hours * 60 + minutes
+
+
+def humanize_duration(minutes):
+    days = minutes // 1440
+    rem = minutes % 1440
+    hours = rem // 60
+    result = ""
+    if days:
+        result += f"{days}d "
+    result += f"{hours}h"
+    return result.strip()
+
+
+def compute_stay_duration(o, i):
+    try:
+        out_date = datetime.datetime.strptime(o["depart"], "%Y-%m-%d").date()
+        in_date = datetime.datetime.strptime(i["depart"], "%Y-%m-%d").date()
+        out_arr = datetime.datetime.strptime(o["arr_time"], "%H:%M").time()
+        in_dep = datetime.datetime.strptime(i["dep_time"], "%H:%M").time()
+        out_dt = datetime.datetime.combine(out_date, out_arr)
+        in_dt = datetime.datetime.combine(in_date, in_dep)
+        stay = in_dt - out_dt
+        if stay.total_seconds() < 0:
+            stay += datetime.timedelta(days=1)
+        return int(stay.total_seconds() // 60)
+    except Exception:
+        return None
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@functools.lru_cache(maxsize=4096)
+def _clock_minutes(time_str):
+    try:
+        t = datetime.datetime.strptime(time_str, "%H:%M")
+    except Exception:
+        return None
+    return t.hour * 60 + t.minute
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_day(value):
+    # strptime is slow and a load of records only has a few hundred dates
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+# dict keys Flight stores as fields; anything else goes to Flight.extra
+_FLIGHT_KEYS = frozenset((
+    "depart", "stops", "airline", "flight_numbers", "dep_time", "arr_time",
+    "intermediate_airports", "num_stops", "cost", "duration", "from", "to",
+))
+
+
+class Flight:
+    """One flight leg, with the fields pairing and display need parsed once.
+
+    ``depart`` is a date (None if the page gave none we could read), clock
+    times are also kept as minutes after midnight, ``duration_min`` is in
+    minutes and ``cost`` in cents (None when the page showed no price).
+    Display strings are interned, since airlines, airports and times
+    repeat across thousands of flights. Keys the parser does not know about
+    are kept in ``extra``; ``from_dict``/``to_dict`` convert at the edges.
+    """
+
+    __slots__ = (
+        "origin",
+        "destination",
+        "depart",
+        "dep_time",
+        "arr_time",
+        "dep_min",
+        "arr_min",
+        "duration",
+        "duration_min",
+        "cost",
+        "airline",
+        "stops",
+        "num_stops",
+        "flight_numbers",
+        "intermediate_airports",
+        "extra",
+    )
+
+    def __init__(
+        self,
+        origin,
+        destination,
+        depart,
+        dep_time="",
+        arr_time="",
+        duration="",
+        cost=None,
+        airline="",
+        stops="",
+        num_stops=0,
+        flight_numbers=(),
+        intermediate_airports=(),
+        extra=None,
+    ):
+        self.origin = _intern(origin)
+        self.destination = _intern(destination)
+        self.depart = depart
+        self.dep_time = _intern(dep_time)
+        self.arr_time = _intern(arr_time)
+        self.dep_min = _clock_minutes(dep_time)
+        self.arr_min = _clock_minutes(arr_time)
+        self.duration = _intern(duration)
+        self.duration_min = parse_duration_str(duration)
+        self.cost = cost
+        self.airline = _intern(airline)
+        self.stops = _intern(stops)
+        self.num_stops = num_stops
+        self.flight_numbers = tuple(flight_numbers)
+        self.intermediate_airports = tuple(_intern(a) for a in intermediate_airports)
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, d):
+        extra = {k: v for k, v in d.items() if k not in _FLIGHT_KEYS}
+        try:
+            depart = _parse_day(d["depart"])
+        except Exception:
+            depart = None
+            if "depart" in d:
+                extra["depart"] = d["depart"]
+        return cls(
+            d.get("from", ""),
+            d.get("to", ""),
+            depart,
+            dep_time=d.get("dep_time", ""),
+            arr_time=d.get("arr_time", ""),
+            duration=d.get("duration", ""),
+            cost=d.get("cost"),
+            airline=d.get("airline", ""),
+            stops=d.get("stops", ""),
+            num_stops=d.get("num_stops", 0),
+            flight_numbers=d.get("flight_numbers", ()),
+            intermediate_airports=d.get("intermediate_airports", ()),
+            extra=extra,
+        )
+
+    def to_dict(self):
+        d = dict(self.extra) if self.extra else {}
+        if self.depart is not None:
+            d["depart"] = self.depart.isoformat()
+        d["stops"] = self.stops
+        d["airline"] = self.airline
+        d["flight_numbers"] = list(self.flight_numbers)
+        d["dep_time"] = self.dep_time
+        d["arr_time"] = self.arr_time
+        d["intermediate_airports"] = list(self.intermediate_airports)
+        d["num_stops"] = self.num_stops
+        if self.cost is not None:
+            d["cost"] = self.cost
+        d["duration"] = self.duration
+        d["from"] = self.origin
+        d["to"] = self.destination
+        return d
+
+    @property
+    def nonstop(self):
+        return "nonstop" in self.stops.lower()
+
+    def __repr__(self):
+        return f"Flight({self.origin}->{self.destination} {self.depart} {self.dep_time} {self.airline})"
+
+
+def as_flights(flights):
+    """Accept flight dicts or Flight records, return Flight records"""
+    return [f if isinstance(f, Flight) else Flight.from_dict(f) for f in flights]
+
+
+def _stay_minutes(o, i):
+    # same result as compute_stay_duration, from pre-parsed fields
+    if o.arr_min is None or i.dep_min is None:
+        return None
+    stay = (i.depart - o.depart).days * 1440 + i.dep_min - o.arr_min
+    if stay < 0:
+        stay += 1440
+    return stay
+
+
+# columns of FlightPair.to_dict and of the csv export
+PAIR_KEYS = [
+    "out_src",
+    "out_dest",
+    "in_src",
+    "in_dest",
+    "out_date",
+    "in_date",
+    "out_dep_time",
+    "out_arr_time",
+    "in_dep_time",
+    "in_arr_time",
+    "out_duration",
+    "in_duration",
+    "out_cost",
+    "in_cost",
+    "total_cost",
+    "out_airline",
+    "in_airline",
+    "out_stops",
+    "in_stops",
+    "total_dur",
+    "stay_dur",
+]
+
+
+class FlightPair:
+    """An outbound and a return Flight with their combined totals"""
+
+    __slots__ = ("out", "inb", "total_cost", "total_dur", "stay_dur")
+
+    def __init__(self, out, inb):
+        self.out = out
+        self.inb = inb
+        self.total_cost = (out.cost or 0) + (inb.cost or 0)
+        self.total_dur = out.duration_min + inb.duration_min
+        self.stay_dur = _stay_minutes(out, inb)
+
+    @property
+    def direct(self):
+        return self.out.nonstop and self.inb.nonstop
+
+    def to_dict(self):
+        o, i = self.out, self.inb
+        return {
+            "out_src": o.origin,
+            "out_dest": o.destination,
+            "in_src": i.origin,
+            "in_dest": i.destination,
+            "out_date": o.depart.isoformat(),
+            "in_date": i.depart.isoformat(),
+            "out_dep_time": o.dep_time,
+            "out_arr_time": o.arr_time,
+            "in_dep_time": i.dep_time,
+            "in_arr_time": i.arr_time,
+            "out_duration": o.duration,
+            "in_duration": i.duration,
+            "out_cost": o.cost or 0,
+            "in_cost": i.cost or 0,
+            "total_cost": self.total_cost,
+            "out_airline": o.airline,
+            "in_airline": i.airline,
+            "out_stops": o.stops,
+            "in_stops": i.stops,
+            "total_dur": self.total_dur,
+            "stay_dur": self.stay_dur,
+        }
+
+    def __repr__(self):
+        return f"FlightPair({self.out!r}, {self.inb!r}, total_cost={self.total_cost})"
+
+
+class _InboundIndex:
+    """Dated inbound flights bucketed by date, and by route when
+    ``same_airports`` requires the return to fly from the outbound
+    destination back to its origin. ``candidates`` gives the
+    ``(position, flight)`` entries an outbound flight can pair with, in
+    input order."""
+
+    def __init__(self, inbound_list, same_airports=False):
+        self.same_airports = same_airports
+        self.buckets = collections.defaultdict(list)
+        for position, flight in enumerate(inbound_list):
+            if flight.depart is None:
+                continue
+            route = (flight.origin, flight.destination) if same_airports else None
+            self.buckets[route, flight.depart].append((position, flight))
+        self.dates_by_route = collections.defaultdict(list)
+        for route, date in self.buckets:
+            self.dates_by_route[route].append(date)
+        for dates in self.dates_by_route.values():
+            dates.sort()
+        self._cache = {}
+
+    def key(self, o):
+        if not self.same_airports:
+            return None, o.depart
+        return (o.destination, o.origin), o.depart
+
+    def candidates(self, o):
+        key = self.key(o)
+        candidates = self._cache.get(key)
+        if candidates is None:
+            route, date = key
+            dates = self.dates_by_route.get(route, [])
+            later = dates[bisect.bisect_right(dates, date):]
+            candidates = list(
+                heapq.merge(*[self.buckets[route, d] for d in later], key=lambda entry: entry[0])
+            )
+            self._cache[key] = candidates
+        return candidates
+
+
+def pair_flights(outbound_list, inbound_list, same_airports=False):
+    """Pair every outbound flight with every inbound flight on a later date.
+
+    Inbound flights are indexed by date, so each outbound flight only visits
+    the inbound flights it can pair with. Pairs come out in the same order
+    as the plain cartesian product would produce them.
+    """
+    outbound_list = as_flights(outbound_list)
+    index = _InboundIndex(as_flights(inbound_list), same_airports)
+    pairs = []
+    for o in outbound_list:
+        if o.depart is None:
+            continue
+        for _, i in index.candidates(o):
+            pairs.append(FlightPair(o, i))
+    return pairs
+
+
+def _depart_time_predicate(depart_time_range):
+    """Return a function telling whether an "HH:MM" time is inside the
+    range, or None (after reporting it) if the range itself is invalid"""
+    try:
+        start_str, end_str = depart_time_range.split("-")
+        start_time = datetime.datetime.strptime(start_str, "%H:%M").time()
+        end_time = datetime.datetime.strptime(end_str, "%H:%M").time()
+    except Exception as e:
+        console.print(f"[red]error parsing depart time range: {e}[/red]")
+        return None
+
+    def in_range(time_str):
+        try:
+            dep = datetime.datetime.strptime(time_str, "%H:%M").time()
+        except Exception:
+            return False
+        return start_time <= dep <= end_time
+
+    return in_range
+
+
+def filter_legs(flights, exclude_airlines=(), direct=False, depart_time_range=None):
+    """Apply the per-leg part of the pair filters to single flights.
+
+    A pair passes exclude/direct if both of its legs do, and the depart
+    time range only looks at the outbound leg, so filtering legs before
+    pairing gives the same pairs as filtering afterwards.
+    """
+    in_range = _depart_time_predicate(depart_time_range) if depart_time_range else None
+    kept = []
+    for flight in as_flights(flights):
+        if exclude_airlines and flight.airline.lower() in exclude_airlines:
+            continue
+        if direct and not flight.nonstop:
+            continue
+        if in_range is not None and not in_range(flight.dep_time):
+            continue
+        kept.append(flight)
+    return kept
+
+
+def top_pairs(outbound_list, inbound_list, k, sort_metric="price", same_airports=False):
+    """The ``k`` best pairs without building every pair.
+
+    Each outbound flight walks its inbound candidates in ascending order of
+    the sort key (price, or departure time for stay length), and a heap
+    merges those streams, so only about ``k`` pairs are ever built. Ties
+    break in product order, which is what the stable sort in sort_pairs
+    gives, so the result equals ``sort_pairs(pair_flights(...))[:k]``.
+    """
+    if sort_metric not in ("price", "total time"):
+        return sort_pairs(pair_flights(outbound_list, inbound_list, same_airports), sort_metric)[:k]
+    if k <= 0:
+        return []
+    inf = float("inf")
+    outbound_list = as_flights(outbound_list)
+    index = _InboundIndex(as_flights(inbound_list), same_airports)
+    by_cost = {}
+    by_departure = {}
+
+    def ordered(o):
+        # (key part, position, flight) for each inbound candidate, ascending
+        key = index.key(o)
+        if sort_metric == "price":
+            if key not in by_cost:
+                by_cost[key] = sorted(
+                    (i.cost or 0, position, i) for position, i in index.candidates(o)
+                )
+            return by_cost[key]
+        if o.arr_min is None:
+            # every pair with this outbound has an unknown stay
+            return [(inf, position, i) for position, i in index.candidates(o)]
+        if key not in by_departure:
+            by_departure[key] = sorted(
+                (
+                    i.depart.toordinal() * 1440 + i.dep_min if i.dep_min is not None else inf,
+                    position,
+                    i,
+                )
+                for position, i in index.candidates(o)
+            )
+        return by_departure[key]
+
+    heap = []
+    streams = []
+    for o_position, o in enumerate(outbound_list):
+        if o.depart is None:
+            continue
+        stream = ordered(o)
+        if not stream:
+            continue
+        if sort_metric == "price":
+            base = o.cost or 0
+        else:
+            base = -(o.depart.toordinal() * 1440 + o.arr_min) if o.arr_min is not None else inf
+        streams.append((o, stream, base))
+        key_part, i_position, _ = stream[0]
+        heapq.heappush(heap, (base + key_part, o_position, i_position, len(streams) - 1, 0))
+
+    result = []
+    while heap and len(result) < k:
+        _, o_position, _, stream_id, pos = heapq.heappop(heap)
+        o, stream, base = streams[stream_id]
+        result.append(FlightPair(o, stream[pos][2]))
+        pos += 1
+        if pos < len(stream):
+            key_part, i_position, _ = stream[pos]
+            heapq.heappush(heap, (base + key_part, o_position, i_position, stream_id, pos))
+    return result
+
+
+def format_date_with_day(date_str):
+    try:
+        d = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+        return f"{date_str} ({d.strftime('%a')})"
+    except Exception:
+        return date_str
+
+
+def sort_pairs(pairs, sort_metric):
+    if sort_metric == "price":
+        return sorted(pairs, key=lambda x: x.total_cost)
+    if sort_metric == "total time":
+        return sorted(
+            pairs,
+            key=lambda x: x.stay_dur if x.stay_dur is not None else float("inf"),
+        )
+    return pairs
+
+
+def print_pairs(topn):
+    from rich.table import Table
+
+    table = Table(title="cheapest round-trip options")
+    table.add_column("route")
+    table.add_column("outbound (dep-arr, duration)")
+    table.add_column("outbound date")
+    table.add_column("inbound (dep-arr, duration)")
+    table.add_column("inbound date")
+    table.add_column("stay", justify="center")
+    table.add_column("prices (out/in/total)", justify="right")
+    table.add_column("airlines")
+    table.add_column("direct?", justify="center")
+    table.add_column("flight time", style="green")
+    for p in topn:
+        o, i = p.out, p.inb
+        route = f"{o.origin} -> {o.destination} / {i.origin} -> {i.destination}"
+        outbound_str = f"{o.dep_time} - {o.arr_time} ({o.duration})"
+        inbound_str = f"{i.dep_time} - {i.arr_time} ({i.duration})"
+        prices = f"${(o.cost or 0)/100:.2f} / ${(i.cost or 0)/100:.2f} / ${p.total_cost/100:.2f}"
+        airlines = f"{o.airline} / {i.airline}"
+        direct = "yes" if p.direct else "no"
+        flight_time = f"{p.total_dur} min"
+        stay_str = humanize_duration(p.stay_dur) if p.stay_dur is not None else "n/a"
+        out_date_str = format_date_with_day(o.depart.isoformat())
+        in_date_str = format_date_with_day(i.depart.isoformat())
+        table.add_row(
+            route,
+            outbound_str,
+            out_date_str,
+            inbound_str,
+            in_date_str,
+            stay_str,
+            prices,
+            airlines,
+            direct,
+            flight_time,
+        )
+    console.print(table)
+
+
+def save_csv(pairs, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PAIR_KEYS)
+        writer.writeheader()
+        for pair in pairs:
+            writer.writerow(pair.to_dict())
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""Columnar storage for collected flight history.
+
+Collected flights are kept as a Parquet dataset partitioned by the day
+they were collected and by route:
+
+    <root>/log_day=2026-03-01/route=SFO-LAX/part-<id>-0.parquet
+
+Columns are typed (dates, minute counts, costs in cents), and airports,
+airlines and stop descriptions are dictionary encoded. A single route's
+history is read by opening only that route's partitions.
+
+Parts are named after the collection run they hold (``run_name``), both
+when the collector writes them and when JSONL is compacted, and a run's
+parts are replaced rather than added to, so compacting the same file
+again, or a file the collector already wrote here, adds nothing twice.
+
+    python history.py compact flight_data/*.jsonl --out flight_history
+    python history.py prices SFO LAX --root flight_history
+
+Needs the optional pyarrow package.
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import queue
+import threading
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from rich.console import Console
+from rich.table import Table
+
+from flights import Flight
+
+console = Console()
+
+DEFAULT_ROOT = Path("flight_history")
+
+_CLOSE = object()
+
+
+def _category():
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+SCHEMA = pa.schema([
+    ("origin", _category()),
+    ("destination", _category()),
+    ("depart", pa.date32()),
+    ("dep_time", pa.string()),
+    ("arr_time", pa.string()),
+    ("dep_min", pa.int16()),
+    ("arr_min", pa.int16()),
+    ("duration", pa.string()),
+    ("duration_min", pa.int32()),
+    ("cost", pa.int32()),
+    ("airline", _category()),
+    ("stops", _category()),
+    ("num_stops", pa.int8()),
+    ("flight_numbers", pa.list_(pa.string())),
+    ("intermediate_airports", pa.list_(_category())),
+    ("log_date", pa.timestamp("s")),
+    ("search_date", pa.date32()),
+    ("log_day", pa.string()),
+    ("route", pa.string()),
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("log_day", pa.string()), ("route", pa.string())]), flavor="hive"
+)
+
+
+# a collection run shares one log_date and a few hundred search dates
+@functools.lru_cache(maxsize=4096)
+def _timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).replace(microsecond=0)
+    except (TypeError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def records_to_table(records):
+    """Collected flight dicts (with log_date/search_date) as a typed table"""
+    columns = {name: [] for name in SCHEMA.names}
+    for record in records:
+        f = Flight.from_dict(record)
+        log_date = _timestamp(record.get("log_date"))
+        columns["origin"].append(f.origin)
+        columns["destination"].append(f.destination)
+        columns["depart"].append(f.depart)
+        columns["dep_time"].append(f.dep_time)
+        columns["arr_time"].append(f.arr_time)
+        columns["dep_min"].append(f.dep_min)
+        columns["arr_min"].append(f.arr_min)
+        columns["duration"].append(f.duration)
+        columns["duration_min"].append(f.duration_min)
+        columns["cost"].append(f.cost)
+        columns["airline"].append(f.airline)
+        columns["stops"].append(f.stops)
+        columns["num_stops"].append(f.num_stops)
+        columns["flight_numbers"].append(list(f.flight_numbers))
+        columns["intermediate_airports"].append(list(f.intermediate_airports))
+        columns["log_date"].append(log_date)
+        columns["search_date"].append(_date(record.get("search_date")))
+        columns["log_day"].append(log_date.date().isoformat() if log_date else "unknown")
+        columns["route"].append(f"{f.origin}-{f.destination}")
+    return pa.table(
+        [pa.array(columns[field.name], type=field.type) for field in SCHEMA],
+        schema=SCHEMA,
+    )
+
+
+def write_table(table, root, name=None):
+    """Add ``table`` to the dataset under ``root`` as new files, named
+    ``part-<name>-<i>.parquet`` (a random name by default)"""
+    ds.write_dataset(
+        table,
+        root,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{name or uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def run_name(log_date):
+    """The part name for a collection run's flights"""
+    return f"run{log_date:%Y%m%d%H%M%S}"
+
+
+def remove_parts(root, name):
+    """Delete the files a ParquetSink called ``name`` wrote; returns how many"""
+    parts = list(Path(root).glob(f"log_day=*/route=*/part-{name}-*.parquet"))
+    for part in parts:
+        part.unlink()
+    return len(parts)
+
+
+class ParquetSink:
+    """Buffers collected records and writes them to the dataset in batches
+    of ``batch_rows``; same write/write_many/flush/close calls as
+    writers.JsonlWriter.
+
+    Full batches are converted and written by a background thread, so the
+    caller (the collector's event loop) only appends to a list. ``flush``
+    and ``close`` wait until everything written so far is in the dataset.
+    An error in the thread is raised by the next call.
+
+    With a ``name``, the n-th batch is written as ``part-<name>-<n>-*``
+    files, which remove_parts can find again.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, batch_rows=50_000, name=None):
+        self.root = Path(root)
+        self.batch_rows = batch_rows
+        self.name = name
+        self.stats = {"records": 0, "flushes": 0}
+        self._pending = []
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="parquet-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError("write to closed ParquetSink")
+
+    def write(self, record):
+        self._check()
+        if "searched" in record:
+            return  # a collector search marker, not a flight
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_rows:
+            self._hand_off()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def _hand_off(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self._queue.put(pending)
+
+    def flush(self):
+        """Block until every record written so far is in the dataset"""
+        self._check()
+        self._hand_off()
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        self._check()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._hand_off()
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+            elif self._error is None:
+                # after an error, keep draining so flush/close never hang
+                try:
+                    name = None if self.name is None else f"{self.name}-{self.stats['flushes']}"
+                    write_table(records_to_table(item), self.root, name)
+                except Exception as e:
+                    self._error = e
+                else:
+                    self.stats["records"] += len(item)
+                    self.stats["flushes"] += 1
+
+
+def compact_jsonl(paths, root=DEFAULT_ROOT, batch_rows=200_000):
+    """Convert collector JSONL files into the dataset, replacing the parts
+    of every run they hold; returns (rows, bad lines)"""
+    bad = rows = 0
+    opened = {}  # run name -> sinks opened for it so far
+    name = sink = None
+    try:
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        bad += 1
+                        continue
+                    log_date = _timestamp(record.get("log_date"))
+                    run = run_name(log_date) if log_date else Path(path).stem
+                    if run != name:
+                        # a run's lines are consecutive, so only one sink
+                        # is ever buffering
+                        if sink is not None:
+                            sink.close()
+                            rows += sink.stats["records"]
+                        count = opened.get(run, 0)
+                        if not count:
+                            remove_parts(root, run)
+                        opened[run] = count + 1
+                        name = run
+                        sink = ParquetSink(root, batch_rows, f"{run}-p{count}" if count else run)
+                    sink.write(record)
+    finally:
+        if sink is not None:
+            sink.close()
+            rows += sink.stats["records"]
+    return rows, bad
+
+
+def dataset(root=DEFAULT_ROOT):
+    return ds.dataset(root, format="parquet", partitioning=PARTITIONING)
+
+
+def read_route(root, origin, destination, columns=None, filter=None):
+    """Every collected flight for one route, reading only its partitions"""
+    condition = ds.field("route") == f"{origin.upper()}-{destination.upper()}"
+    if filter is not None:
+        condition = condition & filter
+    return dataset(root).to_table(columns=columns, filter=condition)
+
+
+def price_history(root, origin, destination, depart=None):
+    """Cheapest fare per (collection day, departure date) for a route"""
+    filter = ds.field("depart") == depart if depart is not None else None
+    table = read_route(root, origin, destination, ["log_day", "depart", "cost"], filter)
+    table = table.filter(pc.is_valid(table["cost"]))
+    table = table.group_by(["log_day", "depart"]).aggregate([("cost", "min"), ("cost", "count")])
+    return table.sort_by([("depart", "ascending"), ("log_day", "ascending")])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="columnar flight history")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("compact", help="convert collector jsonl files to parquet")
+    p.add_argument("paths", nargs="+", help="flights_YYYY-MM-DD.jsonl files")
+    p.add_argument("--out", default=str(DEFAULT_ROOT), help=f"dataset directory (default {DEFAULT_ROOT})")
+
+    p = sub.add_parser("prices", help="cheapest fare per collection day for a route")
+    p.add_argument("origin")
+    p.add_argument("destination")
+    p.add_argument("--root", default=str(DEFAULT_ROOT), help=f"dataset directory (default {DEFAULT_ROOT})")
+    p.add_argument("--depart", help="only this departure date (yyyy-mm-dd)")
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        rows, bad = compact_jsonl(args.paths, args.out)
+        console.print(f"[green]wrote {rows} flights to {args.out}[/green]")
+        if bad:
+            console.print(f"[yellow]skipped {bad} unreadable lines[/yellow]")
+        return
+
+    depart = datetime.date.fromisoformat(args.depart) if args.depart else None
+    history = price_history(args.root, args.origin, args.destination, depart).to_pylist()
+    table = Table(title=f"{args.origin.upper()} -> {args.destination.upper()} fares")
+    for column in ("depart", "collected", "cheapest", "flights"):
+        table.add_column(column, justify="right")
+    for row in history:
+        table.add_row(
+            str(row["depart"]),
+            row["log_day"],
+            f"${row['cost_min'] / 100:.2f}",
+            str(row["cost_count"]),
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
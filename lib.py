@@ -1,25 +1,38 @@
-import argparse
 import asyncio
+import collections
 import concurrent.futures
-import csv
+import contextlib
 import datetime
 import json
+import multiprocessing
 import re
-import sys
-from itertools import product
+import signal
+import threading
+import time
+import urllib.parse
 
-from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
 from rich.console import Console
-from rich.progress import (
-    Progress,
-    SpinnerColumn,
-    BarColumn,
-    TimeRemainingColumn,
-    TextColumn,
+
+from flights import (  # noqa: F401, re-exported for the backends and benchmarks
+    PAIR_KEYS,
+    Flight,
+    FlightPair,
+    as_flights,
+    compute_stay_duration,
+    filter_legs,
+    format_date_with_day,
+    humanize_duration,
+    pair_flights,
+    parse_duration_str,
+    print_pairs,
+    save_csv,
+    sort_pairs,
+    top_pairs,
 )
-from rich.table import Table
+from metrics import PARSE_WAIT_SECONDS
 
+# bs4 and playwright are imported where they are used, so that commands
+# which never scrape do not pay for them
 console = Console()
 
 
@@ -36,75 +49,397 @@ def convert_to_24(time_str):
             return time_str
 
 
-def parse_date(date_str, default_year=None):
-    for fmt in ("%m/%d/%Y", "%m/%d"):
-        try:
-            dt = datetime.datetime.strptime(date_str, fmt).date()
-            if fmt == "%m/%d" and default_year:
-                dt = dt.replace(year=default_year)
-            return dt
-        except ValueError:
-            continue
-    raise ValueError(f"invalid date format: {date_str}")
-
-
-def parse_date_range(range_str):
-    # if no '-' present, treat it as a single date
-    if "-" not in range_str:
-        today = datetime.date.today()
-        single_date = parse_date(range_str, default_year=today.year)
-        return [single_date]
-    parts = range_str.split("-")
-    if len(parts) != 2:
-        raise ValueError("date range must be in 'start-end' format")
-    today = datetime.date.today()
-    start = parse_date(parts[0], default_year=today.year)
-    end = parse_date(parts[1], default_year=today.year)
-    if start > end:
-        raise ValueError("start date must not be after end date")
-    return [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
-
-
-async def create_browser():
-    playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(
-        headless=True,
-        args=["--disable-gpu", "--no-sandbox"]
-    )
-    return browser, playwright
-
-
-async def fetch_flights_page(origin, destination, depart_date, browser):
-    url = f"https://skiplagged.com/flights/{origin}/{destination}/{depart_date.isoformat()}"
-    page = await browser.new_page()
-    await page.set_extra_http_headers({
-        "User-Agent": "mozilla/5.0 (macintosh; intel mac os x 10_15_7) applewebkit/605.1.15 (khtml, like gecko) version/18.0.1 safari/605.1.15"
-    })
+USER_AGENT = "mozilla/5.0 (macintosh; intel mac os x 10_15_7) applewebkit/605.1.15 (khtml, like gecko) version/18.0.1 safari/605.1.15"
+BROWSER_ARGS = ["--disable-gpu", "--no-sandbox"]
+SKIPLAGGED_URL = "https://skiplagged.com"
+
+
+def flights_url(origin, destination, depart_date, base_url=SKIPLAGGED_URL):
+    return f"{base_url}/flights/{origin}/{destination}/{depart_date.isoformat()}"
+
+
+READY_TIMEOUT_MS = 15000  # max wait for the results list or the empty banner
+SETTLE_INTERVAL = 0.25  # seconds between trip count checks
+SETTLE_CHECKS = 2  # unchanged checks in a row before results count as stable
+SETTLE_TIMEOUT = 5.0  # give up waiting for a stable count after this long
+
+
+async def wait_for_results(page, timings):
+    """Wait until results (or the empty-results banner) are shown and stable.
+
+    Both selectors are raced in a single wait, so an empty route returns as
+    soon as its banner appears, even when the banner is inside the results
+    section. When trips are shown, the trip count is polled until it stops
+    changing, or until the banner shows up instead. Records "ready" and
+    "settle" seconds in ``timings`` and returns "found_trips", "no_trips"
+    or "timeout".
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
     try:
-        await page.goto(url)
-        try:
-            trip_list_locator = page.locator(".trip-list-section")
-            trip_list_empty_locator = page.locator(".trip-list-empty")
-            from playwright.async_api import expect
+        await page.wait_for_selector(
+            ".trip-list-section, .trip-list-empty",
+            state="visible",
+            timeout=READY_TIMEOUT_MS,
+        )
+    except Exception:
+        timings["ready"] = loop.time() - start
+        return "timeout"
+    timings["ready"] = loop.time() - start
+
+    start = loop.time()
+    # the banner may sit inside the results section, so look for it first
+    empty = page.locator(".trip-list-empty").first
+    if await empty.is_visible() or not await page.locator(".trip-list-section").first.is_visible():
+        timings["settle"] = 0.0
+        return "no_trips"
+    trips = page.locator("div.trip")
+    last_count = await trips.count()
+    unchanged = 0
+    while unchanged < SETTLE_CHECKS and loop.time() - start < SETTLE_TIMEOUT:
+        await asyncio.sleep(SETTLE_INTERVAL)
+        count = await trips.count()
+        if not count and await empty.is_visible():
+            timings["settle"] = loop.time() - start
+            return "no_trips"
+        if count == last_count and count > 0:
+            unchanged += 1
+        else:
+            unchanged = 0
+        last_count = count
+    timings["settle"] = loop.time() - start
+    return "found_trips"
+
+
+async def load_flights_page(page, origin, destination, depart_date, base_url=SKIPLAGGED_URL, timings=None):
+    if timings is None:
+        timings = {}
+    loop = asyncio.get_running_loop()
+    url = flights_url(origin, destination, depart_date, base_url)
+    start = loop.time()
+    await page.goto(url)
+    timings["navigate"] = loop.time() - start
+    try:
+        timings["result"] = await wait_for_results(page, timings)
+    except Exception as e:
+        timings["result"] = "error"
+        console.print(f"[red]timeout waiting for page {url}: {e}[/red]")
+    start = loop.time()
+    html = await page.content()
+    timings["content"] = loop.time() - start
+    return html
 
+
+# resource types parse_flights never needs; stylesheets are left out because
+# readiness is judged by element visibility, which depends on the site css
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "adservice.google.com",
+    "amazon-adsystem.com",
+    "facebook.net",
+    "connect.facebook.com",
+    "hotjar.com",
+    "clarity.ms",
+    "bat.bing.com",
+    "criteo.com",
+    "criteo.net",
+    "taboola.com",
+    "outbrain.com",
+    "segment.io",
+    "quantserve.com",
+    "scorecardresearch.com",
+)
+# file extensions of the blocked resource types; only urls with one of
+# these, or on a blocked host, are routed through the blocker at all
+BLOCKED_EXTENSIONS = {
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico", "bmp"),
+    "media": ("mp4", "webm", "mp3", "ogg", "m4a", "wav", "m3u8"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+}
+# rough transfer size of an aborted request, used to estimate bytes saved
+ESTIMATED_BYTES = {
+    "image": 40_000,
+    "media": 500_000,
+    "font": 60_000,
+    "stylesheet": 50_000,
+    "script": 60_000,
+}
+
+
+class RequestBlocker:
+    """Aborts asset and tracker requests on a browser context.
+
+    A request is blocked when its resource type is in ``resource_types`` or
+    its host matches ``deny_hosts``, unless the host matches ``allow_hosts``.
+    Hosts match on the domain or any subdomain. Blocked requests and an
+    estimate of the bytes they would have transferred are counted per page
+    (reset around each search) and in ``totals``.
+
+    Only urls that can be blocked (a blocked type's file extension or a
+    denied host) are routed, so other requests never wait on the handler.
+    Assets served without a telling extension get through. Playwright
+    turns off the HTTP cache of a context with any route installed, so the
+    scripts and stylesheets that are allowed are downloaded again on every
+    search. ``--no-block-assets`` keeps the cache instead.
+    """
+
+    def __init__(self, resource_types=BLOCKED_RESOURCE_TYPES, deny_hosts=BLOCKED_HOSTS, allow_hosts=()):
+        self.resource_types = frozenset(resource_types)
+        self.deny_hosts = tuple(deny_hosts)
+        self.allow_hosts = tuple(allow_hosts)
+        self.totals = {"blocked_requests": 0, "est_bytes_saved": 0}
+        self._per_page = {}
+        extensions = [e for kind in self.resource_types for e in BLOCKED_EXTENSIONS.get(kind, ())]
+        patterns = []
+        if extensions:
+            patterns.append(r"^[^?#]*\.(?:" + "|".join(sorted(extensions)) + r")(?:[?#]|$)")
+        if self.deny_hosts:
+            hosts = "|".join(re.escape(h) for h in self.deny_hosts)
+            patterns.append(r"^[a-z]+://(?:[^/?#]*\.)?(?:" + hosts + r")(?::\d+)?(?:[/?#]|$)")
+        self.pattern = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+
+    @staticmethod
+    def _host_matches(host, patterns):
+        return any(host == p or host.endswith("." + p) for p in patterns)
+
+    def should_block(self, url, resource_type):
+        host = urllib.parse.urlsplit(url).hostname or ""
+        if self._host_matches(host, self.allow_hosts):
+            return False
+        return resource_type in self.resource_types or self._host_matches(host, self.deny_hosts)
+
+    async def install(self, context):
+        if self.pattern is not None:
+            await context.route(self.pattern, self._handle)
+
+    async def _handle(self, route):
+        request = route.request
+        if not self.should_block(request.url, request.resource_type):
+            await route.continue_()
+            return
+        await route.abort()
+        saved = ESTIMATED_BYTES.get(request.resource_type, 5_000)
+        self.totals["blocked_requests"] += 1
+        self.totals["est_bytes_saved"] += saved
+        try:
+            counters = self._per_page.get(request.frame.page)
+        except Exception:
+            counters = None
+        if counters is not None:
+            counters["blocked_requests"] += 1
+            counters["est_bytes_saved"] += saved
+
+    def reset(self, page):
+        self._per_page[page] = {"blocked_requests": 0, "est_bytes_saved": 0}
+
+    def take(self, page):
+        return self._per_page.pop(page, {"blocked_requests": 0, "est_bytes_saved": 0})
+
+
+class _BrowserSlot:
+    """One chromium instance in a BrowserPool, with its context and idle pages"""
+
+    def __init__(self, index):
+        self.index = index
+        self.browser = None
+        self.context = None
+        self.idle_pages = []
+        self.active = 0
+        self.navigations = 0
+        self.draining = False
+        self.lock = asyncio.Lock()
+
+    def healthy(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    async def launch(self, playwright, warm_pages=0, blocker=None):
+        self.browser = await playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+        self.context = await self.browser.new_context()
+        await self.context.set_extra_http_headers({"User-Agent": USER_AGENT})
+        if blocker is not None:
+            await blocker.install(self.context)
+        self.idle_pages = []
+        self.navigations = 0
+        self.draining = False
+        for _ in range(warm_pages):
+            page = await self.context.new_page()
+            await page.goto("about:blank")
+            self.idle_pages.append(page)
+
+    async def close(self):
+        browser = self.browser
+        self.browser = None
+        self.context = None
+        self.idle_pages = []
+        if browser is not None:
             try:
-                await expect(trip_list_locator).to_be_visible(timeout=15000)
-                result = "found_trips"
-            except:
+                await browser.close()
+            except Exception:
+                pass
+
+
+class BrowserPool:
+    """Shared pool of warm chromium browsers with reusable pages.
+
+    At most ``size * pages_per_browser`` pages are leased at once. A browser
+    that has served ``max_navigations`` searches stops taking new leases and
+    is relaunched once its last page is returned, which caps memory growth
+    over long runs. Disconnected browsers are relaunched on the next lease.
+    Every context gets a RequestBlocker installed (``blocker``, or a default
+    one); pass ``block_assets=False`` to load pages with all their assets.
+    """
+
+    def __init__(self, size=2, pages_per_browser=3, max_navigations=50, block_assets=True, blocker=None):
+        if size < 1 or pages_per_browser < 1:
+            raise ValueError("pool size and pages per browser must be at least 1")
+        self.size = size
+        self.pages_per_browser = pages_per_browser
+        self.max_navigations = max_navigations
+        if blocker is None and block_assets:
+            blocker = RequestBlocker()
+        self.blocker = blocker if block_assets else None
+        self.stats = {"launches": 0, "recycles": 0, "navigations": 0, "page_errors": 0}
+        self.timings = collections.deque(maxlen=1000)
+        self._playwright = None
+        self._slots = []
+        self._semaphore = asyncio.Semaphore(size * pages_per_browser)
+
+    async def start(self):
+        from playwright.async_api import async_playwright
+
+        self._playwright = await async_playwright().start()
+        self._slots = [_BrowserSlot(i) for i in range(self.size)]
+        try:
+            await asyncio.gather(*[self._launch(slot, warm=True) for slot in self._slots])
+        except Exception:
+            await self.close()
+            raise
+        return self
+
+    async def close(self):
+        await asyncio.gather(*[slot.close() for slot in self._slots])
+        self._slots = []
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _launch(self, slot, warm=False):
+        await slot.close()
+        await slot.launch(
+            self._playwright, self.pages_per_browser if warm else 0, self.blocker
+        )
+        self.stats["launches"] += 1
+
+    def _pick_slot(self):
+        candidates = [s for s in self._slots if not s.draining] or self._slots
+        return min(candidates, key=lambda s: s.active)
+
+    async def _acquire(self):
+        await self._semaphore.acquire()
+        slot = self._pick_slot()
+        slot.active += 1
+        try:
+            async with slot.lock:
+                if not slot.healthy():
+                    await self._launch(slot)
+                page = None
+                while slot.idle_pages and page is None:
+                    page = slot.idle_pages.pop()
+                    if page.is_closed():
+                        page = None
+                if page is None:
+                    page = await slot.context.new_page()
+        except Exception:
+            slot.active -= 1
+            self._semaphore.release()
+            raise
+        slot.navigations += 1
+        self.stats["navigations"] += 1
+        if self.max_navigations and slot.navigations >= self.max_navigations:
+            slot.draining = True
+        return slot, page
+
+    async def _release(self, slot, page, ok):
+        try:
+            if ok and not slot.draining and not page.is_closed():
+                slot.idle_pages.append(page)
+            else:
+                if not ok:
+                    self.stats["page_errors"] += 1
                 try:
-                    await expect(trip_list_empty_locator).to_be_visible(timeout=15000)
-                    result = "no_trips"
-                except:
-                    result = "timeout"
-            await asyncio.sleep(2)
-        except Exception as e:
-            console.print(f"[red]timeout waiting for page {url}: {e}[/red]")
-        html = await page.content()
-    finally:
-        await page.close()
-    return html
+                    await page.close()
+                except Exception:
+                    pass
+            slot.active -= 1
+            if slot.draining and slot.active == 0:
+                async with slot.lock:
+                    if slot.draining and slot.active == 0:
+                        await self._launch(slot)
+                        self.stats["recycles"] += 1
+        finally:
+            self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        slot, page = await self._acquire()
+        ok = False
+        try:
+            yield page
+            ok = True
+        finally:
+            await self._release(slot, page, ok)
+
+    async def fetch_flights_page(
+        self, origin, destination, depart_date, base_url=SKIPLAGGED_URL, timings=None
+    ):
+        """The results page html; ``timings`` (if given) receives the page's
+        phase timings and its "result" from wait_for_results"""
+        if timings is None:
+            timings = {}
+        timings.update(route=f"{origin}-{destination}", date=depart_date.isoformat())
+        try:
+            async with self.page() as page:
+                if self.blocker is not None:
+                    self.blocker.reset(page)
+                try:
+                    return await load_flights_page(
+                        page, origin, destination, depart_date, base_url, timings
+                    )
+                finally:
+                    if self.blocker is not None:
+                        timings.update(self.blocker.take(page))
+        finally:
+            self.timings.append(timings)
+
+    def phase_summary(self):
+        """Mean, p95 and max per page phase (seconds) and per-page blocking
+        counters over recent searches"""
+        summary = {}
+        for phase in ("navigate", "ready", "settle", "content", "blocked_requests", "est_bytes_saved"):
+            values = sorted(t[phase] for t in self.timings if phase in t)
+            if values:
+                summary[phase] = {
+                    "count": len(values),
+                    "mean": sum(values) / len(values),
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                    "max": values[-1],
+                }
+        return summary
+
+def _parse_flights_bs4(html, origin, destination):
+    from bs4 import BeautifulSoup
 
-def parse_flights(html, origin, destination):
     soup = BeautifulSoup(html, "html.parser")
     flights = []
     for div in soup.find_all("div", class_="trip", id=True):
@@ -189,233 +524,302 @@ def parse_flights(html, origin, destination):
         flights.append(flight)
     return flights
 
-async def search_flights(origin, destination, depart_date, browser):
-    html = await fetch_flights_page(origin, destination, depart_date, browser)
-    return parse_flights(html, origin, destination)
+def _has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
 
 
-async def fetch_flights_for_page(origin, destination, depart_date):
-    browser, playwright = await create_browser()
-    try:
-        flights = await search_flights(origin, destination, depart_date, browser)
-    finally:
-        await browser.close()
-        await playwright.stop()
-    return flights
+_LXML_XPATHS = {
+    "trips": f"//div[@id and {_has_class('trip')}]",
+    "stops": f".//span[{_has_class('trip-stops')}]",
+    "airline": f".//span[{_has_class('airlines')}]",
+    "first_point": './/div[normalize-space(@class) = "trip-path-point trip-path-point-first"]',
+    "last_point": './/div[normalize-space(@class) = "trip-path-point trip-path-point-last"]',
+    "point_time": f".//div[{_has_class('trip-path-point-time')}]",
+    "layovers": f".//div[{_has_class('trip-path-point-airport-demp')}]",
+    "airport_code": f".//span[{_has_class('airport-code')}]",
+    "cost": f".//div[{_has_class('trip-cost')}]",
+    "span": ".//span",
+    "duration": f".//div[{_has_class('trip-path-duration')}]",
+}
+# compiled XPath objects are kept per thread so a thread parse pool can use them
+_lxml_local = threading.local()
 
+# BeautifulSoup leaves the contents of these tags out of get_text()
+_NON_TEXT_TAGS = frozenset(("script", "style", "template"))
 
-def parse_duration_str(dur_str):
-    match = re.search(r"(\d+)\s*h", dur_str)
-    hours = int(match.group(1)) if match else 0
-    match = re.search(r"(\d+)\s*m", dur_str)
-    minutes = int(match.group(1)) if match else 0
-    return hours * 60 + minutes
 
+def _lxml_strings(elem):
+    if elem.tag not in _NON_TEXT_TAGS and elem.text:
+        yield elem.text
+    for child in elem:
+        # comments and processing instructions have a non-string tag
+        if isinstance(child.tag, str):
+            yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
 
-def humanize_duration(minutes):
-    days = minutes // 1440
-    rem = minutes % 1440
-    hours = rem // 60
-    result = ""
-    if days:
-        result += f"{days}d "
-    result += f"{hours}h"
-    return result.strip()
 
+def _lxml_text(elem):
+    """Equivalent of BeautifulSoup's ``get_text(strip=True)``"""
+    return "".join(s.strip() for s in _lxml_strings(elem))
 
-def compute_stay_duration(o, i):
-    try:
-        out_date = datetime.datetime.strptime(o["depart"], "%Y-%m-%d").date()
-        in_date = datetime.datetime.strptime(i["depart"], "%Y-%m-%d").date()
-        out_arr = datetime.datetime.strptime(o["arr_time"], "%H:%M").time()
-        in_dep = datetime.datetime.strptime(i["dep_time"], "%H:%M").time()
-        out_dt = datetime.datetime.combine(out_date, out_arr)
-        in_dt = datetime.datetime.combine(in_date, in_dep)
-        stay = in_dt - out_dt
-        if stay.total_seconds() < 0:
-            stay += datetime.timedelta(days=1)
-        return int(stay.total_seconds() // 60)
-    except Exception:
-        return None
 
+def _parse_flights_lxml(html, origin, destination):
+    from lxml import etree, html as lxml_html
 
-def pair_flights(outbound_list, inbound_list):
-    pairs = []
-    for o, i in product(outbound_list, inbound_list):
+    xp = getattr(_lxml_local, "xpaths", None)
+    if xp is None:
+        xp = _lxml_local.xpaths = {k: etree.XPath(v) for k, v in _LXML_XPATHS.items()}
+
+    def first(name, elem):
+        found = xp[name](elem)
+        return found[0] if found else None
+
+    if not html.strip():
+        return []
+    root = lxml_html.document_fromstring(html)
+    flights = []
+    for div in xp["trips"](root):
+        flight_id = div.get("id", "")
+        if "|" not in flight_id:
+            continue
+        flight = {}
         try:
-            o_date = datetime.datetime.strptime(o["depart"], "%Y-%m-%d").date()
-            i_date = datetime.datetime.strptime(i["depart"], "%Y-%m-%d").date()
+            _, json_part = flight_id.split("|", 1)
+            flight.update(json.loads(json_part))
         except Exception:
             continue
-        if o_date < i_date:
-            out_cost = o.get("cost", 0)
-            in_cost = i.get("cost", 0)
-            total_cost = out_cost + in_cost
-            out_dur = parse_duration_str(o.get("duration", ""))
-            in_dur = parse_duration_str(i.get("duration", ""))
-            total_dur = out_dur + in_dur
-            stay_min = compute_stay_duration(o, i)
-            pair = {
-                "out_src": o.get("from", ""),
-                "out_dest": o.get("to", ""),
-                "in_src": i.get("from", ""),
-                "in_dest": i.get("to", ""),
-                "out_date": o.get("depart", ""),
-                "in_date": i.get("depart", ""),
-                "out_dep_time": o.get("dep_time", ""),
-                "out_arr_time": o.get("arr_time", ""),
-                "in_dep_time": i.get("dep_time", ""),
-                "in_arr_time": i.get("arr_time", ""),
-                "out_duration": o.get("duration", ""),
-                "in_duration": i.get("duration", ""),
-                "out_cost": out_cost,
-                "in_cost": in_cost,
-                "total_cost": total_cost,
-                "out_airline": o.get("airline", ""),
-                "in_airline": i.get("airline", ""),
-                "out_stops": o.get("stops", ""),
-                "in_stops": i.get("stops", ""),
-                "total_dur": total_dur,
-                "stay_dur": stay_min,
-            }
-            pairs.append(pair)
-    return pairs
-
-
-def format_date_with_day(date_str):
-    try:
-        d = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-        return f"{date_str} ({d.strftime('%a')})"
-    except Exception:
-        return date_str
 
+        stops_elem = first("stops", div)
+        flight["stops"] = _lxml_text(stops_elem) if stops_elem is not None else ""
 
-def display_pairs(pairs, top, sort_metric, depart_time_range, direct=False):
-    # filter by outbound depart time range if provided
-    if depart_time_range:
-        try:
-            start_str, end_str = depart_time_range.split("-")
-            start_time = datetime.datetime.strptime(start_str, "%H:%M").time()
-            end_time = datetime.datetime.strptime(end_str, "%H:%M").time()
-            filtered = []
-            for p in pairs:
-                try:
-                    dep = datetime.datetime.strptime(p["out_dep_time"], "%H:%M").time()
-                    if start_time <= dep <= end_time:
-                        filtered.append(p)
-                except Exception:
-                    continue
-            pairs = filtered
-        except Exception as e:
-            console.print(f"[red]error parsing depart time range: {e}[/red]")
-    # filter by direct flights if enabled (both legs must be nonstop)
-    if direct:
-        pairs = [
-            p
-            for p in pairs
-            if "nonstop" in p["out_stops"].lower()
-            and "nonstop" in p["in_stops"].lower()
-        ]
-    if sort_metric == "price":
-        sorted_pairs = sorted(pairs, key=lambda x: x["total_cost"])
-    elif sort_metric == "total time":
-        sorted_pairs = sorted(
-            pairs,
-            key=lambda x: x["stay_dur"] if x["stay_dur"] is not None else float("inf"),
-        )
-    else:
-        sorted_pairs = pairs
-    topn = sorted_pairs[:top]
-    table = Table(title="cheapest round-trip options")
-    table.add_column("route")
-    table.add_column("outbound (dep-arr, duration)")
-    table.add_column("outbound date")
-    table.add_column("inbound (dep-arr, duration)")
-    table.add_column("inbound date")
-    table.add_column("stay", justify="center")
-    table.add_column("prices (out/in/total)", justify="right")
-    table.add_column("airlines")
-    table.add_column("direct?", justify="center")
-    table.add_column("flight time", style="green")
-    for p in topn:
-        route = f"{p['out_src']} -> {p['out_dest']} / {p['in_src']} -> {p['in_dest']}"
-        outbound_str = (
-            f"{p['out_dep_time']} - {p['out_arr_time']} ({p['out_duration']})"
-        )
-        inbound_str = f"{p['in_dep_time']} - {p['in_arr_time']} ({p['in_duration']})"
-        prices = f"${p['out_cost']/100:.2f} / ${p['in_cost']/100:.2f} / ${p['total_cost']/100:.2f}"
-        airlines = f"{p['out_airline']} / {p['in_airline']}"
-        direct = (
-            "yes"
-            if (
-                "nonstop" in p["out_stops"].lower()
-                and "nonstop" in p["in_stops"].lower()
+        airline_elem = first("airline", div)
+        flight["airline"] = _lxml_text(airline_elem) if airline_elem is not None else ""
+
+        flight_numbers = []
+        if airline_elem is not None and "data-original-title" in airline_elem.attrib:
+            tooltip = airline_elem.get("data-original-title", "")
+            flight_numbers = re.findall(r"Flight (\d+)", tooltip)
+        flight["flight_numbers"] = flight_numbers
+
+        for key, point_name in (("dep_time", "first_point"), ("arr_time", "last_point")):
+            point = first(point_name, div)
+            time_elem = first("point_time", point) if point is not None else None
+            flight[key] = (
+                convert_to_24(_lxml_text(time_elem)) if time_elem is not None else ""
             )
-            else "no"
-        )
-        flight_time = f"{p['total_dur']} min"
-        stay_str = (
-            humanize_duration(p["stay_dur"]) if p["stay_dur"] is not None else "n/a"
-        )
-        out_date_str = format_date_with_day(p["out_date"])
-        in_date_str = format_date_with_day(p["in_date"])
-        table.add_row(
-            route,
-            outbound_str,
-            out_date_str,
-            inbound_str,
-            in_date_str,
-            stay_str,
-            prices,
-            airlines,
-            direct,
-            flight_time,
+
+        intermediate_airports = set()
+        for point in xp["layovers"](div):
+            code_elem = first("airport_code", point)
+            if code_elem is not None:
+                code = "".join(_lxml_strings(code_elem)).strip()
+                if code:
+                    intermediate_airports.add(code)
+        flight["intermediate_airports"] = list(intermediate_airports)
+        flight["num_stops"] = len(flight["intermediate_airports"])
+
+        cost_elem = first("cost", div)
+        if cost_elem is not None:
+            price_elem = first("span", cost_elem)
+            if price_elem is not None:
+                digits = re.sub(r"[^\d]", "", _lxml_text(price_elem))
+                if digits:
+                    flight["cost"] = int(digits) * 100
+
+        dur_elem = first("duration", div)
+        flight["duration"] = (
+            _lxml_text(dur_elem).split("|")[0].strip() if dur_elem is not None else ""
         )
-    console.print(table)
-    return sorted_pairs
-
-
-def save_csv(pairs, path):
-    keys = [
-        "out_src",
-        "out_dest",
-        "in_src",
-        "in_dest",
-        "out_date",
-        "in_date",
-        "out_dep_time",
-        "out_arr_time",
-        "in_dep_time",
-        "in_arr_time",
-        "out_duration",
-        "in_duration",
-        "out_cost",
-        "in_cost",
-        "total_cost",
-        "out_airline",
-        "in_airline",
-        "out_stops",
-        "in_stops",
-        "total_dur",
-        "stay_dur",
-    ]
-    with open(path, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=keys)
-        writer.writeheader()
-        for row in pairs:
-            writer.writerow(row)
-
-async def run_tasks(tasks, workers=5):
-    results = []
-    semaphore = asyncio.Semaphore(workers)
-
-    async def bounded_task(task):
-        async with semaphore:
-            return await task
-
-    for result in await asyncio.gather(
-        *[bounded_task(task) for task in tasks], return_exceptions=True
-    ):
-        if not isinstance(result, Exception):
-            results.append(result)
-    return results
+
+        flight.setdefault("from", origin)
+        flight.setdefault("to", destination)
+
+        flights.append(flight)
+    return flights
+
+
+# "bs4" is the reference implementation; "lxml" is faster and produces the
+# same flight dicts, but needs the optional lxml package
+PARSER_ENGINES = {
+    "bs4": _parse_flights_bs4,
+    "lxml": _parse_flights_lxml,
+}
+PARSER_ENGINE = "bs4"
+
+
+def set_parser_engine(name):
+    """Select the engine ``parse_flights`` uses when none is passed"""
+    global PARSER_ENGINE
+    if name not in PARSER_ENGINES:
+        raise ValueError(f"unknown parser engine: {name}")
+    if name == "lxml":
+        try:
+            import lxml.html  # noqa: F401
+        except ImportError as e:
+            raise ValueError("the lxml parser engine needs the lxml package") from e
+    PARSER_ENGINE = name
+
+
+def parse_flights(html, origin, destination, engine=None):
+    flights = PARSER_ENGINES[engine or PARSER_ENGINE](html, origin, destination)
+    return [Flight.from_dict(f) for f in flights]
+
+
+def _timed_parse(html, origin, destination, engine):
+    # runs in the pool worker, so the time is the parse alone and not the
+    # wait for a free worker
+    start = time.perf_counter()
+    flights = parse_flights(html, origin, destination, engine)
+    return flights, time.perf_counter() - start
+
+
+def _parse_worker_init():
+    # ctrl-c reaches the whole process group; shutting down is the parent's
+    # job, and a worker that imported the collector must not run its handlers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+class ParsePool:
+    """Runs parse_flights off the event loop.
+
+    ``kind`` is "process" (spawned worker processes, for the GIL-bound bs4
+    engine), "thread" (for lxml, which releases the GIL while parsing) or
+    "auto" to pick by engine. At most ``max_pending`` pages are queued or
+    being parsed; further callers wait, so fetchers slow down instead of
+    piling html up in memory when parsing falls behind.
+    """
+
+    def __init__(self, workers=2, kind="auto", max_pending=None, engine=None):
+        if workers < 1:
+            raise ValueError("parse pool needs at least one worker")
+        self.engine = engine or PARSER_ENGINE
+        if kind == "auto":
+            kind = "thread" if self.engine == "lxml" else "process"
+        if kind not in ("process", "thread"):
+            raise ValueError(f"unknown parse pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending or workers * 2
+        self.stats = {
+            "parsed": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "parse_seconds": 0.0,
+            "wait_seconds": 0.0,
+        }
+        self._pending = asyncio.Semaphore(self.max_pending)
+        # started on the first parse: runs answered by the http backend or
+        # the cache never parse html, and a process pool costs a process
+        self._executor = None
+
+    def _start(self):
+        if self.kind == "process":
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_parse_worker_init,
+            )
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix="parse"
+            )
+        return self._executor
+
+    async def parse(self, html, origin, destination):
+        """Parse in a worker and return ``(flights, seconds spent parsing)``"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.stats["waiting"] += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], self.stats["waiting"])
+        try:
+            await self._pending.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+        try:
+            flights, seconds = await loop.run_in_executor(
+                self._executor or self._start(), _timed_parse, html, origin, destination, self.engine
+            )
+        finally:
+            self._pending.release()
+        # the rest of the round trip is queueing for a slot or a worker
+        wait = max(0.0, loop.time() - start - seconds)
+        self.stats["parsed"] += 1
+        self.stats["parse_seconds"] += seconds
+        self.stats["wait_seconds"] += wait
+        PARSE_WAIT_SECONDS.observe(wait)
+        return flights, seconds
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+_parse_pool = None
+
+
+def set_parse_pool(pool):
+    """Route parse_flights_async through ``pool`` (None parses inline)"""
+    global _parse_pool
+    _parse_pool = pool
+
+
+async def parse_flights_async(html, origin, destination):
+    """Return ``(flights, seconds spent parsing)``, excluding any wait for the pool"""
+    if _parse_pool is None:
+        return _timed_parse(html, origin, destination, None)
+    return await _parse_pool.parse(html, origin, destination)
+
+
+TaskResult = collections.namedtuple("TaskResult", "item result error elapsed")
+
+
+async def iter_tasks(items, run, workers=5, timeout=None):
+    """Run ``run(item)`` for every item with ``workers`` calls in flight.
+
+    Unlike fixed batches, a new item starts as soon as any call finishes,
+    so one slow search never idles the other workers. Yields a TaskResult
+    per item in completion order; ``error`` holds the exception (an
+    asyncio.TimeoutError once a call exceeds ``timeout`` seconds) and
+    ``result`` is None in that case. Closing the iterator early cancels
+    the calls still running.
+    """
+    pending = iter(items)
+    done = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    async def worker():
+        for item in pending:
+            start = loop.time()
+            try:
+                if timeout is None:
+                    result = await run(item)
+                else:
+                    result = await asyncio.wait_for(run(item), timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await done.put(TaskResult(item, None, e, loop.time() - start))
+            else:
+                await done.put(TaskResult(item, result, None, loop.time() - start))
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    finished = asyncio.ensure_future(asyncio.gather(*tasks))
+    try:
+        while True:
+            getter = asyncio.ensure_future(done.get())
+            await asyncio.wait({getter, finished}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+                continue
+            getter.cancel()
+            while not done.empty():
+                yield done.get_nowait()
+            finished.result()  # surface a crashed worker
+            return
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, finished, return_exceptions=True)
@@ -1,160 +1,245 @@
 import argparse
-import asyncio
 import datetime
 import sys
-from rich.console import Console
-from rich.progress import (
-    Progress,
-    SpinnerColumn,
-    BarColumn,
-    TimeRemainingColumn,
-    TextColumn,
-)
-
-from lib import (
-    parse_date,
-    parse_date_range,
-    fetch_flights_for_page,
-    run_tasks,
-    pair_flights,
-    display_pairs,
-    save_csv,
-)
-
-console = Console()
-
-parser = argparse.ArgumentParser(
-    description="cli for round-trip flight search via headless browser simulation (parallel)"
-)
-parser.add_argument(
-    "origin", help="comma separated candidate source airports (e.g. SAN,SNA,LAX)"
-)
-parser.add_argument(
-    "destinations",
-    help="comma separated candidate destination airports (e.g. SFO,OAK,SJC)",
-)
-parser.add_argument(
-    "--depart", help="outbound date or date range (e.g. 3/7 or 3/7-3/8)"
-)
-parser.add_argument(
-    "--return",
-    dest="return_range",
-    help="return date or date range (e.g. 3/9 or 3/9-3/10)",
-)
-# new weekend flag - if provided, computes weekend dates automatically
-parser.add_argument(
-    "--weekend",
-    default=None,
-    help="specify a date (mm/dd or mm/dd/yyyy) for a weekend trip; computes depart as friday/saturday and return as sunday/monday",
-)
-parser.add_argument(
-    "--top", type=int, default=5, help="number of top results to show (default 5)"
-)
-parser.add_argument(
-    "--sort",
-    choices=["price", "total time"],
-    default="price",
-    help="metric to sort by (default price)",
-)
-parser.add_argument(
-    "--exclude",
-    default="",
-    help="comma separated list of airlines to exclude (default none)",
-)
-parser.add_argument(
-    "--save-csv",
-    default=None,
-    help="path to save full sorted results as csv (default none)",
-)
-parser.add_argument(
-    "--depart-time-range",
-    default=None,
-    help="filter outbound departures within time range, e.g. '08:00-12:00'",
-)
-# add --direct flag; filtering by direct flights is on by default
-group = parser.add_mutually_exclusive_group()
-group.add_argument(
-    "--direct",
-    dest="direct",
-    action="store_true",
-    help="only show direct flights (default)",
-)
-group.add_argument(
-    "--no-direct",
-    dest="direct",
-    action="store_false",
-    help="include flights with stops",
-)
-parser.set_defaults(direct=True)
-parser.add_argument(
-    "--workers", type=int, default=5, help="number of threadpool workers (default 5)"
-)
-args = parser.parse_args()
-
-
-async def async_main():
-    sources = [s.strip().upper() for s in args.origin.split(",")]
-    dests = [d.strip().upper() for d in args.destinations.split(",")]
 
-    # if weekend flag is provided, compute weekend dates; else use provided dates/ranges
-    if args.weekend:
-        try:
-            today = datetime.date.today()
-            weekend_date = parse_date(args.weekend, default_year=today.year)
-        except Exception as e:
-            console.print(f"[red]error parsing weekend date: {e}[/red]")
-            sys.exit(1)
-        wd = weekend_date.weekday()
-        # valid weekend days: friday (4), saturday (5), sunday (6), monday (0)
-        if wd not in (4, 5, 6, 0):
-            console.print(
-                f"[red]provided weekend date {args.weekend} is not part of a weekend (fri-sat-sun-mon)[/red]"
-            )
-            sys.exit(1)
-
-        friday_date = None
-        if wd == 4:  # friday
-            friday_date = weekend_date
-        elif wd == 5:  # saturday
-            friday_date = weekend_date - datetime.timedelta(days=1)
-        elif wd == 6:  # sunday
-            friday_date = weekend_date - datetime.timedelta(days=2)
-        elif wd == 0:  # monday
-            friday_date = weekend_date - datetime.timedelta(days=3)
-
-        depart_dates = [friday_date, friday_date + datetime.timedelta(days=1)]
-        return_dates = [
-            friday_date + datetime.timedelta(days=2),
-            friday_date + datetime.timedelta(days=3),
-        ]
-    else:
-        try:
-            depart_dates = parse_date_range(args.depart)
-            return_dates = parse_date_range(args.return_range)
-        except Exception as e:
-            console.print(f"[red]error parsing date(s): {e}[/red]")
-            sys.exit(1)
+from dates import parse_date, parse_date_range, weekend_dates
 
-    exclude_airlines = (
-        [x.strip().lower() for x in args.exclude.split(",") if x.strip()]
-        if args.exclude
-        else []
+# everything else is imported where it is used, so --help and bad
+# arguments do not wait for asyncio, rich or the search backends
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="cli for round-trip flight search via headless browser simulation (parallel)",
+        epilog="`findflights serve --help` describes the search daemon used by --daemon",
+    )
+    parser.add_argument(
+        "origin", help="comma separated candidate source airports (e.g. SAN,SNA,LAX)"
+    )
+    parser.add_argument(
+        "destinations",
+        help="comma separated candidate destination airports (e.g. SFO,OAK,SJC)",
+    )
+    parser.add_argument(
+        "--depart", help="outbound date or date range (e.g. 3/7 or 3/7-3/8)"
+    )
+    parser.add_argument(
+        "--return",
+        dest="return_range",
+        help="return date or date range (e.g. 3/9 or 3/9-3/10)",
+    )
+    # new weekend flag - if provided, computes weekend dates automatically
+    parser.add_argument(
+        "--weekend",
+        default=None,
+        help="specify a date (mm/dd or mm/dd/yyyy) for a weekend trip; computes depart as friday/saturday and return as sunday/monday",
+    )
+    parser.add_argument(
+        "--top", type=int, default=5, help="number of top results to show (default 5)"
+    )
+    parser.add_argument(
+        "--sort",
+        choices=["price", "total time"],
+        default="price",
+        help="metric to sort by (default price)",
+    )
+    parser.add_argument(
+        "--exclude",
+        default="",
+        help="comma separated list of airlines to exclude (default none)",
+    )
+    parser.add_argument(
+        "--save-csv",
+        default=None,
+        help="path to save full sorted results as csv (default none)",
+    )
+    parser.add_argument(
+        "--depart-time-range",
+        default=None,
+        help="filter outbound departures within time range, e.g. '08:00-12:00'",
+    )
+    # add --direct flag; filtering by direct flights is on by default
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--direct",
+        dest="direct",
+        action="store_true",
+        help="only show direct flights (default)",
+    )
+    group.add_argument(
+        "--no-direct",
+        dest="direct",
+        action="store_false",
+        help="include flights with stops",
     )
+    parser.set_defaults(direct=True)
+    parser.add_argument(
+        "--same-airports",
+        action="store_true",
+        help="only pair returns that fly from the outbound destination back to its origin",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=5, help="number of threadpool workers (default 5)"
+    )
+    parser.add_argument(
+        "--search-timeout",
+        type=float,
+        default=90,
+        help="give up on a single route/date search after this many seconds (default 90)",
+    )
+    parser.add_argument(
+        "--browsers",
+        type=int,
+        default=2,
+        help="number of browsers in the shared pool (default 2)",
+    )
+    parser.add_argument(
+        "--max-navigations",
+        type=int,
+        default=50,
+        help="recycle a pooled browser after this many searches (default 50, 0 = never)",
+    )
+    parser.add_argument(
+        "--no-block-assets",
+        dest="block_assets",
+        action="store_false",
+        help="let the browser load images, fonts and trackers (blocked by default)",
+    )
+    # fetchers.FETCHERS and lib.PARSER_ENGINES, spelled out so that building
+    # the parser imports neither
+    parser.add_argument(
+        "--fetcher",
+        choices=["auto", "http", "browser"],
+        default="auto",
+        help="search backend: json api over http, headless browser, or http with browser fallback (default auto)",
+    )
+    parser.add_argument(
+        "--base-url",
+        default="https://skiplagged.com",
+        help="site to search, e.g. a local stub server (default https://skiplagged.com)",
+    )
+    parser.add_argument(
+        "--parser",
+        choices=["bs4", "lxml"],
+        default="bs4",
+        help="html parser engine for scraped pages; lxml is faster (default bs4)",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=2,
+        help="workers parsing pages off the event loop, 0 parses inline (default 2)",
+    )
+    parser.add_argument(
+        "--parse-pool",
+        choices=["auto", "process", "thread"],
+        default="auto",
+        help="parse worker type; auto uses threads for lxml, processes for bs4 (default auto)",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--cache",
+        dest="cache",
+        action="store_true",
+        help="answer repeated searches from the on-disk cache (default)",
+    )
+    group.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="always search live and leave the cache untouched",
+    )
+    group.add_argument(
+        "--refresh",
+        action="store_true",
+        help="search live and overwrite the cached results",
+    )
+    parser.set_defaults(cache=True)
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=24,
+        help="hours a cached search stays fresh (default 24)",
+    )
+    parser.add_argument(
+        "--cache-path",
+        default=None,
+        help="cache database (default ~/.cache/findflights/searches.sqlite3)",
+    )
+    parser.add_argument(
+        "--from-store",
+        nargs="?",
+        const="flight_data",
+        default=None,
+        metavar="DATA_DIR",
+        help="answer from the collector's latest data instead of searching live (default dir flight_data)",
+    )
+    parser.add_argument(
+        "--daemon",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="SOCKET",
+        help="send the searches to a running `findflights serve` (default socket $XDG_RUNTIME_DIR/findflights.sock)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print where the time went (stages, searches, parsing, peak memory) after the results",
+    )
+    parser.add_argument(
+        "--profile-out",
+        default=None,
+        metavar="PATH",
+        help="with --profile, also write cProfile stats to PATH, or a Chrome trace if PATH ends in .json",
+    )
+    return parser
 
-    outbound_tasks = []
-    inbound_tasks = []
-    for src in sources:
-        for dest in dests:
-            for d in depart_dates:
-                outbound_tasks.append(fetch_flights_for_page(src, dest, d))
-    for dest in dests:
-        for src in sources:
-            for d in return_dates:
-                inbound_tasks.append(fetch_flights_for_page(dest, src, d))
 
-    total_out = len(outbound_tasks)
-    total_in = len(inbound_tasks)
+args = None
+console = None
+profiler = None
+
+# options that configure searching in this process, by dest; a daemon
+# search uses whatever `findflights serve` was started with instead
+LOCAL_SEARCH_OPTIONS = {
+    "fetcher": "--fetcher",
+    "base_url": "--base-url",
+    "parser": "--parser",
+    "parse_workers": "--parse-workers",
+    "parse_pool": "--parse-pool",
+    "browsers": "--browsers",
+    "max_navigations": "--max-navigations",
+    "block_assets": "--no-block-assets",
+    "cache": "--no-cache",
+    "refresh": "--refresh",
+    "cache_ttl": "--cache-ttl",
+    "cache_path": "--cache-path",
+    "from_store": "--from-store",
+}
+
 
+async def fetch_all(fetcher, sources, dests, depart_dates, return_dates):
+    import asyncio
+
+    from rich.progress import (
+        Progress,
+        SpinnerColumn,
+        BarColumn,
+        TimeRemainingColumn,
+        TextColumn,
+    )
+
+    from lib import iter_tasks
+    from retry import classify
+
+    searches = search_list(sources, dests, depart_dates, return_dates)
+
+    def search(item):
+        _, origin, destination, date = item
+        return fetcher.search(origin, destination, date)
+
+    flights = {"outbound": [], "inbound": []}
     with Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
@@ -162,57 +247,278 @@ async def async_main():
         TimeRemainingColumn(),
         transient=True,
     ) as progress:
-        out_task = progress.add_task("fetching outbound flights...", total=total_out)
-
-        # Process outbound flights in batches to show progress
-        outbound_flights = []
-        for i in range(0, len(outbound_tasks), args.workers):
-            batch = outbound_tasks[i:i+args.workers]
-            try:
-                results = await run_tasks(batch)
-                outbound_flights.extend([flight for flights in results for flight in flights])
-                progress.update(out_task, advance=len(batch))
-            except Exception as exc:
-                console.print(f"[red]outbound task error: {exc}[/red]")
-
-        in_task = progress.add_task("fetching inbound flights...", total=total_in)
-        inbound_flights = []
-
-        # Process inbound flights in batches to show progress
-        for i in range(0, len(inbound_tasks), args.workers):
-            batch = inbound_tasks[i:i+args.workers]
-            try:
-                results = await run_tasks(batch)
-                inbound_flights.extend([flight for flights in results for flight in flights])
-                progress.update(in_task, advance=len(batch))
-            except Exception as exc:
-                console.print(f"[red]inbound task error: {exc}[/red]")
+        bars = {
+            "outbound": progress.add_task(
+                "fetching outbound flights...", total=len(depart_dates) * len(sources) * len(dests)
+            ),
+            "inbound": progress.add_task(
+                "fetching inbound flights...", total=len(return_dates) * len(sources) * len(dests)
+            ),
+        }
+        # keep args.workers searches in flight; each finished search frees
+        # its slot for the next one instead of waiting on a whole batch
+        async for done in iter_tasks(
+            searches, search, workers=args.workers, timeout=args.search_timeout
+        ):
+            direction, origin, destination, date = done.item
+            profiler.search(
+                f"{origin}-{destination} {date}", done.elapsed, classify(done.error, done.result)
+            )
+            if done.error is not None:
+                reason = "timed out" if isinstance(done.error, asyncio.TimeoutError) else done.error
+                console.print(
+                    f"[red]{direction} task error ({origin}->{destination} on {date}): {reason}[/red]"
+                )
+            else:
+                flights[direction].extend(done.result)
+            progress.update(bars[direction], advance=1)
+
+    return flights["outbound"], flights["inbound"]
+
+
+def search_list(sources, dests, depart_dates, return_dates):
+    """``(direction, origin, destination, date)`` for every leg to search"""
+    searches = []
+    for src in sources:
+        for dest in dests:
+            for d in depart_dates:
+                searches.append(("outbound", src, dest, d))
+    for dest in dests:
+        for src in sources:
+            for d in return_dates:
+                searches.append(("inbound", dest, src, d))
+    return searches
+
+
+def search_terms():
+    """``(sources, destinations, excluded airlines)`` from the arguments"""
+    sources = [s.strip().upper() for s in args.origin.split(",")]
+    dests = [d.strip().upper() for d in args.destinations.split(",")]
+    exclude_airlines = (
+        [x.strip().lower() for x in args.exclude.split(",") if x.strip()]
+        if args.exclude
+        else []
+    )
+    return sources, dests, exclude_airlines
+
+
+def check_daemon_options(parser, args):
+    """Refuse options a --daemon search would silently ignore"""
+    if args.daemon is None:
+        return
+    given = [
+        flag
+        for dest, flag in LOCAL_SEARCH_OPTIONS.items()
+        if getattr(args, dest) != parser.get_default(dest)
+    ]
+    if given:
+        parser.error(
+            f"{', '.join(given)} cannot be used with --daemon; the daemon searches with the"
+            " options `findflights serve` was started with"
+        )
+
+
+def search_dates(parser, args):
+    """``(depart dates, return dates)`` from --weekend or --depart/--return"""
+    if args.weekend:
+        try:
+            day = parse_date(args.weekend, default_year=datetime.date.today().year)
+            return weekend_dates(day)
+        except ValueError as e:
+            parser.error(f"error parsing weekend date: {e}")
+    if not args.depart or not args.return_range:
+        parser.error("give --depart and --return, or --weekend")
+    try:
+        return parse_date_range(args.depart), parse_date_range(args.return_range)
+    except ValueError as e:
+        parser.error(f"error parsing date(s): {e}")
+
+
+async def async_main(depart_dates, return_dates):
+    sources, dests, exclude_airlines = search_terms()
+    if args.daemon is not None:
+        # the daemon has its own backend, parser and cache; importing or
+        # setting up ours would only cost startup time
+        await search_daemon(sources, dests, depart_dates, return_dates, exclude_airlines)
+        return
+
+    from cache import SearchCache
+    from fetchers import CachingFetcher, create_fetcher
+    from lib import ParsePool, set_parse_pool, set_parser_engine
+
+    try:
+        set_parser_engine(args.parser)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        sys.exit(1)
+
+    with profiler.stage("setup"):
+        browsers = max(1, min(args.browsers, args.workers))
+        fetcher = create_fetcher(
+            args.fetcher,
+            base_url=args.base_url,
+            connections=args.workers,
+            size=browsers,
+            pages_per_browser=-(-args.workers // browsers),
+            max_navigations=args.max_navigations,
+            block_assets=args.block_assets,
+        )
+        cache = None
+        if args.cache or args.refresh:
+            cache = SearchCache(args.cache_path, ttl=args.cache_ttl * 3600)
+            fetcher = CachingFetcher(fetcher, cache, refresh=args.refresh)
+        parse_pool = (
+            ParsePool(args.parse_workers, kind=args.parse_pool)
+            if args.parse_workers > 0
+            else None
+        )
+        set_parse_pool(parse_pool)
+    try:
+        with profiler.stage("fetch"):
+            async with fetcher:
+                outbound_flights, inbound_flights = await fetch_all(
+                    fetcher, sources, dests, depart_dates, return_dates
+                )
+    finally:
+        set_parse_pool(None)
+        if parse_pool is not None:
+            parse_pool.close()
+        if cache is not None:
+            stats = cache.stats
+            console.print(
+                f"[dim]cache: {stats['hits']} hits, {stats['misses']} misses"
+                f" ({stats['expired']} expired), {stats['stores']} stored[/dim]"
+            )
+            cache.close()
+
+    show_results(outbound_flights, inbound_flights, exclude_airlines)
+
+
+def search_store(depart_dates, return_dates):
+    # lookups take milliseconds, so this path runs without asyncio, a
+    # progress bar or a search backend
+    from store import FlightStore
+
+    sources, dests, exclude_airlines = search_terms()
+    try:
+        store = FlightStore(args.from_store)
+    except FileNotFoundError as e:
+        console.print(f"[red]{e}[/red]")
+        sys.exit(1)
+    flights = {"outbound": [], "inbound": []}
+    with store, profiler.stage("fetch"):
+        store.refresh()
+        for direction, origin, destination, date in search_list(
+            sources, dests, depart_dates, return_dates
+        ):
+            flights[direction].extend(store.search(origin, destination, date))
+    stats = store.stats
+    if stats["missing"]:
+        console.print(
+            f"[yellow]{stats['missing']} route/date searches were never collected[/yellow]"
+        )
+    if stats["empty"]:
+        console.print(
+            f"[yellow]{stats['empty']} route/date searches found no flights when last collected[/yellow]"
+        )
+    if stats["oldest"] is not None:
+        console.print(
+            f"[dim]collected data from {stats['oldest']:%Y-%m-%d %H:%M}"
+            f" to {stats['newest']:%Y-%m-%d %H:%M}[/dim]"
+        )
+    show_results(flights["outbound"], flights["inbound"], exclude_airlines)
+
+
+async def search_daemon(sources, dests, depart_dates, return_dates, exclude_airlines):
+    from daemon import DaemonFetcher, DaemonUnavailable
+
+    fetcher = DaemonFetcher(args.daemon or None)
+    try:
+        with profiler.stage("fetch"):
+            async with fetcher:
+                outbound_flights, inbound_flights = await fetch_all(
+                    fetcher, sources, dests, depart_dates, return_dates
+                )
+    except DaemonUnavailable as e:
+        console.print(f"[red]{e}[/red]")
+        sys.exit(1)
+    show_results(outbound_flights, inbound_flights, exclude_airlines)
+
+
+def show_results(outbound_flights, inbound_flights, exclude_airlines):
+    from flights import filter_legs, pair_flights, print_pairs, save_csv, sort_pairs, top_pairs
 
     if not outbound_flights:
         console.print("[yellow]no outbound flights found[/yellow]")
     if not inbound_flights:
         console.print("[yellow]no inbound flights found[/yellow]")
 
-    all_pairs = pair_flights(outbound_flights, inbound_flights)
-    if exclude_airlines:
-        all_pairs = [
-            p
-            for p in all_pairs
-            if p["out_airline"].lower() not in exclude_airlines
-            and p["in_airline"].lower() not in exclude_airlines
-        ]
+    # the exclude, direct and depart time filters all work per leg, so apply
+    # them before pairing rather than to every pair
+    profiler.count("outbound legs", len(outbound_flights))
+    profiler.count("inbound legs", len(inbound_flights))
+    with profiler.stage("filter"):
+        outbound_flights = filter_legs(
+            outbound_flights, exclude_airlines, args.direct, args.depart_time_range
+        )
+        inbound_flights = filter_legs(inbound_flights, exclude_airlines, args.direct)
+    profiler.count("legs after filtering", f"{len(outbound_flights)} out, {len(inbound_flights)} in")
+    profiler.count("leg combinations", len(outbound_flights) * len(inbound_flights))
 
-    sorted_pairs = display_pairs(all_pairs, args.top, args.sort, args.depart_time_range)
     if args.save_csv:
+        # the csv holds every pair, so build and sort them all
+        with profiler.stage("pair"):
+            pairs = pair_flights(outbound_flights, inbound_flights, same_airports=args.same_airports)
+        profiler.count("pairs", len(pairs))
+        with profiler.stage("sort"):
+            sorted_pairs = sort_pairs(pairs, args.sort)
+        with profiler.stage("display"):
+            print_pairs(sorted_pairs[: args.top])
         try:
-            save_csv(sorted_pairs, args.save_csv)
+            with profiler.stage("save csv"):
+                save_csv(sorted_pairs, args.save_csv)
             console.print(f"[green]saved full results to {args.save_csv}[/green]")
         except Exception as e:
             console.print(f"[red]error saving csv: {e}[/red]")
+    else:
+        with profiler.stage("pair and sort (top)"):
+            best = top_pairs(
+                outbound_flights,
+                inbound_flights,
+                args.top,
+                args.sort,
+                same_airports=args.same_airports,
+            )
+        with profiler.stage("display"):
+            print_pairs(best)
 
 
-def main():
-    asyncio.run(async_main())
+def main(argv=None):
+    global args, console, profiler
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"]:
+        from daemon import main as serve
+
+        serve(argv[1:])
+        return
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    check_daemon_options(parser, args)
+    depart_dates, return_dates = search_dates(parser, args)
+
+    from rich.console import Console
+
+    from profiling import Profiler
+
+    console = Console()
+    profiler = Profiler(args.profile, args.profile_out).start()
+    if args.from_store:
+        search_store(depart_dates, return_dates)
+    else:
+        import asyncio
+
+        asyncio.run(async_main(depart_dates, return_dates))
+    profiler.finish(console)
 
 
 if __name__ == "__main__":
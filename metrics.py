@@ -0,0 +1,251 @@
+"""Prometheus-style metrics for the collector.
+
+The metrics below are module-level and updated in place on the hot path
+(fetchers, the JSONL writer thread, the collector loop). ``render``
+produces the Prometheus text format. The collector writes it to a file
+for node_exporter's textfile collector and can also serve it over HTTP.
+
+Together the histograms show where a slow sweep spends its time: the
+site (navigation, readiness, request time), the browser (settle,
+content), the parser, our own rate limit, or the disk.
+"""
+
+import asyncio
+import bisect
+import os
+import threading
+import time
+from pathlib import Path
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self, extra=()):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, (*extra, *zip(self.labelnames, key)), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        return self.totals(**labels)[0]
+
+    def totals(self, **labels):
+        """``(count, sum)`` of the observations with these labels"""
+        with self._lock:
+            entry = self._values.get(tuple(labels[name] for name in self.labelnames))
+            return (sum(entry[0]), entry[1]) if entry else (0, 0.0)
+
+    def samples(self, extra=()):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = (*extra, *zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, ("le", _number(bound))), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """A set of metrics rendered together; ``labels`` are added to every
+    sample (e.g. the worker name when several collectors export)"""
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        extra = tuple(self.labels.items())
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples(extra):
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write the metrics to ``path`` atomically, for node_exporter's
+        textfile collector"""
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+BROWSER_START_SECONDS = REGISTRY.histogram(
+    "findflights_browser_start_seconds", "Time to launch the browser pool"
+)
+PAGE_PHASE_SECONDS = REGISTRY.histogram(
+    "findflights_page_phase_seconds",
+    "Browser time per results page phase (navigate, ready, settle, content)",
+    labels=("phase",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "findflights_request_seconds", "Search API request time for the http backend"
+)
+RESPONSE_BYTES = REGISTRY.histogram(
+    "findflights_response_bytes",
+    "Size of the fetched results page or API response",
+    labels=("backend",),
+    buckets=BYTES_BUCKETS,
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    "findflights_parse_seconds", "Time to parse a fetched response into flights", labels=("backend",)
+)
+PARSE_WAIT_SECONDS = REGISTRY.histogram(
+    "findflights_parse_wait_seconds", "Time a fetched page waited for a parse pool worker"
+)
+SEARCH_SECONDS = REGISTRY.histogram(
+    "findflights_search_seconds", "Time per search attempt, fetch and parse, excluding rate limiting"
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "findflights_rate_limit_wait_seconds", "Time a search waited for the rate limiter"
+)
+WRITE_SECONDS = REGISTRY.histogram(
+    "findflights_write_seconds", "Time to write and flush a batch of JSONL records"
+)
+SEARCHES = REGISTRY.counter(
+    "findflights_searches_total", "Finished searches by route and outcome", labels=("route", "outcome")
+)
+RETRIES = REGISTRY.counter("findflights_retries_total", "Search attempts that were retried")
+CIRCUIT_TRIPS = REGISTRY.counter(
+    "findflights_circuit_trips_total", "Pauses after repeated blocks", labels=("scope",)
+)
+
+
+class MetricsServer:
+    """Serves ``registry.render()`` over HTTP for Prometheus to scrape"""
+
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            # skip the headers; no request here has a body
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[1].split(b"?")[0] in (b"/", b"/metrics"):
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,170 @@
+"""Pick which route/dates a collection cycle searches.
+
+Every search the collector makes is recorded with its cheapest fare.
+Before the next cycle each candidate route/date is scored:
+
+    staleness * (1 + proximity_weight * proximity + volatility_weight * volatility)
+
+where staleness is the time since it was last searched in units of
+``refresh_hours``, proximity grows as the departure date gets closer, and
+volatility is a moving average of how much its cheapest fare moved
+between searches. Route/dates never searched come first. The cycle
+searches the ``budget`` highest scoring candidates, best first.
+"""
+
+import datetime
+import json
+import sqlite3
+from pathlib import Path
+
+# weight of the newest fare change in the volatility average
+VOLATILITY_ALPHA = 0.3
+
+
+class Plan:
+    """The searches chosen for one cycle and a report on the choice"""
+
+    def __init__(self, items, report):
+        self.items = items
+        self.report = report
+
+    def __len__(self):
+        return len(self.items)
+
+    def write_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report, f, default=str, indent=2)
+
+
+class CollectionPlanner:
+    """Remembers past searches in SQLite and ranks the next cycle's"""
+
+    def __init__(
+        self,
+        path,
+        budget=None,
+        refresh_hours=24,
+        proximity_weight=1.0,
+        volatility_weight=4.0,
+        clock=datetime.datetime.now,
+    ):
+        self.path = Path(path)
+        self.budget = budget
+        self.refresh_hours = refresh_hours
+        self.proximity_weight = proximity_weight
+        self.volatility_weight = volatility_weight
+        self.clock = clock
+        # sharded collectors share this database
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS searches (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                search_date TEXT NOT NULL,
+                last_fetched TEXT NOT NULL,
+                fetches INTEGER NOT NULL,
+                min_cost INTEGER,
+                volatility REAL NOT NULL,
+                PRIMARY KEY (origin, destination, search_date)
+            )"""
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _history(self):
+        rows = self.db.execute(
+            "SELECT origin, destination, search_date, last_fetched, min_cost, volatility FROM searches"
+        )
+        return {
+            (o, d, datetime.date.fromisoformat(day)): (datetime.datetime.fromisoformat(last), cost, vol)
+            for o, d, day, last, cost, vol in rows
+        }
+
+    def score(self, depart_date, last_fetched, volatility, now):
+        staleness = (now - last_fetched).total_seconds() / 3600 / self.refresh_hours
+        days_out = max(0, (depart_date - now.date()).days)
+        proximity = 7 / (7 + days_out)
+        return staleness * (1 + self.proximity_weight * proximity + self.volatility_weight * volatility)
+
+    def plan(self, candidates):
+        """Rank ``(origin, destination, date)`` candidates and keep the
+        budgeted best"""
+        now = self.clock()
+        history = self._history()
+        scored = []
+        new = 0
+        for item in candidates:
+            past = history.get(item)
+            if past is None:
+                new += 1
+                scored.append((float("inf"), item, None))
+                continue
+            last_fetched, _, volatility = past
+            scored.append((self.score(item[2], last_fetched, volatility, now), item, last_fetched))
+        # stable on ties, so equal scores keep the candidates' order
+        scored.sort(key=lambda entry: -entry[0])
+        budget = len(scored) if self.budget is None else max(0, self.budget)
+        chosen, skipped = scored[:budget], scored[budget:]
+
+        def rounded(score):
+            return round(score, 3) if score != float("inf") else "new"
+
+        def age_hours(entries):
+            ages = [(now - last).total_seconds() / 3600 for _, _, last in entries if last is not None]
+            return round(max(ages), 1) if ages else None
+
+        report = {
+            "planned_at": now,
+            "candidates": len(scored),
+            "budget": self.budget,
+            "selected": len(chosen),
+            "never_searched": new,
+            "selected_never_searched": sum(1 for _, _, last in chosen if last is None),
+            "oldest_selected_hours": age_hours(chosen),
+            "oldest_skipped_hours": age_hours(skipped),
+            "lowest_selected_score": rounded(chosen[-1][0]) if chosen else None,
+            "top": [
+                {"origin": o, "destination": d, "date": day, "score": rounded(s)}
+                for s, (o, d, day), _ in chosen[:20]
+            ],
+        }
+        return Plan([item for _, item, _ in chosen], report)
+
+    def record(self, origin, destination, search_date, flights):
+        """Note a completed search and how its cheapest fare moved.
+
+        Pass None for a search that failed: it counts as attempted, so a
+        route that keeps failing does not take the budget every cycle, but
+        its fare history is kept.
+        """
+        costs = [f.cost for f in flights or () if f.cost is not None]
+        cost = min(costs) if costs else None
+        key = (origin, destination, search_date.isoformat())
+        row = self.db.execute(
+            "SELECT fetches, min_cost, volatility FROM searches"
+            " WHERE origin = ? AND destination = ? AND search_date = ?",
+            key,
+        ).fetchone()
+        fetches, volatility = 0, 0.0
+        if row is not None:
+            fetches, previous, volatility = row
+            if flights is None:
+                cost = previous
+            elif previous and cost is not None:
+                change = abs(cost - previous) / previous
+                volatility = VOLATILITY_ALPHA * change + (1 - VOLATILITY_ALPHA) * volatility
+        self.db.execute(
+            "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, self.clock().isoformat(), fetches + 1, cost, volatility),
+        )
+        self.db.commit()
@@ -0,0 +1,184 @@
+"""Where a findflights run spends its time, for ``--profile``.
+
+A Profiler times named stages (wall and CPU seconds), keeps each search's
+timing, and counts things like legs and pairs. Fetch-side detail (browser
+start, page phases, parsing) comes from the histograms in metrics. After
+the results it prints a summary and can write either cProfile stats or a
+Chrome trace-event file (open it in chrome://tracing or Perfetto).
+
+A disabled profiler hands out one shared no-op context manager and drops
+everything else, so leaving the calls in costs next to nothing; cProfile,
+rich and the metrics are only imported once a profile is taken.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+_NOOP = contextlib.nullcontext()
+
+
+def peak_rss_bytes():
+    """The process's peak resident set size, or None where unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    def __init__(self, enabled=False, output=None):
+        self.enabled = enabled or output is not None
+        self.output = output
+        self.stages = []  # (name, start, wall, cpu)
+        self.searches = []  # (label, start, elapsed, outcome)
+        self.counts = {}
+        self._origin = time.perf_counter()
+        self._cprofile = None
+
+    def start(self):
+        """Begin profiling; with a non-.json output, under cProfile too"""
+        if self.output is not None and not str(self.output).endswith(".json"):
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def stage(self, name):
+        """Context manager timing a stage"""
+        if not self.enabled:
+            return _NOOP
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.stages.append(
+                (name, start - self._origin, time.perf_counter() - start, time.process_time() - cpu)
+            )
+
+    def search(self, label, elapsed, outcome):
+        """Record a search that just finished after ``elapsed`` seconds"""
+        if self.enabled:
+            end = time.perf_counter() - self._origin
+            self.searches.append((label, end - elapsed, elapsed, outcome))
+
+    def count(self, name, value):
+        if self.enabled:
+            self.counts[name] = value
+
+    def finish(self, console=None):
+        """Stop profiling, print the summary and write the output file"""
+        if not self.enabled:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if console is None:
+            from rich.console import Console
+
+            console = Console()
+        self.print_summary(console)
+        if self.output is None:
+            return
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(self.output)
+        else:
+            with open(self.output, "w") as f:
+                json.dump(self.trace_events(), f)
+
+    def print_summary(self, console):
+        from rich.table import Table
+
+        from metrics import (
+            BROWSER_START_SECONDS,
+            PAGE_PHASE_SECONDS,
+            PARSE_SECONDS,
+            PARSE_WAIT_SECONDS,
+            REQUEST_SECONDS,
+        )
+
+        table = Table(title="profile", show_header=True, header_style="bold")
+        table.add_column("stage")
+        table.add_column("count", justify="right")
+        table.add_column("wall s", justify="right")
+        table.add_column("cpu s", justify="right")
+        for name, _, wall, cpu in self.stages:
+            table.add_row(name, "1", f"{wall:.3f}", f"{cpu:.3f}")
+
+        # fetch detail, summed over every search (these overlap in time)
+        def add(label, histogram, **labels):
+            count, total = histogram.totals(**labels)
+            if count:
+                table.add_row(f"  {label}", str(count), f"{total:.3f}", "")
+
+        add("browser start", BROWSER_START_SECONDS)
+        for phase in ("navigate", "ready", "settle", "content"):
+            add(f"page {phase}", PAGE_PHASE_SECONDS, phase=phase)
+        add("api request", REQUEST_SECONDS)
+        for backend in ("browser", "http"):
+            add(f"parse ({backend})", PARSE_SECONDS, backend=backend)
+        add("parse pool wait", PARSE_WAIT_SECONDS)
+        console.print(table)
+
+        if self.searches:
+            elapsed = sorted(s[2] for s in self.searches)
+            slowest = max(self.searches, key=lambda s: s[2])
+            outcomes = {}
+            for _, _, _, outcome in self.searches:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            console.print(
+                f"searches: {len(elapsed)} ({', '.join(f'{n} {o}' for o, n in outcomes.items())}),"
+                f" p50 {elapsed[len(elapsed) // 2]:.2f}s,"
+                f" p95 {elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.95))]:.2f}s,"
+                f" slowest {slowest[2]:.2f}s ({slowest[0]})"
+            )
+        if self.counts:
+            console.print(", ".join(f"{name}: {value}" for name, value in self.counts.items()))
+        peak = peak_rss_bytes()
+        if peak is not None:
+            console.print(f"peak rss: {peak / (1 << 20):.1f} MiB")
+
+    def trace_events(self):
+        """Stages on one row and searches on as many rows as ran at once,
+        in the Chrome trace-event format"""
+        pid = os.getpid()
+        events = [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "findflights"}},
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "stages"}},
+        ]
+        for name, start, wall, cpu in self.stages:
+            events.append({
+                "name": name, "ph": "X", "pid": pid, "tid": 0,
+                "ts": start * 1e6, "dur": wall * 1e6, "args": {"cpu_s": round(cpu, 6)},
+            })
+        lanes = []  # end time of the last search on each row
+        for label, start, elapsed, outcome in sorted(self.searches, key=lambda s: s[1]):
+            for lane, end in enumerate(lanes):
+                if end <= start:
+                    break
+            else:
+                lane = len(lanes)
+                lanes.append(0)
+                events.append({
+                    "name": "thread_name", "ph": "M", "pid": pid, "tid": lane + 1,
+                    "args": {"name": f"search slot {lane + 1}"},
+                })
+            lanes[lane] = start + elapsed
+            events.append({
+                "name": label, "ph": "X", "pid": pid, "tid": lane + 1,
+                "ts": start * 1e6, "dur": elapsed * 1e6, "args": {"outcome": outcome},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,155 @@
+"""Token bucket rate limiting for searches.
+
+Callers reserve a token and are told how long to wait for it. The bucket
+is updated before anyone sleeps, so waiters never queue behind a lock and
+each is served in reservation order. A RateLimiter combines a global
+bucket with optional per-destination buckets. In adaptive mode it backs
+off when searches time out or hit a challenge page and ramps back up
+while they succeed.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Refills at ``rate`` tokens per minute up to ``burst`` tokens.
+
+    ``reserve`` always takes a token, letting the balance go negative, and
+    returns the seconds until that token would have existed. Later
+    reservations queue up behind it.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def reserve(self):
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens * 60.0 / self.rate
+
+    def set_rate(self, rate):
+        # settle what accrued at the old rate before switching
+        self._refill()
+        self.rate = float(rate)
+
+
+class RateLimiter:
+    """Global, and optionally per-destination, limits on searches per minute.
+
+    ``per_destination`` is either a rate applied to every destination or a
+    dict of destination -> rate; destinations missing from the dict only
+    obey the global limit. With ``adaptive`` the global rate moves between
+    ``min_rate`` and its configured value: each ``record(key, False)``
+    multiplies it by ``backoff`` and each ``record(key, True)`` adds
+    ``step`` back. Destination rates move in proportion.
+    """
+
+    def __init__(
+        self,
+        rate_limit_per_minute,
+        per_destination=None,
+        adaptive=False,
+        min_rate=None,
+        backoff=0.5,
+        step=1.0,
+        clock=time.monotonic,
+        sleep=asyncio.sleep,
+    ):
+        self.clock = clock
+        self.sleep = sleep
+        self.adaptive = adaptive
+        self.backoff = backoff
+        self.step = step
+        self.min_rate = min_rate if min_rate is not None else max(1.0, rate_limit_per_minute / 10)
+        self.max_rate = rate_limit_per_minute
+        self.bucket = TokenBucket(rate_limit_per_minute, clock=clock)
+        self.per_destination = per_destination
+        self.buckets = {}
+        self.ceilings = {}
+        self.waiting = 0
+        self.metrics = {"acquired": 0, "throttled": 0, "throttle_seconds": 0.0, "backoffs": 0}
+
+    def _destination_bucket(self, key):
+        if key is None or self.per_destination is None:
+            return None
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if isinstance(self.per_destination, dict):
+                rate = self.per_destination.get(key)
+                if rate is None:
+                    return None
+            else:
+                rate = self.per_destination
+            bucket = self.buckets[key] = TokenBucket(rate, clock=self.clock)
+            self.ceilings[key] = rate
+        return bucket
+
+    def reserve(self, key=None):
+        """Take a token from every bucket that applies and return the wait"""
+        wait = self.bucket.reserve()
+        bucket = self._destination_bucket(key)
+        if bucket is not None:
+            wait = max(wait, bucket.reserve())
+        return wait
+
+    async def acquire(self, key=None):
+        """Wait for a token for a search to ``key`` (a destination)"""
+        wait = self.reserve(key)
+        self.metrics["acquired"] += 1
+        if wait > 0:
+            self.metrics["throttled"] += 1
+            self.metrics["throttle_seconds"] += wait
+            self.waiting += 1
+            try:
+                await self.sleep(wait)
+            finally:
+                self.waiting -= 1
+        return wait
+
+    def record(self, key=None, ok=True):
+        """Feed back a search outcome; only used in adaptive mode"""
+        if not self.adaptive:
+            return
+        buckets = [(self.bucket, self.max_rate)]
+        bucket = self._destination_bucket(key)
+        if bucket is not None:
+            buckets.append((bucket, self.ceilings[key]))
+        if not ok:
+            self.metrics["backoffs"] += 1
+        for bucket, ceiling in buckets:
+            # destination buckets bottom out at the same fraction of their
+            # configured rate as the global one
+            floor = self.min_rate * ceiling / self.max_rate
+            if ok:
+                rate = min(ceiling, bucket.rate + self.step * ceiling / self.max_rate)
+            else:
+                rate = max(floor, bucket.rate * self.backoff)
+            if rate != bucket.rate:
+                bucket.set_rate(rate)
+
+    @property
+    def rate(self):
+        """Current global limit in searches per minute"""
+        return self.bucket.rate
+
+    def snapshot(self):
+        return {
+            "rate": self.rate,
+            "queue_depth": self.waiting,
+            **self.metrics,
+            "destination_rates": {key: bucket.rate for key, bucket in self.buckets.items()},
+        }
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Record live skiplagged responses as fixtures for stubsite.py.
+
+    python recorder.py fixtures LAX SFO,OAK --depart 3/7-3/9 [--pages]
+
+Search API responses are saved as ``api/<FROM>-<TO>-<DATE>.json`` and,
+with ``--pages``, rendered results pages as ``pages/<FROM>-<TO>-<DATE>.html``.
+Every response is kept, whatever it was, and described in
+``manifest.json``:
+
+- kind: found, empty, blocked, error (any other HTTP status), timeout
+  (the page never finished loading) or malformed (the site answered with
+  something that does not parse)
+- seconds: how long the live site took, which stubsite.py can replay
+- status, bytes and when it was recorded
+
+Searches run one at a time with a pause between them, to go easy on the
+site.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import time
+from pathlib import Path
+
+from dates import parse_date_range
+from fetchers import (
+    BLOCKED_STATUSES,
+    SEARCH_API_PATH,
+    HttpClient,
+    looks_blocked,
+    parse_search_json,
+    search_params,
+)
+from lib import SKIPLAGGED_URL, BrowserPool, console, parse_flights
+
+
+def _kind(flights, blocked=False, timed_out=False):
+    if blocked:
+        return "blocked"
+    if flights:
+        return "found"
+    return "timeout" if timed_out else "empty"
+
+
+async def record_api(client, origin, destination, day):
+    """``(body, entry)`` for one search api request"""
+    start = time.perf_counter()
+    status, _, body = await client.get(SEARCH_API_PATH, search_params(origin, destination, day))
+    seconds = time.perf_counter() - start
+    if status != 200:
+        kind = "blocked" if status in BLOCKED_STATUSES else "error"
+    else:
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError("not an object")
+            kind = _kind(parse_search_json(data, origin, destination, day))
+        except ValueError:
+            kind = "malformed"
+    return body, {"kind": kind, "status": status, "seconds": round(seconds, 3)}
+
+
+async def record_page(pool, origin, destination, day, base_url):
+    """``(html, entry)`` for one rendered results page"""
+    timings = {}
+    start = time.perf_counter()
+    html = await pool.fetch_flights_page(origin, destination, day, base_url=base_url, timings=timings)
+    seconds = time.perf_counter() - start
+    try:
+        flights = parse_flights(html, origin, destination)
+        kind = _kind(
+            flights,
+            blocked=not flights and looks_blocked(html),
+            timed_out=timings.get("result") in ("timeout", "error"),
+        )
+    except Exception:
+        kind = "malformed"
+    return html.encode("utf-8"), {"kind": kind, "status": 200, "seconds": round(seconds, 3)}
+
+
+async def record(out, searches, base_url, api=True, pages=False, delay=2.0):
+    out = Path(out)
+    manifest_path = out / "manifest.json"
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.is_file() else {}
+    recorders = []
+    client = pool = None
+    if api:
+        (out / "api").mkdir(parents=True, exist_ok=True)
+        client = HttpClient(base_url, max_connections=1)
+        recorders.append(("api", ".json", lambda o, d, day: record_api(client, o, d, day)))
+    if pages:
+        (out / "pages").mkdir(parents=True, exist_ok=True)
+        pool = BrowserPool(size=1, pages_per_browser=1)
+        await pool.start()
+        recorders.append(
+            ("pages", ".html", lambda o, d, day: record_page(pool, o, d, day, base_url))
+        )
+    first = True
+    try:
+        for origin, destination, day in searches:
+            for folder, suffix, run in recorders:
+                if not first:
+                    await asyncio.sleep(delay)
+                first = False
+                name = f"{folder}/{origin}-{destination}-{day.isoformat()}{suffix}"
+                try:
+                    body, entry = await run(origin, destination, day)
+                except Exception as e:
+                    console.print(f"[red]{name}: {e}[/red]")
+                    continue
+                (out / name).write_bytes(body)
+                entry["bytes"] = len(body)
+                entry["recorded"] = datetime.datetime.now().isoformat(timespec="seconds")
+                manifest[name] = entry
+                console.print(f"{name}: {entry['kind']} in {entry['seconds']:.2f}s")
+                # keep what was recorded so far if interrupted
+                manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    finally:
+        if client is not None:
+            await client.close()
+        if pool is not None:
+            await pool.close()
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="record live skiplagged responses as stub fixtures")
+    parser.add_argument("out", help="fixtures directory to write")
+    parser.add_argument("origins", help="comma separated origin airports")
+    parser.add_argument("destinations", help="comma separated destination airports")
+    parser.add_argument("--depart", required=True, help="date or range, e.g. 3/7 or 3/7-3/9")
+    parser.add_argument("--no-api", dest="api", action="store_false", help="skip search api responses")
+    parser.add_argument("--pages", action="store_true", help="also record rendered results pages (needs playwright)")
+    parser.add_argument("--base-url", default=SKIPLAGGED_URL, help="site to record from")
+    parser.add_argument("--delay", type=float, default=2.0, help="seconds between requests (default 2)")
+    args = parser.parse_args()
+
+    origins = [a.strip().upper() for a in args.origins.split(",") if a.strip()]
+    destinations = [a.strip().upper() for a in args.destinations.split(",") if a.strip()]
+    searches = [
+        (o, d, day)
+        for day in parse_date_range(args.depart)
+        for o in origins
+        for d in destinations
+        if o != d
+    ]
+    manifest = asyncio.run(
+        record(args.out, searches, args.base_url, api=args.api, pages=args.pages, delay=args.delay)
+    )
+    kinds = {}
+    for entry in manifest.values():
+        kinds[entry["kind"]] = kinds.get(entry["kind"], 0) + 1
+    console.print(f"{len(manifest)} fixtures in {args.out}: {kinds}")
+
+
+if __name__ == "__main__":
+    main()
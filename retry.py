@@ -0,0 +1,163 @@
+"""Classify search outcomes, retry transient failures, pause on blocks.
+
+Every search ends as one of OUTCOMES:
+
+- found: flights came back
+- empty: the site answered and has no flights for the route/date
+- timeout: the search or the results page did not finish in time
+- blocked: the site refused us (rate limited or a challenge page)
+- error: anything else that went wrong
+
+Timeouts and errors are usually transient, so RetryPolicy tries them
+again after a jittered exponential backoff. Blocks are not: an immediate
+retry only spends another rate limit token on a page we will not get.
+CircuitBreaker pauses a route after repeated blocks on it, and every
+route after repeated blocks across routes.
+"""
+
+import asyncio
+import random
+import time
+
+from fetchers import FetchError
+
+FOUND = "found"
+EMPTY = "empty"
+TIMEOUT = "timeout"
+BLOCKED = "blocked"
+ERROR = "error"
+OUTCOMES = (FOUND, EMPTY, TIMEOUT, BLOCKED, ERROR)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of searching a route the breaker has paused"""
+
+
+def classify(error=None, flights=None):
+    """The outcome of a search that raised ``error`` or returned ``flights``"""
+    if error is None:
+        return FOUND if flights else EMPTY
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, FetchError):
+        if error.blocked:
+            return BLOCKED
+        if error.timed_out:
+            return TIMEOUT
+    return ERROR
+
+
+class RetryPolicy:
+    """Which outcomes to retry, how often, and how long to wait between.
+
+    The wait before retry ``n`` is drawn uniformly from
+    ``[0, min(max_delay, base_delay * 2 ** (n - 1))]`` ("full jitter"), so
+    searches that failed together do not all come back together.
+    """
+
+    def __init__(
+        self,
+        attempts=3,
+        base_delay=2.0,
+        max_delay=60.0,
+        retry_on=(TIMEOUT, ERROR),
+        random=random.random,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.random = random
+
+    def should_retry(self, outcome, attempt):
+        """Whether a search whose ``attempt``-th try ended in ``outcome``
+        gets another"""
+        return outcome in self.retry_on and attempt < self.attempts
+
+    def delay(self, attempt):
+        """Seconds to wait after the ``attempt``-th try failed"""
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+
+class _Circuit:
+    __slots__ = ("blocks", "open_until", "trips")
+
+    def __init__(self):
+        self.blocks = 0
+        self.open_until = 0.0
+        self.trips = 0
+
+
+class CircuitBreaker:
+    """Pauses searching after repeated blocks.
+
+    ``route_blocks`` blocks in a row on one route pause that route, and
+    ``global_blocks`` in a row across all routes pause every route, for
+    ``cooldown`` seconds. The first search after a pause is a probe: if it
+    is blocked too, the pause starts again at twice the length (up to
+    ``max_cooldown``). A found or empty result closes the circuit.
+    Timeouts and errors count neither way.
+    """
+
+    def __init__(
+        self,
+        route_blocks=3,
+        global_blocks=5,
+        cooldown=300.0,
+        max_cooldown=3600.0,
+        clock=time.monotonic,
+    ):
+        self.route_blocks = route_blocks
+        self.global_blocks = global_blocks
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self._routes = {}
+        self._global = _Circuit()
+        self.metrics = {"route_trips": 0, "global_trips": 0}
+
+    def wait(self):
+        """Seconds until every route may be searched again (0 if not paused)"""
+        return max(0.0, self._global.open_until - self.clock())
+
+    def route_open(self, route):
+        """Whether ``route`` is paused"""
+        circuit = self._routes.get(route)
+        return circuit is not None and circuit.open_until > self.clock()
+
+    def record(self, route, outcome):
+        if outcome in (FOUND, EMPTY):
+            # results from searches started before a pause do not end it
+            if not self.route_open(route):
+                self._routes.pop(route, None)
+            if not self.wait():
+                self._global = _Circuit()
+        elif outcome == BLOCKED:
+            circuit = self._routes.setdefault(route, _Circuit())
+            if self._trip(circuit, self.route_blocks):
+                self.metrics["route_trips"] += 1
+            if self._trip(self._global, self.global_blocks):
+                self.metrics["global_trips"] += 1
+
+    def _trip(self, circuit, threshold):
+        if circuit.open_until > self.clock():
+            # a search that started before the pause; already counted
+            return False
+        circuit.blocks += 1
+        if circuit.blocks < threshold:
+            return False
+        circuit.open_until = self.clock() + min(self.max_cooldown, self.cooldown * 2 ** circuit.trips)
+        circuit.trips += 1
+        # half open: one more block re-trips it
+        circuit.blocks = threshold - 1
+        return True
+
+    def snapshot(self):
+        now = self.clock()
+        return {
+            "paused_for": round(self.wait(), 1),
+            "paused_routes": sorted(
+                f"{src}-{dst}" for (src, dst), c in self._routes.items() if c.open_until > now
+            ),
+            **self.metrics,
+        }
@@ -0,0 +1,218 @@
+"""Query collected flights without searching live.
+
+The collector's ``flights_YYYY-MM-DD.jsonl`` files are indexed into a
+SQLite database next to them, keyed by the route that was searched (a
+flight's own airports can be nearby ones), searched date and collection
+time. The collector follows each search's flights with a
+``search_marker`` line, so a search that found nothing in the latest
+collection answers as empty rather than with an older collection's fares.
+
+Files are append-only, so reopening the store only indexes lines added
+since the last run. A file that was replaced or cut back (a resumed
+collection truncates its output) is recognised by its inode and a
+checksum of the bytes before the indexed offset, and indexed again from
+the start.
+"""
+
+import datetime
+import json
+import sqlite3
+import zlib
+from pathlib import Path
+
+from flights import Flight
+
+DEFAULT_DATA_DIR = Path("flight_data")
+INDEX_NAME = "index.sqlite3"
+INDEX_VERSION = 3
+# how much of a file, just before the indexed offset, identifies it
+TAIL_BYTES = 4096
+
+
+def search_marker(src, dst, search_date, log_date, flights):
+    """The line the collector writes after a search's ``flights`` records"""
+    return {
+        "searched": flights,
+        "src": src,
+        "dst": dst,
+        "search_date": search_date.isoformat(),
+        "log_date": log_date.isoformat(),
+    }
+
+
+def _tail_digest(path, offset):
+    with open(path, "rb") as f:
+        start = max(0, offset - TAIL_BYTES)
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+
+class FlightStore:
+    """Route/date index over a directory of collector output"""
+
+    def __init__(self, data_dir=DEFAULT_DATA_DIR, index_path=None):
+        self.data_dir = Path(data_dir)
+        if not self.data_dir.is_dir():
+            raise FileNotFoundError(f"no collected data in {self.data_dir}")
+        self.index_path = Path(index_path) if index_path else self.data_dir / INDEX_NAME
+        self.stats = {"found": 0, "empty": 0, "missing": 0, "oldest": None, "newest": None}
+        self.db = sqlite3.connect(self.index_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+            # everything here is rebuilt from the data files
+            self.db.executescript(
+                "DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS flights;"
+                " DROP TABLE IF EXISTS searches;"
+            )
+            self.db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                tail INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS flights (
+                file TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                search_date TEXT NOT NULL,
+                log_date TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS flights_route
+                ON flights (origin, destination, search_date, log_date);
+            CREATE TABLE IF NOT EXISTS searches (
+                file TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                search_date TEXT NOT NULL,
+                log_date TEXT NOT NULL,
+                flights INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS searches_route
+                ON searches (origin, destination, search_date, log_date);
+            """
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def refresh(self):
+        """Index lines appended to the data files since the last refresh;
+        returns how many flights were added"""
+        indexed = {
+            name: (offset, inode, tail)
+            for name, offset, inode, tail in self.db.execute("SELECT * FROM files")
+        }
+        added = 0
+        for path in sorted(self.data_dir.glob("flights_*.jsonl")):
+            offset, inode, tail = indexed.get(path.name, (0, None, None))
+            stat = path.stat()
+            if offset and (
+                stat.st_ino != inode
+                or stat.st_size < offset
+                or _tail_digest(path, offset) != tail
+            ):
+                # replaced, or cut back and written again past where we
+                # stopped; drop what came from it and start over
+                with self.db:
+                    self.db.execute("DELETE FROM flights WHERE file = ?", (path.name,))
+                    self.db.execute("DELETE FROM searches WHERE file = ?", (path.name,))
+                offset = 0
+            if stat.st_size == offset:
+                continue
+            added += self._index_file(path, offset, stat.st_ino)
+        return added
+
+    def _index_file(self, path, offset, inode):
+        rows = []
+        searches = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # a line the collector is still writing
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                    if "searched" in record:
+                        searches.append((
+                            path.name,
+                            record["src"],
+                            record["dst"],
+                            record["search_date"],
+                            record["log_date"],
+                            record["searched"],
+                        ))
+                        continue
+                    rows.append((
+                        path.name,
+                        # older output has no src/dst
+                        record.get("src") or record["from"],
+                        record.get("dst") or record["to"],
+                        record.get("search_date") or record["depart"],
+                        record.get("log_date", ""),
+                        line.decode("utf-8").rstrip("\n"),
+                    ))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        with self.db:
+            self.db.executemany("INSERT INTO flights VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.db.executemany("INSERT INTO searches VALUES (?, ?, ?, ?, ?, ?)", searches)
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path.name, offset, inode, _tail_digest(path, offset)),
+            )
+        return len(rows)
+
+    def latest(self, origin, destination, search_date):
+        """``(log_date, flights)`` from the newest collection of this search,
+        with no flights if that collection found none, or ``(None, [])`` if
+        it was never collected"""
+        key = (origin.upper(), destination.upper(), search_date.isoformat())
+        # output from before search markers only has its flights to go by
+        row = self.db.execute(
+            "SELECT MAX(log_date) FROM ("
+            " SELECT log_date FROM searches WHERE origin = ? AND destination = ? AND search_date = ?"
+            " UNION ALL"
+            " SELECT log_date FROM flights WHERE origin = ? AND destination = ? AND search_date = ?)",
+            key + key,
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None, []
+        log_date = row[0]
+        records = self.db.execute(
+            "SELECT record FROM flights"
+            " WHERE origin = ? AND destination = ? AND search_date = ? AND log_date = ?",
+            (*key, log_date),
+        )
+        return log_date, [Flight.from_dict(json.loads(r)) for (r,) in records]
+
+    def search(self, origin, destination, depart_date):
+        """The latest collected flights for a search, [] if it was never
+        collected or the latest collection found none; counted in ``stats``"""
+        log_date, flights = self.latest(origin, destination, depart_date)
+        if log_date is None:
+            self.stats["missing"] += 1
+            return []
+        self.stats["found" if flights else "empty"] += 1
+        collected = datetime.datetime.fromisoformat(log_date) if log_date else None
+        if collected is not None:
+            if self.stats["oldest"] is None or collected < self.stats["oldest"]:
+                self.stats["oldest"] = collected
+            if self.stats["newest"] is None or collected > self.stats["newest"]:
+                self.stats["newest"] = collected
+        return flights
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM flights").fetchone()[0]
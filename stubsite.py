@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Local stand-in for skiplagged that serves recorded responses.
+
+Fixtures live under one directory:
+
+    <fixtures>/api/<FROM>-<TO>-<YYYY-MM-DD>.json   search api responses
+    <fixtures>/pages/<FROM>-<TO>-<YYYY-MM-DD>.html results pages
+
+Point the CLI or collector at it with ``--base-url http://127.0.0.1:<port>``.
+
+Responses can be slowed down (a fixed latency plus jitter, or the latency
+recorder.py measured on the live site) and a share of them replaced by
+failures: server errors, 429 blocks, challenge pages, truncated bodies,
+dropped connections and hangs. The random choices are seeded, so a run
+can be repeated exactly.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+CHALLENGE_PAGE = b"""<!DOCTYPE html>
+<html><head><title>Just a moment...</title></head>
+<body><div id="cf-challenge">Verify you are human</div></body></html>"""
+
+
+class Faults:
+    """Latency and failure injection for the stub.
+
+    Each ``*_rate`` is the share of requests that fail that way:
+
+    - error: HTTP 500
+    - block: HTTP 429
+    - challenge: a 200 bot-check page
+    - malformed: the first half of the real body
+    - drop: the connection closes with no response
+    - hang: ``hang_seconds`` of silence before the real response
+    """
+
+    KINDS = ("error", "block", "challenge", "malformed", "drop", "hang")
+
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        replay_latency=False,
+        hang_seconds=60.0,
+        seed=0,
+        **rates,
+    ):
+        unknown = set(rates) - {f"{kind}_rate" for kind in self.KINDS}
+        if unknown:
+            raise TypeError(f"unknown fault rates: {', '.join(sorted(unknown))}")
+        self.latency = latency
+        self.jitter = jitter
+        self.replay_latency = replay_latency
+        self.hang_seconds = hang_seconds
+        self.rates = {kind: rates.get(f"{kind}_rate", 0.0) for kind in self.KINDS}
+        if sum(self.rates.values()) > 1:
+            raise ValueError("fault rates add up to more than 1")
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """``(delay seconds, fault kind or None)`` for the next request"""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+        for kind, rate in self.rates.items():
+            if roll < rate:
+                return delay, kind
+            roll -= rate
+        return delay, None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/api/search.php":
+            query = urllib.parse.parse_qs(url.query)
+            key = "-".join(
+                query.get(name, [""])[0] for name in ("from", "to", "depart")
+            )
+            self.serve_fixture(Path("api") / f"{key}.json", "application/json")
+            return
+        parts = url.path.strip("/").split("/")
+        if len(parts) == 4 and parts[0] == "flights":
+            key = "-".join(parts[1:])
+            self.serve_fixture(Path("pages") / f"{key}.html", "text/html; charset=utf-8")
+            return
+        self.send_body(404, b"not found", "text/plain")
+
+    def serve_fixture(self, relative, content_type):
+        server = self.server
+        path = server.fixtures / relative
+        if not path.is_file():
+            self.send_body(404, b"no recorded response", "text/plain")
+            return
+        delay, fault = server.faults.draw()
+        if server.faults.replay_latency:
+            delay += server.manifest.get(relative.as_posix(), {}).get("seconds", 0.0)
+        server.count(fault or "ok")
+        if fault == "hang":
+            delay += server.faults.hang_seconds
+        if delay:
+            time.sleep(delay)
+        if fault == "drop":
+            self.close_connection = True
+            return
+        if fault == "error":
+            self.send_body(500, b"internal server error", "text/plain")
+        elif fault == "block":
+            self.send_body(429, b"too many requests", "text/plain")
+        elif fault == "challenge":
+            self.send_body(200, CHALLENGE_PAGE, "text/html; charset=utf-8")
+        else:
+            body = path.read_bytes()
+            if fault == "malformed":
+                body = body[: len(body) // 2]
+            self.send_body(200, body, content_type)
+
+    def send_body(self, status, body, content_type):
+        encoding = None
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            encoding = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixtures, host="127.0.0.1", port=0, verbose=False, faults=None):
+        super().__init__((host, port), StubHandler)
+        self.fixtures = Path(fixtures)
+        self.verbose = verbose
+        self.faults = faults or Faults()
+        # what recorder.py saw on the live site for each fixture
+        manifest = self.fixtures / "manifest.json"
+        self.manifest = json.loads(manifest.read_text()) if manifest.is_file() else {}
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def count(self, outcome):
+        with self._stats_lock:
+            self.stats[outcome] = self.stats.get(outcome, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve recorded skiplagged responses locally")
+    parser.add_argument("fixtures", help="directory containing api/ and pages/ fixtures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(
+        args.fixtures, args.host, args.port, verbose=args.verbose, faults=faults_from_args(args)
+    )
+    print(f"serving {args.fixtures} at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"responses: {server.stats}")
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument(
+        "--replay-latency",
+        action="store_true",
+        help="also add the latency recorded in the fixtures' manifest.json",
+    )
+    answers = {
+        "error": "HTTP 500",
+        "block": "HTTP 429",
+        "challenge": "a bot-check page",
+        "malformed": "a truncated body",
+        "drop": "a closed connection",
+        "hang": "a response after --hang-seconds",
+    }
+    for kind in Faults.KINDS:
+        parser.add_argument(
+            f"--{kind}-rate",
+            type=float,
+            default=0.0,
+            help=f"share of requests answered with {answers[kind]} (default 0)",
+        )
+    parser.add_argument("--hang-seconds", type=float, default=60.0, help="how long a hang lasts (default 60)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for latency and faults (default 0)")
+
+
+def faults_from_args(args):
+    return Faults(
+        latency=args.latency,
+        jitter=args.jitter,
+        replay_latency=args.replay_latency,
+        hang_seconds=args.hang_seconds,
+        seed=args.seed,
+        **{f"{kind}_rate": getattr(args, f"{kind}_rate") for kind in Faults.KINDS},
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import asyncio
+import datetime
+
+from cache import SearchCache
+from fetchers import CachingFetcher, Fetcher, cache_backend
+from lib import SKIPLAGGED_URL, Flight
+
+DAY = datetime.date(2026, 3, 6)
+
+
+class SiteFetcher(Fetcher):
+    """Returns one flight priced by the site it was pointed at"""
+
+    name = "http"
+
+    def __init__(self, base_url, cost):
+        self.base_url = base_url
+        self.cost = cost
+        self.searches = 0
+
+    async def search(self, origin, destination, depart_date):
+        self.searches += 1
+        return [Flight(origin, destination, depart_date, cost=self.cost)]
+
+
+def search(fetcher, cache):
+    async def run():
+        async with CachingFetcher(fetcher, cache) as caching:
+            return await caching.search("LAX", "SFO", DAY)
+
+    return [f.cost for f in asyncio.run(run())]
+
+
+def test_base_urls_do_not_share_entries(tmp_path):
+    with SearchCache(tmp_path / "cache.sqlite3") as cache:
+        stub = SiteFetcher("http://127.0.0.1:8765", cost=100)
+        live = SiteFetcher(SKIPLAGGED_URL, cost=25000)
+        assert search(stub, cache) == [100]
+        assert search(live, cache) == [25000]
+        assert live.searches == 1
+        # each site is answered from its own entry
+        assert search(stub, cache) == [100]
+        assert search(live, cache) == [25000]
+        assert stub.searches == live.searches == 1
+        assert len(cache) == 2
+
+
+def test_skiplagged_keys_are_the_backend_name():
+    assert cache_backend(SiteFetcher(SKIPLAGGED_URL + "/", 0)) == "http"
+    assert cache_backend(SiteFetcher("http://127.0.0.1:8765/", 0)) == "http@http://127.0.0.1:8765"
@@ -0,0 +1,41 @@
+import datetime
+import json
+
+from coordinator import WorkQueue, merge_shards
+
+DAY = datetime.date(2026, 3, 6)
+LOG_DATE = datetime.datetime(2026, 2, 1, 10)
+
+
+def record(origin, destination, cost):
+    return {
+        "from": origin,
+        "to": destination,
+        "src": "LAX",
+        "dst": "SFO",
+        "depart": DAY.isoformat(),
+        "cost": cost,
+        "log_date": LOG_DATE.isoformat(),
+        "search_date": DAY.isoformat(),
+    }
+
+
+def test_merge_keeps_nearby_airport_flights_of_the_credited_worker(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3")
+    run = queue.open_run(LOG_DATE, datetime.timedelta(hours=24), lambda: [("LAX", "SFO", DAY)])
+    shards = {}
+    for worker, cost in (("w1", 100), ("w2", 200)):
+        shards[worker] = tmp_path / f"shard.{worker}.jsonl"
+        shards[worker].write_text(
+            "".join(json.dumps(r) + "\n" for r in (record("LAX", "SFO", cost), record("BUR", "OAK", cost)))
+        )
+        queue.register_shard(run.id, worker, shards[worker])
+    # w2's lease expired and w1 finished the search
+    assert queue.claim(run.id, "w1") == ("LAX", "SFO", DAY)
+    queue.complete(run.id, "w1", [("LAX", "SFO", DAY)])
+
+    output = tmp_path / "flights_2026-02-01.jsonl"
+    assert merge_shards(queue, run.id, output) == 2
+    merged = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted((r["from"], r["cost"]) for r in merged) == [("BUR", 100), ("LAX", 100)]
+    queue.close()
@@ -0,0 +1,70 @@
+import datetime
+import json
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from history import ParquetSink, compact_jsonl, dataset, run_name  # noqa: E402
+from store import search_marker  # noqa: E402
+
+DAY = datetime.date(2026, 3, 6)
+RUNS = [datetime.datetime(2026, 2, 1, 10), datetime.datetime(2026, 2, 1, 22)]
+
+
+def records(log_date):
+    return [
+        {
+            "from": "SFO",
+            "to": dst,
+            "depart": "2026-03-06",
+            "dep_time": "08:00",
+            "arr_time": "09:30",
+            "duration": "1h 30m",
+            "cost": cost,
+            "airline": "United",
+            "stops": "nonstop",
+            "log_date": log_date.isoformat(),
+            "search_date": "2026-03-06",
+        }
+        for dst in ("LAX", "SAN")
+        for cost in (9900, 12900)
+    ]
+
+
+@pytest.fixture
+def jsonl(tmp_path):
+    path = tmp_path / "flights_2026-02-01.jsonl"
+    with open(path, "w") as f:
+        for log_date in RUNS:
+            for record in records(log_date):
+                f.write(json.dumps(record) + "\n")
+            # the collector's search markers are not flights
+            f.write(json.dumps(search_marker("SFO", "LAX", DAY, log_date, 2)) + "\n")
+    return path
+
+
+def test_compacting_twice_adds_nothing(tmp_path, jsonl):
+    root = tmp_path / "history"
+    assert compact_jsonl([jsonl], root) == (8, 0)
+    assert dataset(root).count_rows() == 8
+    assert compact_jsonl([jsonl], root, batch_rows=3) == (8, 0)
+    assert dataset(root).count_rows() == 8
+
+
+def test_compacting_replaces_what_the_collector_wrote(tmp_path, jsonl):
+    root = tmp_path / "history"
+    with ParquetSink(root, name=run_name(RUNS[0])) as sink:
+        sink.write_many(records(RUNS[0]))
+    assert dataset(root).count_rows() == 4
+    compact_jsonl([jsonl], root)
+    assert dataset(root).count_rows() == 8
+
+
+def test_a_run_split_across_files_is_kept_whole(tmp_path, jsonl):
+    root = tmp_path / "history"
+    shard = tmp_path / "flights_2026-02-01.w2.jsonl"
+    shard.write_text("".join(json.dumps(r) + "\n" for r in records(RUNS[0])))
+    for _ in range(2):
+        assert compact_jsonl([jsonl, shard], root) == (12, 0)
+        assert dataset(root).count_rows() == 12
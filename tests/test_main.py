@@ -0,0 +1,29 @@
+import pytest
+
+import lib
+import main
+
+SEARCH = ["LAX", "SFO", "--weekend", "3/6"]
+
+
+def test_daemon_refuses_options_it_would_ignore(capsys):
+    with pytest.raises(SystemExit) as exit:
+        main.main([*SEARCH, "--daemon", "--fetcher", "http", "--no-cache"])
+    assert exit.value.code == 2
+    error = capsys.readouterr().err
+    assert "--fetcher, --no-cache cannot be used with --daemon" in error
+
+
+def test_daemon_searches_skip_local_setup(monkeypatch):
+    searched = []
+
+    async def search_daemon(sources, dests, depart_dates, return_dates, exclude_airlines):
+        searched.append((sources, dests))
+
+    def set_parser_engine(name):
+        raise AssertionError("the daemon parses, not this process")
+
+    monkeypatch.setattr(main, "search_daemon", search_daemon)
+    monkeypatch.setattr(lib, "set_parser_engine", set_parser_engine)
+    main.main([*SEARCH, "--daemon", "--workers", "8"])
+    assert searched == [(["LAX"], ["SFO"])]
@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+import lib
+
+
+def slow_parse(html, origin, destination, engine=None):
+    time.sleep(0.2)
+    return [html]
+
+
+def test_parse_time_excludes_waiting_for_a_worker(monkeypatch):
+    monkeypatch.setattr(lib, "parse_flights", slow_parse)
+    pool = lib.ParsePool(1, kind="thread")
+
+    async def run():
+        return await asyncio.gather(*(pool.parse(page, "LAX", "SFO") for page in ("a", "b")))
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        pool.close()
+    assert [flights for flights, _ in results] == [["a"], ["b"]]
+    # the second page queued behind the first, but parsed no slower
+    assert all(0.15 < seconds < 0.35 for _, seconds in results)
+    assert pool.stats["parse_seconds"] < 0.6
+    assert pool.stats["wait_seconds"] > 0.15
@@ -0,0 +1,73 @@
+import datetime
+import json
+
+from store import FlightStore, search_marker
+
+DAY = datetime.date(2026, 3, 6)
+RUN = "2026-02-01T10:00:00"
+
+
+def flight(src, dst, origin, destination, cost, log_date=RUN):
+    return {
+        "from": origin,
+        "to": destination,
+        "src": src,
+        "dst": dst,
+        "depart": DAY.isoformat(),
+        "dep_time": "08:00",
+        "arr_time": "09:30",
+        "duration": "1h 30m",
+        "cost": cost,
+        "airline": "United",
+        "stops": "nonstop",
+        "log_date": log_date,
+        "search_date": DAY.isoformat(),
+    }
+
+
+def write(path, records):
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_flights_are_filed_under_the_searched_route(tmp_path):
+    write(tmp_path / "flights_2026-02-01.jsonl", [
+        flight("LAX", "SFO", "LAX", "SFO", 9900),
+        # a nearby airport the site offered for the same search
+        flight("LAX", "SFO", "BUR", "OAK", 8900),
+    ])
+    with FlightStore(tmp_path) as store:
+        store.refresh()
+        log_date, flights = store.latest("lax", "sfo", DAY)
+        assert log_date == RUN
+        assert sorted((f.origin, f.destination) for f in flights) == [("BUR", "OAK"), ("LAX", "SFO")]
+        assert store.latest("BUR", "OAK", DAY) == (None, [])
+
+
+def test_output_without_a_searched_route_uses_the_flight_airports(tmp_path):
+    record = flight("LAX", "SFO", "LAX", "SFO", 9900)
+    del record["src"], record["dst"]
+    write(tmp_path / "flights_2026-02-01.jsonl", [record])
+    with FlightStore(tmp_path) as store:
+        store.refresh()
+        assert [f.cost for f in store.latest("LAX", "SFO", DAY)[1]] == [9900]
+
+
+def test_an_empty_latest_collection_answers_empty(tmp_path):
+    first = datetime.datetime(2026, 2, 1, 10)
+    second = datetime.datetime(2026, 2, 2, 10)
+    write(tmp_path / "flights_2026-02-01.jsonl", [
+        flight("LAX", "SFO", "LAX", "SFO", 9900, first.isoformat()),
+        search_marker("LAX", "SFO", DAY, first, 1),
+    ])
+    with FlightStore(tmp_path) as store:
+        store.refresh()
+        assert [f.cost for f in store.search("LAX", "SFO", DAY)] == [9900]
+        write(tmp_path / "flights_2026-02-02.jsonl", [search_marker("LAX", "SFO", DAY, second, 0)])
+        store.refresh()
+        assert store.latest("LAX", "SFO", DAY) == (second.isoformat(), [])
+        assert store.search("LAX", "SFO", DAY) == []
+        assert store.search("LAX", "OAK", DAY) == []
+        assert (store.stats["found"], store.stats["empty"], store.stats["missing"]) == (1, 1, 1)
+        assert len(store) == 1
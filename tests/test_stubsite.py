@@ -0,0 +1,85 @@
+import asyncio
+import datetime
+import json
+
+import pytest
+
+from fetchers import FetchError, create_fetcher
+from stubsite import StubServer
+
+DAY = datetime.date(2026, 3, 6)
+
+RESPONSE = {
+    "airlines": {"UA": {"name": "United"}, "AS": {"name": "Alaska Airlines"}},
+    "flights": {
+        "direct": {
+            "segments": [{
+                "airline": "UA",
+                "flight_number": 1234,
+                "departure": {"airport": "LAX", "time": "2026-03-06T08:00:00"},
+                "arrival": {"airport": "SFO", "time": "2026-03-06T09:30:00"},
+            }],
+            "duration": 5400,
+        },
+        "via-sjc": {
+            "segments": [
+                {
+                    "airline": "AS",
+                    "flight_number": 10,
+                    "departure": {"airport": "LAX", "time": "2026-03-06T18:00:00"},
+                    "arrival": {"airport": "SJC", "time": "2026-03-06T19:10:00"},
+                },
+                {
+                    "airline": "UA",
+                    "flight_number": 20,
+                    "departure": {"airport": "SJC", "time": "2026-03-06T20:00:00"},
+                    "arrival": {"airport": "SFO", "time": "2026-03-06T20:45:00"},
+                },
+            ],
+        },
+    },
+    "itineraries": {
+        "outbound": [
+            {"flight": "direct", "one_way_price": 9900},
+            {"flight": "via-sjc", "one_way_price": 15900},
+        ]
+    },
+}
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "api").mkdir()
+    (tmp_path / "api" / f"LAX-SFO-{DAY.isoformat()}.json").write_text(json.dumps(RESPONSE))
+    server = StubServer(tmp_path)
+    server.start_in_thread()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def search(server, origin, destination):
+    async def run():
+        async with create_fetcher("http", base_url=server.base_url) as fetcher:
+            return await fetcher.search(origin, destination, DAY)
+
+    return asyncio.run(run())
+
+
+def test_http_fetcher_parses_the_stub_response(server):
+    flights = search(server, "LAX", "SFO")
+    assert [
+        (f.origin, f.destination, f.depart, f.dep_time, f.arr_time, f.duration, f.cost, f.airline, f.stops)
+        for f in flights
+    ] == [
+        ("LAX", "SFO", DAY, "08:00", "09:30", "1h 30m", 9900, "United", "nonstop"),
+        ("LAX", "SFO", DAY, "18:00", "20:45", "2h 45m", 15900, "Alaska Airlines, United", "1 stop"),
+    ]
+    assert flights[1].intermediate_airports == ("SJC",)
+    assert flights[1].flight_numbers == ("10", "20")
+    assert server.stats == {"ok": 1}
+
+
+def test_unrecorded_routes_are_fetch_errors(server):
+    with pytest.raises(FetchError):
+        search(server, "LAX", "OAK")
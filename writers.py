@@ -0,0 +1,184 @@
+"""Output writers for the collector.
+
+JsonlWriter keeps one file open and appends records from a background
+thread in batches. StatusFile rewrites a small json status document at
+most once per interval, atomically.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from metrics import WRITE_SECONDS
+
+_CLOSE = object()
+
+
+class _Marker:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class JsonlWriter:
+    """Appends json lines to ``path`` from a background thread.
+
+    Records are serialized and buffered by the thread and written once
+    ``flush_lines`` lines or ``flush_bytes`` bytes are pending, or
+    ``flush_interval`` seconds after the oldest pending one arrived.
+    ``flush`` and ``close`` wait until everything queued so far is on
+    disk. An error in the thread is raised by the next call.
+
+    ``write_many`` can queue a marker after its records. Once those records
+    are written, ``on_written`` is called from the thread with a list of
+    ``(marker, offset)``, where offset is the file size just past the
+    marker's records.
+    """
+
+    def __init__(
+        self, path, flush_lines=1000, flush_bytes=1 << 20, flush_interval=5.0, on_written=None
+    ):
+        self.path = Path(path)
+        self.flush_lines = flush_lines
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.on_written = on_written
+        self.stats = {"records": 0, "bytes": 0, "flushes": 0}
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._closed = False
+        self._position = self.path.stat().st_size if self.path.exists() else 0
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError("write to closed JsonlWriter")
+
+    def write(self, record):
+        self._check()
+        self._queue.put(record)
+
+    def write_many(self, records, marker=None):
+        self._check()
+        for record in records:
+            self._queue.put(record)
+        if marker is not None:
+            self._queue.put(_Marker(marker))
+
+    def flush(self):
+        """Block until every record written so far is on disk"""
+        self._check()
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        self._check()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        lines = []
+        size = 0
+        deadline = None
+        markers = []
+
+        def write_out():
+            nonlocal lines, size, deadline, markers
+            if lines:
+                with WRITE_SECONDS.time():
+                    self._file.write("".join(lines))
+                    self._file.flush()
+                self._position += size
+                self.stats["records"] += len(lines)
+                self.stats["bytes"] += size
+                self.stats["flushes"] += 1
+            lines, size, deadline = [], 0, None
+            if markers:
+                written, markers = markers, []
+                self.on_written(written)
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            try:
+                if item is None:
+                    write_out()
+                elif item is _CLOSE:
+                    write_out()
+                    return
+                elif isinstance(item, threading.Event):
+                    write_out()
+                    item.set()
+                elif isinstance(item, _Marker):
+                    if self.on_written is not None:
+                        markers.append((item.value, self._position + size))
+                        if not lines:
+                            write_out()
+                else:
+                    # json.dumps escapes non-ascii, so characters are bytes
+                    line = json.dumps(item) + "\n"
+                    lines.append(line)
+                    size += len(line)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if len(lines) >= self.flush_lines or size >= self.flush_bytes:
+                        write_out()
+            except Exception as e:
+                # keep draining so flush/close never hang, but stop writing
+                self._error = self._error or e
+                lines, size, deadline, markers = [], 0, None, []
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is _CLOSE:
+                    return
+
+
+class StatusFile:
+    """Writes a json snapshot at most every ``interval`` seconds.
+
+    Snapshots go to a temporary file that is renamed over ``path``, so a
+    reader never sees a half-written document.
+    """
+
+    def __init__(self, path, interval=5.0, clock=time.monotonic):
+        self.path = Path(path)
+        self.interval = interval
+        self.clock = clock
+        self.last_write = None
+
+    def save(self, data, force=False):
+        """Write ``data`` unless a snapshot was written less than an interval
+        ago; returns whether it wrote"""
+        now = self.clock()
+        if not force and self.last_write is not None and now - self.last_write < self.interval:
+            return False
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f, default=str, indent=2)
+        os.replace(tmp, self.path)
+        self.last_write = now
+        return True